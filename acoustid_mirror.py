@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local, read-only mirror of Acoustid fingerprint to recording mappings, built
+from our own past resolutions (see `fingerprint_index`) and imported dumps.
+`AcoustidMirror.lookup()` returns responses shaped like the ones of
+`acoustid.lookup()`.
+The mirror is a single file which is memory mapped, so opening it is cheap and
+any number of worker processes share its pages. Rebuilding it replaces the
+file atomically, processes which have the old one open keep using it.
+File layout (little endian): 8 byte magic, uint64 bucket count, uint64 record
+count, the sorted uint64 LSH bucket keys, the uint32 record number of each
+bucket key (padded to 8 bytes), uint64 offsets of the records and their UTF-8
+JSON data. Requires NumPy.
+"""
+import os, json, mmap, struct, tempfile
+from collections import defaultdict
+
+import numpy
+
+from fingerprint_index import decode_fingerprint, get_bucket_keys, get_query_bucket_keys, \
+    bit_error_rate
+
+MAGIC = b'MP3TFAM2'
+_HEADER = struct.Struct( '<8sQQ' )
+
+_CANDIDATE_LIMIT = 20
+# Buckets holding more records than this are only partially scanned, they
+# come from very common sub-fingerprints (like silence) and don't tell much
+_BUCKET_SCAN_LIMIT = 1000
+
+# Differences in duration (in seconds) above this rule a record out
+MAX_DURATION_DIFFERENCE = 7
+
+
+def _get_recordings( track_name, track_id, artist_name, artist_id ):
+    return [{
+        'id': track_id,
+        'title': track_name,
+        'artists': [{'id': artist_id, 'name': artist_name}]
+    }]
+
+
+def records_from_fingerprint_index( index ):
+    """
+    Yields mirror records for all fingerprints in the
+    `fingerprint_index.FingerprintIndex` `index` which have a match
+    """
+    for row in index.connection.execute(
+            'SELECT * FROM fingerprints WHERE track_id IS NOT NULL' ):
+        yield {
+            'fingerprint': row['fingerprint'],
+            'duration': row['duration'],
+            'recordings': _get_recordings(  row['track_name'], row['track_id'],
+                                            row['artist_name'], row['artist_id'] )
+        }
+
+
+def records_from_dump( absolute_path_to_dump ):
+    """
+    Yields mirror records from a dump file, containing one JSON object per
+    line with a 'fingerprint' (as printed by fpcalc), a 'duration' in seconds
+    and 'recordings' shaped like the ones in Acoustid responses
+    """
+    with open( absolute_path_to_dump ) as dump:
+        for line in dump:
+            line = line.strip()
+            if line:
+                yield json.loads( line )
+
+
+def build_mirror( absolute_path_to_mirror, records ):
+    """
+    Writes the mirror file from the iterable `records` (dicts like the ones
+    yielded by `records_from_dump()`) and returns the number of records.
+    Records with an invalid fingerprint are skipped.
+    """
+    keys, key_records, data = list(), list(), list()
+    for record in records:
+        try:
+            values = decode_fingerprint( record['fingerprint'] )
+        except (KeyError, ValueError):
+            continue
+        record_keys = get_bucket_keys( values )
+        keys.extend( record_keys )
+        key_records.extend( [len(data)] * len(record_keys) )
+        data.append( json.dumps( record, separators=(',', ':') ).encode( 'utf-8' ) )
+
+    keys = numpy.array( keys, dtype='<u8' )
+    key_records = numpy.array( key_records, dtype='<u4' )
+    order = numpy.argsort( keys, kind='mergesort' )
+    keys, key_records = keys[order], key_records[order]
+    offsets = numpy.zeros( len(data) + 1, dtype='<u8' )
+    offsets[1:] = numpy.cumsum( [len(d) for d in data] )
+
+    directory, name = os.path.split( os.path.abspath( absolute_path_to_mirror ) )
+    fd, temp_path = tempfile.mkstemp( prefix='.' + name, dir=directory )
+    try:
+        with os.fdopen( fd, 'wb' ) as mirror_file:
+            mirror_file.write( _HEADER.pack( MAGIC, len(keys), len(data) ) )
+            mirror_file.write( keys.tobytes() )
+            mirror_file.write( key_records.tobytes() )
+            mirror_file.write( b'\x00' * (len(key_records) % 2 * 4) )
+            mirror_file.write( offsets.tobytes() )
+            for d in data:
+                mirror_file.write( d )
+        os.chmod( temp_path, 0o644 )
+        os.rename( temp_path, absolute_path_to_mirror )
+    except:
+        os.remove( temp_path )
+        raise
+    return len(data)
+
+
+class AcoustidMirror(object):
+    """
+    Memory mapped mirror file at `absolute_path_to_mirror`.
+    Raises IOError/OSError if it can't be opened, ValueError if it's invalid.
+    """
+
+    def __init__( self, absolute_path_to_mirror ):
+        with open( absolute_path_to_mirror, 'rb' ) as mirror_file:
+            self._map = mmap.mmap( mirror_file.fileno(), 0, access=mmap.ACCESS_READ )
+        if len(self._map) < _HEADER.size:
+            raise ValueError( 'mirror file too short' )
+        magic, num_keys, num_records = _HEADER.unpack_from( self._map, 0 )
+        if magic[:6] == MAGIC[:6] and magic != MAGIC:
+            raise ValueError( 'mirror file of an older version, rebuild it' )
+        if magic != MAGIC:
+            raise ValueError( 'not a mirror file' )
+        offset = _HEADER.size
+        self._keys = numpy.frombuffer( self._map, dtype='<u8', count=num_keys, offset=offset )
+        offset += num_keys * 8
+        self._key_records = numpy.frombuffer( self._map, dtype='<u4', count=num_keys, offset=offset )
+        offset += num_keys * 4 + num_keys % 2 * 4
+        self._offsets = numpy.frombuffer( self._map, dtype='<u8', count=num_records + 1, offset=offset )
+        self._data_offset = offset + (num_records + 1) * 8
+        if self._data_offset + int(self._offsets[-1]) > len(self._map):
+            raise ValueError( 'mirror file truncated' )
+
+    def __len__( self ):
+        return len(self._offsets) - 1
+
+    def close( self ):
+        self._keys = self._key_records = self._offsets = None
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+    def _get_record( self, record_number ):
+        start = self._data_offset + int(self._offsets[record_number])
+        end = self._data_offset + int(self._offsets[record_number + 1])
+        return json.loads( self._map[start:end].decode( 'utf-8' ) )
+
+    def lookup( self, fingerprint, duration, max_bit_error_rate ):
+        """
+        Returns a response like `acoustid.lookup()` with a result for each
+        record whose fingerprint differs in at most `max_bit_error_rate` of its
+        bits, scored 1.0 for identical ones down to 0.0 for unrelated ones.
+        Raises ValueError if `fingerprint` is not valid.
+        """
+        values = decode_fingerprint( fingerprint )
+        hits = defaultdict( int )
+        for key in get_query_bucket_keys( values ):
+            key = numpy.uint64( key )
+            start = numpy.searchsorted( self._keys, key, 'left' )
+            end = numpy.searchsorted( self._keys, key, 'right' )
+            for record_number in self._key_records[start:min(end, start + _BUCKET_SCAN_LIMIT)]:
+                hits[int(record_number)] += 1
+        candidates = sorted( hits, key=hits.get, reverse=True )[:_CANDIDATE_LIMIT]
+
+        results = list()
+        for record_number in candidates:
+            record = self._get_record( record_number )
+            if duration and record.get( 'duration' ) and \
+                    abs( duration - record['duration'] ) > MAX_DURATION_DIFFERENCE:
+                continue
+            try:
+                error_rate = bit_error_rate( values, decode_fingerprint( record['fingerprint'] ) )
+            except ValueError:
+                continue
+            if error_rate <= max_bit_error_rate:
+                results.append( {
+                    'id': 'mirror:%d' % record_number,
+                    'score': max( 0.0, 1.0 - 2.0 * error_rate ),
+                    'recordings': record.get( 'recordings', list() )
+                } )
+        results.sort( key=lambda result: result['score'], reverse=True )
+        return {'status': 'ok', 'results': results}
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""Measures loading and saving a large fragmented MP4 file.
+
+Writes a synthetic file with one moof/mdat pair per fragment and reports
+how long MP4() and MP4.save() take. On Python 3 the peak memory of
+loading is reported as well.
+
+Usage: python benchmarks/mp4_fragmented.py [fragments]
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from mutagen.mp4 import MP4  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def atom(name, data=b""):
+    return struct.pack(">I4s", len(data) + 8, name) + data
+
+
+def full_atom(name, data, version=0, flags=0):
+    return atom(name, struct.pack(">I", (version << 24) | flags) + data)
+
+
+def write_file(fileobj, fragments):
+    mdhd = full_atom(b"mdhd", struct.pack(">IIII", 0, 0, 44100, 0) + b"\0" * 4)
+    hdlr = full_atom(b"hdlr", b"\0" * 4 + b"soun" + b"\0" * 13)
+    moov = atom(b"moov", atom(b"trak", atom(b"mdia", mdhd + hdlr)))
+    fileobj.write(atom(b"ftyp", b"M4A \0\0\0\0") + moov)
+
+    for i in range(fragments):
+        base = fileobj.tell()
+        tfhd = full_atom(b"tfhd", struct.pack(">IQ", 1, base), flags=1)
+        traf = atom(b"traf", tfhd + full_atom(b"trun", b"\0" * 4))
+        moof = atom(b"moof", full_atom(b"mfhd", struct.pack(">I", i)) + traf)
+        fileobj.write(moof + atom(b"mdat", b"\0" * 16))
+
+
+def measure(func):
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = time.time()
+    result = func()
+    duration = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, duration, peak
+
+
+def main(argv):
+    fragments = int(argv[1]) if len(argv) > 1 else 50000
+
+    fd, filename = tempfile.mkstemp(suffix=".m4a")
+    try:
+        with os.fdopen(fd, "wb") as fileobj:
+            write_file(fileobj, fragments)
+
+        audio, duration, peak = measure(lambda: MP4(filename))
+        print("load: %.2fs" % duration)
+        if peak is not None:
+            print("load peak memory: %.1f MB" % (peak / 1e6))
+
+        audio["\xa9nam"] = u"benchmark"
+        _, duration, _ = measure(audio.save)
+        print("save: %.2fs" % duration)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
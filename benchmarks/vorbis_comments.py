@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""Measures parsing and writing a Vorbis comment with many entries.
+
+Builds a comment with the given number of text entries plus a few
+embedded cover pictures and reports how long loading it, looking up a
+single key, decoding all values and writing it back take, both for a bare
+comment and for a FLAC file containing it.
+
+Usage: python benchmarks/vorbis_comments.py [comments] [repeat]
+"""
+
+import base64
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from mutagen._vorbis import VCommentDict  # noqa: E402
+from mutagen.flac import FLAC, Picture  # noqa: E402
+
+
+# A STREAMINFO block, taken from mutagen's own tests
+STREAMINFO = (b'\x12\x00\x12\x00\x00\x00\x0e\x005\xea\n\xc4H\xf0\x00\xca0'
+              b'\x14(\x90\xf9\xe1)2\x13\x01\xd4\xa7\xa9\x11!8\xab\x91')
+
+
+def build_comment(comments, pictures=3):
+    tags = VCommentDict()
+    for i in range(comments):
+        tags.append((u"comment%d" % (i % 50),
+                     u"value %d äöü" % i + u"x" * (i % 100)))
+    for i in range(pictures):
+        picture = Picture()
+        picture.mime = u"image/jpeg"
+        picture.data = os.urandom(200000)
+        tags.append((u"metadata_block_picture",
+                     base64.b64encode(picture.write()).decode("ascii")))
+    tags["title"] = u"benchmark"
+    return tags.write(framing=False)
+
+
+def block(code, data, last=False):
+    header = struct.pack(">I", len(data))[1:]
+    return struct.pack("B", code | (128 if last else 0)) + header + data
+
+
+def write_flac(fileobj, comment):
+    fileobj.write(b"fLaC" + block(0, STREAMINFO) + block(4, comment) +
+                  block(1, b"\x00" * 1024, last=True) + b"\xff\xf8" * 1000)
+
+
+def measure(name, func, repeat):
+    start = time.time()
+    for i in range(repeat):
+        func()
+    print("%s: %.2f ms" % (name, (time.time() - start) / repeat * 1000))
+
+
+def main(argv):
+    comments = int(argv[1]) if len(argv) > 1 else 5000
+    repeat = int(argv[2]) if len(argv) > 2 else 20
+
+    data = build_comment(comments)
+    print("%d comments, %.1f MB" % (comments, len(data) / 1e6))
+
+    measure("load", lambda: VCommentDict(data, framing=False), repeat)
+    measure("load + keys", lambda: VCommentDict(data, framing=False).keys(),
+            repeat)
+    measure("load + one key",
+            lambda: VCommentDict(data, framing=False)["title"], repeat)
+    measure("load + all values",
+            lambda: list(VCommentDict(data, framing=False)), repeat)
+    tags = VCommentDict(data, framing=False)
+    measure("write unchanged", lambda: tags.write(framing=False), repeat)
+
+    fd, filename = tempfile.mkstemp(suffix=".flac")
+    try:
+        with os.fdopen(fd, "wb") as fileobj:
+            write_flac(fileobj, data)
+        measure("FLAC load", lambda: FLAC(filename), repeat)
+        audio = FLAC(filename)
+        audio["title"] = u"changed"
+        measure("FLAC save", audio.save, repeat)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+SQLite catalog of the processed library: one row per album directory and one
+row per file with its stat values, stream information, resolved tags,
+Musicbrainz IDs, fingerprint and the result of the last run, so reports don't
+need to rescan the library
+"""
+import os, time, sqlite3
+
+ALBUM_RESULT_SUCCESS = 'success'
+ALBUM_RESULT_NOT_SUCCESS = 'not_success'
+# Waiting for `mp3_tag_fixer.py resolve-queue`, see `get_queued_albums()`
+ALBUM_RESULT_QUEUED = 'queued'
+
+FILE_RESULT_TAGGED = 'tagged'
+FILE_RESULT_TAG_FAILED = 'tag_failed'
+FILE_RESULT_UNRESOLVED = 'unresolved'
+FILE_RESULT_NOT_MP3 = 'not_mp3'
+FILE_RESULT_QUEUED = 'queued'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+    album_dir TEXT PRIMARY KEY,
+    artist TEXT,
+    album TEXT,
+    result TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS albums_result_artist ON albums (result, artist);
+CREATE INDEX IF NOT EXISTS albums_artist ON albums (artist);
+
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id INTEGER PRIMARY KEY,
+    duration INTEGER,
+    fingerprint TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    album_dir TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    device INTEGER,
+    inode INTEGER,
+    format TEXT,
+    length REAL,
+    bitrate INTEGER,
+    sample_rate INTEGER,
+    artist TEXT,
+    album TEXT,
+    title TEXT,
+    track_number INTEGER,
+    recording_mbid TEXT,
+    artist_mbid TEXT,
+    fingerprint_id INTEGER REFERENCES fingerprints (id),
+    result TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_album_dir ON files (album_dir);
+CREATE INDEX IF NOT EXISTS files_title ON files (title);
+CREATE INDEX IF NOT EXISTS files_result ON files (result);
+CREATE INDEX IF NOT EXISTS files_recording_mbid ON files (recording_mbid);
+CREATE INDEX IF NOT EXISTS files_device_inode ON files (device, inode);
+"""
+
+FILE_COLUMNS = (
+    'path', 'album_dir', 'size', 'mtime', 'device', 'inode', 'format',
+    'length', 'bitrate', 'sample_rate', 'artist', 'album', 'title',
+    'track_number', 'recording_mbid', 'artist_mbid', 'fingerprint_id',
+    'result', 'updated' )
+
+_INSERT_FILE = 'INSERT OR REPLACE INTO files (%s) VALUES (%s)' % (
+    ', '.join( FILE_COLUMNS ), ', '.join( '?' * len(FILE_COLUMNS) ) )
+
+
+def open_catalog( absolute_path_to_catalog ):
+    """
+    Returns a connection to the catalog database at `absolute_path_to_catalog`,
+    which is created if it doesn't exist yet. The connection may be used by
+    several threads, one at a time.
+    """
+    connection = sqlite3.connect( absolute_path_to_catalog, check_same_thread=False )
+    connection.row_factory = sqlite3.Row
+    connection.execute( 'PRAGMA journal_mode=WAL' )
+    connection.execute( 'PRAGMA synchronous=NORMAL' )
+    connection.executescript( SCHEMA )
+    return connection
+
+
+def get_file_stat_values( absolute_path_to_file ):
+    """
+    Returns a dict with the 'size', 'mtime', 'device' and 'inode' of the file,
+    or an empty dict if it can't be accessed
+    """
+    try:
+        st = os.stat( absolute_path_to_file )
+    except OSError:
+        return dict()
+    return {
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'device': st.st_dev,
+        'inode': st.st_ino
+    }
+
+
+def _get_fingerprint_id( connection, duration, fingerprint ):
+    connection.execute(
+        'INSERT OR IGNORE INTO fingerprints (duration, fingerprint) VALUES (?, ?)',
+        (duration, fingerprint) )
+    return connection.execute(
+        'SELECT id FROM fingerprints WHERE fingerprint = ?',
+        (fingerprint,) ).fetchone()[0]
+
+
+def _get_file_row( connection, album_dir, values, now ):
+    values = dict( values )
+    values.setdefault( 'album_dir', album_dir )
+    values['updated'] = now
+    fingerprint = values.pop( 'fingerprint', None )
+    if fingerprint is not None:
+        values['fingerprint_id'] = _get_fingerprint_id( connection, *fingerprint )
+    return tuple( values.get( column ) for column in FILE_COLUMNS )
+
+
+def update_album( connection, album_dir, artist, album, result, files ):
+    """
+    Replaces all catalog rows of the album directory `album_dir` in a single
+    transaction. `files` should be a list of dicts mapping the names in
+    `FILE_COLUMNS` to values (missing ones are stored as NULL), optionally
+    also mapping 'fingerprint' to a tuple <int: duration>, <str: fingerprint>
+    """
+    now = time.time()
+    with connection:
+        connection.execute( 'DELETE FROM files WHERE album_dir = ?', (album_dir,) )
+        connection.executemany( _INSERT_FILE, [
+            _get_file_row( connection, album_dir, values, now ) for values in files ] )
+        connection.execute(
+            'INSERT OR REPLACE INTO albums (album_dir, artist, album, result, updated) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (album_dir, artist, album, result, now) )
+
+
+def move_album( connection, album_dir, new_album_dir ):
+    """
+    Updates the catalog after the album directory `album_dir` was moved to
+    `new_album_dir`, refreshing the stat values of the moved files. If both
+    are the same, only the stat values get refreshed, e.g. after the files
+    were written in place.
+    """
+    now = time.time()
+    with connection:
+        rows = connection.execute(
+            'SELECT path FROM files WHERE album_dir = ?', (album_dir,) ).fetchall()
+        prefix = album_dir + '/'
+        updates = list()
+        for row in rows:
+            path = row['path']
+            if path.startswith( prefix ):
+                path = os.path.join( new_album_dir, path[len(prefix):] )
+            stat_values = get_file_stat_values( path )
+            updates.append( (path, new_album_dir, stat_values.get('size'),
+                             stat_values.get('mtime'), stat_values.get('device'),
+                             stat_values.get('inode'), now, row['path']) )
+        if new_album_dir != album_dir:
+            # Drop rows of an album which was at `new_album_dir` before
+            connection.execute( 'DELETE FROM files WHERE album_dir = ?', (new_album_dir,) )
+            connection.execute( 'DELETE FROM albums WHERE album_dir = ?', (new_album_dir,) )
+        connection.executemany(
+            'UPDATE OR REPLACE files SET path = ?, album_dir = ?, size = ?, '
+            'mtime = ?, device = ?, inode = ?, updated = ? WHERE path = ?',
+            updates )
+        connection.execute(
+            'UPDATE albums SET album_dir = ?, updated = ? WHERE album_dir = ?',
+            (new_album_dir, now, album_dir) )
+
+
+def get_albums( connection, result=None, artist=None ):
+    """
+    Returns the catalog rows of all albums, optionally only those with the
+    given last `result` and/or `artist`, ordered by artist and album
+    """
+    query = 'SELECT * FROM albums'
+    conditions, parameters = list(), list()
+    if result is not None:
+        conditions.append( 'result = ?' )
+        parameters.append( result )
+    if artist is not None:
+        conditions.append( 'artist = ?' )
+        parameters.append( artist )
+    if conditions:
+        query += ' WHERE ' + ' AND '.join( conditions )
+    return connection.execute( query + ' ORDER BY artist, album', parameters ).fetchall()
+
+
+def get_remaining_work( connection ):
+    """
+    Returns <list: album rows which weren't processed successfully or are
+    queued>, <list: file rows of MP3 files which weren't tagged>
+    """
+    albums = connection.execute(
+        'SELECT * FROM albums WHERE result IN (?, ?) ORDER BY artist, album',
+        (ALBUM_RESULT_NOT_SUCCESS, ALBUM_RESULT_QUEUED) ).fetchall()
+    files = connection.execute(
+        'SELECT * FROM files WHERE result IN (?, ?, ?) ORDER BY path',
+        (FILE_RESULT_TAG_FAILED, FILE_RESULT_UNRESOLVED, FILE_RESULT_QUEUED) ).fetchall()
+    return albums, files
+
+
+def get_queued_albums( connection ):
+    """
+    Returns the catalog rows of all albums queued for resolving their files'
+    titles with the web services, ordered by artist and album. The queue is
+    the catalog itself: an album leaves it when it's recorded with another
+    result.
+    """
+    return get_albums( connection, result=ALBUM_RESULT_QUEUED )
+
+
+def get_queued_files( connection, album_dir ):
+    """
+    Returns the catalog rows of the queued files of the album directory
+    `album_dir`, with their fingerprint's 'duration' and 'fingerprint'
+    """
+    return connection.execute(
+        'SELECT files.*, fingerprints.duration, fingerprints.fingerprint FROM files '
+        'LEFT JOIN fingerprints ON fingerprints.id = fingerprint_id '
+        'WHERE album_dir = ? AND result = ? ORDER BY path',
+        (album_dir, FILE_RESULT_QUEUED) ).fetchall()
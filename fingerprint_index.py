@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local index of Chromaprint audio fingerprints, for finding files with the same
+or almost the same audio without asking the Acoustid web service.
+Fingerprints are decoded into arrays of 32 bit sub-fingerprints. Candidates
+are found with bit sampling locality-sensitive hashing, which tolerates bit
+errors: each of `HASH_TABLES` bucket keys is made of `BITS_PER_KEY` bits taken
+from fixed positions of the sub-fingerprints near the start, and stored in
+SQLite. Queries compute their keys at every alignment within
+`MAX_ALIGNMENT_OFFSET`. Fingerprints sharing buckets with the query are then
+scored by their bit error rate, counted with NumPy.
+Requires NumPy.
+"""
+import base64, sqlite3
+
+import numpy
+
+# A duplicate with bit error rate p shares each bucket with probability
+# (1 - p) ** BITS_PER_KEY, so at 15% about 5 of the 64 buckets
+HASH_TABLES = 64
+BITS_PER_KEY = 16
+# Bits are sampled from this many sub-fingerprints (about 15s)
+KEY_WINDOW = 128
+
+# Candidates are compared at these offsets (in sub-fingerprints, about 0.12s
+# each) to allow for a bit of leading silence being added or removed
+MAX_ALIGNMENT_OFFSET = 8
+MIN_OVERLAP = 16
+
+_CANDIDATE_LIMIT = 20
+# Buckets holding more fingerprints than this are only partially scanned, they
+# come from very common sub-fingerprints (like silence) and don't tell much
+_BUCKET_SCAN_LIMIT = 1000
+
+# Version of the bucket keys, stored as the index's user_version. Indexes with
+# other keys get their buckets rebuilt when opened.
+KEYS_VERSION = 2
+
+# Sub-fingerprint and bit position of each bit of each key, fixed so keys stay
+# comparable between runs. Sub-fingerprints before MAX_ALIGNMENT_OFFSET are
+# left out so every query alignment can compute all keys.
+_random_state = numpy.random.RandomState( 0x6d703374 )
+_KEY_ITEMS = _random_state.randint( MAX_ALIGNMENT_OFFSET, MAX_ALIGNMENT_OFFSET + KEY_WINDOW,
+                                    (HASH_TABLES, BITS_PER_KEY) )
+_KEY_BITS = _random_state.randint( 0, 32, (HASH_TABLES, BITS_PER_KEY) ).astype( numpy.uint32 )
+del _random_state
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id INTEGER PRIMARY KEY,
+    path TEXT,
+    duration INTEGER,
+    fingerprint TEXT NOT NULL,
+    track_name TEXT,
+    track_id TEXT,
+    artist_name TEXT,
+    artist_id TEXT
+);
+CREATE INDEX IF NOT EXISTS fingerprints_path ON fingerprints (path);
+
+CREATE TABLE IF NOT EXISTS fingerprint_buckets (
+    bucket INTEGER NOT NULL,
+    fingerprint_id INTEGER NOT NULL,
+    PRIMARY KEY (bucket, fingerprint_id)
+) WITHOUT ROWID;
+"""
+
+
+def _unpack_bits( data ):
+    """
+    Returns the bits of the uint8 array `data` as an array of 0 and 1, least
+    significant bit of each byte first
+    """
+    return numpy.unpackbits( data ).reshape( -1, 8 )[:, ::-1].ravel()
+
+
+def _unpack_ints( data, width ):
+    """
+    Unpacks `width` bit little endian integers from the uint8 array `data`
+    """
+    bits = _unpack_bits( data )
+    bits = bits[:len(bits) - len(bits) % width].reshape( -1, width )
+    return bits.dot( 1 << numpy.arange( width ) )
+
+
+def decode_fingerprint( fingerprint ):
+    """
+    Decodes a compressed, base64 encoded Chromaprint fingerprint (as printed
+    by fpcalc) into a numpy array of uint32 sub-fingerprints.
+    Raises ValueError if `fingerprint` is not valid.
+    """
+    fingerprint = str( fingerprint )
+    try:
+        data = base64.urlsafe_b64decode( fingerprint + '=' * (-len(fingerprint) % 4) )
+    except TypeError as e:
+        raise ValueError( str(e) )
+    data = numpy.frombuffer( data, dtype=numpy.uint8 )
+    if len(data) < 4:
+        raise ValueError( 'fingerprint too short' )
+    num_values = (int(data[1]) << 16) | (int(data[2]) << 8) | int(data[3])
+    if num_values == 0:
+        return numpy.zeros( 0, dtype=numpy.uint32 )
+
+    # Each sub-fingerprint is stored XORed with the previous one, as the
+    # distances between its set bits in 3 bit values terminated by a 0.
+    # Distances of 7 or more continue in 5 bit values stored after them.
+    bits = _unpack_ints( data[4:], 3 )
+    ends = numpy.flatnonzero( bits == 0 )
+    if len(ends) < num_values:
+        raise ValueError( 'fingerprint truncated' )
+    bits = bits[:ends[num_values - 1] + 1]
+    ends = ends[:num_values]
+    exceptional = numpy.flatnonzero( bits == 7 )
+    if len(exceptional):
+        offset = 4 + (len(bits) * 3 + 7) // 8
+        exceptional_bits = _unpack_ints( data[offset:], 5 )
+        if len(exceptional_bits) < len(exceptional):
+            raise ValueError( 'fingerprint truncated' )
+        bits[exceptional] += exceptional_bits[:len(exceptional)]
+
+    # Bit positions are the running sum of the distances since the start of
+    # each sub-fingerprint
+    positions = numpy.cumsum( bits )
+    item_starts = numpy.concatenate( ([0], positions[ends[:-1]]) )
+    items = numpy.concatenate( ([0], numpy.cumsum( bits == 0 )[:-1]) )
+    positions -= item_starts[items]
+    set_bits = bits != 0
+    if numpy.any( positions[set_bits] > 32 ):
+        raise ValueError( 'invalid bit position' )
+    weights = numpy.uint64(1) << (positions[set_bits] - 1).astype( numpy.uint64 )
+    values = numpy.bincount( items[set_bits], weights=weights, minlength=num_values )
+    return numpy.bitwise_xor.accumulate( values.astype( numpy.uint32 ) )
+
+
+def bit_error_rate( values, other_values ):
+    """
+    Returns the lowest fraction of differing bits between the sub-fingerprint
+    arrays `values` and `other_values` over the alignments within
+    `MAX_ALIGNMENT_OFFSET`, or 1.0 if they don't overlap enough
+    """
+    best = 1.0
+    for offset in range( -MAX_ALIGNMENT_OFFSET, MAX_ALIGNMENT_OFFSET + 1 ):
+        if offset >= 0:
+            a, b = values[offset:], other_values
+        else:
+            a, b = values, other_values[-offset:]
+        size = min( len(a), len(b) )
+        if size < MIN_OVERLAP:
+            continue
+        difference = numpy.bitwise_xor( a[:size], b[:size] )
+        errors = numpy.unpackbits( difference.view( numpy.uint8 ) ).sum()
+        best = min( best, float(errors) / (32.0 * size) )
+    return best
+
+
+def _get_keys( values, offset ):
+    """
+    Returns the bucket keys of the sub-fingerprint array `values` with the
+    sub-fingerprint at `offset` taken as the first one, leaving out the keys
+    of bits past its end
+    """
+    items = _KEY_ITEMS + offset
+    tables = numpy.flatnonzero( items.max( axis=1 ) < len(values) )
+    if len(tables) == 0:
+        return []
+    bits = (values[items[tables]] >> _KEY_BITS[tables]) & numpy.uint32(1)
+    keys = (tables << BITS_PER_KEY) | bits.astype( numpy.int64 ).dot( 1 << numpy.arange( BITS_PER_KEY ) )
+    return [int(key) for key in keys]
+
+
+def get_bucket_keys( values ):
+    """
+    Returns the LSH bucket keys to store for the sub-fingerprint array `values`
+    """
+    return _get_keys( values, 0 )
+
+
+def get_query_bucket_keys( values ):
+    """
+    Returns the LSH bucket keys to look up for the sub-fingerprint array
+    `values`: the ones of all its alignments within `MAX_ALIGNMENT_OFFSET`
+    """
+    keys = set()
+    for offset in range( -MAX_ALIGNMENT_OFFSET, MAX_ALIGNMENT_OFFSET + 1 ):
+        keys.update( _get_keys( values, offset ) )
+    return sorted( keys )
+
+
+class FingerprintIndex(object):
+    """
+    Fingerprint index stored in the SQLite database at `absolute_path_to_index`.
+    It may be used by several threads, one at a time.
+    """
+
+    def __init__( self, absolute_path_to_index ):
+        self.connection = sqlite3.connect( absolute_path_to_index, check_same_thread=False )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute( 'PRAGMA journal_mode=WAL' )
+        self.connection.execute( 'PRAGMA synchronous=NORMAL' )
+        self.connection.executescript( SCHEMA )
+        version = self.connection.execute( 'PRAGMA user_version' ).fetchone()[0]
+        if version != KEYS_VERSION:
+            self._rebuild_buckets()
+
+    def _rebuild_buckets( self ):
+        """
+        Replaces the bucket keys of all fingerprints with the current ones
+        """
+        with self.connection:
+            self.connection.execute( 'DELETE FROM fingerprint_buckets' )
+            for row in self.connection.execute(
+                    'SELECT id, fingerprint FROM fingerprints' ).fetchall():
+                try:
+                    keys = get_bucket_keys( decode_fingerprint( row['fingerprint'] ) )
+                except ValueError:
+                    continue
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO fingerprint_buckets (bucket, fingerprint_id) '
+                    'VALUES (?, ?)',
+                    [(key, row['id']) for key in keys] )
+            self.connection.execute( 'PRAGMA user_version = %d' % KEYS_VERSION )
+
+    def close( self ):
+        self.connection.close()
+
+    def add( self, path, duration, fingerprint, match=None ):
+        """
+        Adds a fingerprint of the file at `path` and returns its ID. `match`
+        can be the tuple <str: track title>, <str: track ID>, <str: artist
+        name>, <str: artist ID> found for it, for reuse by `find_match()`.
+        A fingerprint already indexed for `path` is replaced.
+        Raises ValueError if `fingerprint` is not valid.
+        """
+        keys = get_bucket_keys( decode_fingerprint( fingerprint ) )
+        track_name, track_id, artist_name, artist_id = match or (None,) * 4
+        with self.connection:
+            for row in self.connection.execute(
+                    'SELECT id FROM fingerprints WHERE path = ?', (path,) ).fetchall():
+                self._delete( row['id'] )
+            fingerprint_id = self.connection.execute(
+                'INSERT INTO fingerprints (path, duration, fingerprint, track_name, '
+                'track_id, artist_name, artist_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (path, duration, fingerprint, track_name, track_id, artist_name,
+                 artist_id) ).lastrowid
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO fingerprint_buckets (bucket, fingerprint_id) '
+                'VALUES (?, ?)',
+                [(key, fingerprint_id) for key in keys] )
+        return fingerprint_id
+
+    def _delete( self, fingerprint_id ):
+        row = self.connection.execute(
+            'SELECT fingerprint FROM fingerprints WHERE id = ?',
+            (fingerprint_id,) ).fetchone()
+        try:
+            keys = get_bucket_keys( decode_fingerprint( row['fingerprint'] ) )
+        except ValueError:
+            keys = list()
+        self.connection.executemany(
+            'DELETE FROM fingerprint_buckets WHERE bucket = ? AND fingerprint_id = ?',
+            [(key, fingerprint_id) for key in keys] )
+        self.connection.execute( 'DELETE FROM fingerprints WHERE id = ?', (fingerprint_id,) )
+
+    def search( self, fingerprint, max_bit_error_rate ):
+        """
+        Returns a list of <float: bit error rate>, <sqlite3.Row: indexed
+        fingerprint> for all indexed fingerprints sharing an LSH bucket with
+        `fingerprint` and differing in at most `max_bit_error_rate` of their
+        bits, best first.
+        Raises ValueError if `fingerprint` is not valid.
+        """
+        values = decode_fingerprint( fingerprint )
+        hits = dict()
+        for key in get_query_bucket_keys( values ):
+            for row in self.connection.execute(
+                    'SELECT fingerprint_id FROM fingerprint_buckets WHERE bucket = ? LIMIT ?',
+                    (key, _BUCKET_SCAN_LIMIT) ):
+                hits[row[0]] = hits.get( row[0], 0 ) + 1
+        candidates = list()
+        for fingerprint_id in sorted( hits, key=hits.get, reverse=True )[:_CANDIDATE_LIMIT]:
+            candidates.extend( self.connection.execute(
+                'SELECT * FROM fingerprints WHERE id = ?', (fingerprint_id,) ).fetchall() )
+        results = list()
+        for candidate in candidates:
+            try:
+                candidate_values = decode_fingerprint( candidate['fingerprint'] )
+            except ValueError:
+                continue
+            error_rate = bit_error_rate( values, candidate_values )
+            if error_rate <= max_bit_error_rate:
+                results.append( (error_rate, candidate) )
+        results.sort( key=lambda result: result[0] )
+        return results
+
+    def find_match( self, fingerprint, max_bit_error_rate ):
+        """
+        Returns the match stored with the most similar indexed fingerprint
+        (see `add()`) if it differs in at most `max_bit_error_rate` of its
+        bits, else None
+        """
+        for error_rate, row in self.search( fingerprint, max_bit_error_rate ):
+            if row['track_id'] is not None:
+                return row['track_name'], row['track_id'], row['artist_name'], row['artist_id']
+        return None
+
+    def find_duplicates( self, path, fingerprint, max_bit_error_rate ):
+        """
+        Returns the paths (when indexed) of other files with audio differing in at
+        most `max_bit_error_rate` of the fingerprint bits
+        """
+        return [row['path'] for error_rate, row in self.search( fingerprint, max_bit_error_rate )
+                if row['path'] != path]
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pooled HTTP transport shared by the web service clients, so requests reuse
+kept-alive connections instead of paying TCP (and TLS) setup every time.
+Only the standard library is used.
+"""
+import socket, threading, time, zlib
+
+try:
+    import httplib
+    from urlparse import urlsplit
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 2
+DEFAULT_TIMEOUT = 30.0
+
+# Errors meaning a kept-alive connection was closed by the server while idle,
+# after which the request is sent once more on a new connection
+_STALE_CONNECTION_ERRORS = (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error)
+
+
+class HTTPError(Exception):
+    """
+    HTTP error status of `response` (an `HTTPResponse`)
+    """
+
+    def __init__( self, response ):
+        Exception.__init__( self, 'HTTP error %d: %s' % (response.status, response.reason) )
+        self.response = response
+
+
+class HTTPResponse(object):
+    """
+    Complete response: `status`, `reason`, `headers` (dict with lower case
+    names) and `body` (bytes, already decompressed)
+    """
+
+    def __init__( self, status, reason, headers, body ):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+def default_connection_factory( scheme, host, port, timeout ):
+    """
+    Returns a new, not yet connected HTTP(S) connection, see `HTTPTransport`
+    """
+    if scheme == 'https':
+        return httplib.HTTPSConnection( host, port, timeout=timeout )
+    return httplib.HTTPConnection( host, port, timeout=timeout )
+
+
+class HTTPTransport(object):
+    """
+    Thread safe pool of kept-alive HTTP connections.
+    At most `max_connections` connections are open at a time, at most
+    `max_connections_per_host` of them to the same host; requests wait for a
+    free connection beyond that. Idle connections to other hosts are closed
+    to make room.
+    `connection_factory(scheme, host, port, timeout)` creates connections and
+    can be replaced, e.g. to point the transport at a local server in tests.
+    Each callable in `hooks` is called after every request with the method,
+    URL, response status (None on failure), elapsed seconds and whether an
+    idle connection was reused.
+    """
+
+    def __init__(   self,
+                    max_connections=DEFAULT_MAX_CONNECTIONS,
+                    max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                    timeout=DEFAULT_TIMEOUT,
+                    connection_factory=default_connection_factory,
+                    hooks=None ):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.connection_factory = connection_factory
+        self.hooks = list( hooks or list() )
+        self._condition = threading.Condition()
+        # Maps (scheme, host, port) to a list of <float: time last used>,
+        # <idle connection>, least recently used first, and to the number of
+        # connections in use
+        self._idle = dict()
+        self._in_use = dict()
+
+    def _count_open( self ):
+        return sum( len(connections) for connections in self._idle.values() ) \
+            + sum( self._in_use.values() )
+
+    def _close_least_recently_used( self ):
+        """
+        Closes the idle connection which was used least recently, over all
+        hosts. Returns False if there is none.
+        """
+        oldest = None
+        for connections in self._idle.values():
+            if connections and (oldest is None or connections[0][0] < oldest[0][0]):
+                oldest = connections
+        if oldest is None:
+            return False
+        oldest.pop( 0 )[1].close()
+        return True
+
+    def _acquire( self, key ):
+        """
+        Returns <connection>, <bool: is a reused idle connection>
+        """
+        with self._condition:
+            while True:
+                idle = self._idle.get( key )
+                if idle:
+                    self._in_use[key] = self._in_use.get( key, 0 ) + 1
+                    return idle.pop()[1], True
+                if self._in_use.get( key, 0 ) < self.max_connections_per_host \
+                and ( self._count_open() < self.max_connections
+                      or self._close_least_recently_used() ):
+                    self._in_use[key] = self._in_use.get( key, 0 ) + 1
+                    break
+                self._condition.wait()
+        try:
+            return self.connection_factory( key[0], key[1], key[2], self.timeout ), False
+        except:
+            self._release( key, None )
+            raise
+
+    def _release( self, key, connection, reusable=False ):
+        with self._condition:
+            self._in_use[key] -= 1
+            if connection is not None:
+                if reusable:
+                    self._idle.setdefault( key, list() ).append( (time.time(), connection) )
+                else:
+                    connection.close()
+            # Waiters for other hosts may be able to go on too, e.g. by
+            # closing this connection if it stays idle
+            self._condition.notify_all()
+
+    def _send( self, connection, method, path, body, headers, timeout ):
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout( timeout )
+        connection.request( method, path, body, headers )
+        response = connection.getresponse()
+        data = response.read()
+        return response, data
+
+    def request( self, method, url, body=None, headers=None, timeout=None ):
+        """
+        Sends the request and returns its `HTTPResponse`, asking for a gzip
+        compressed response body. HTTP error statuses are returned like any
+        other, network errors raise `socket.error` or `httplib.HTTPException`.
+        """
+        parts = urlsplit( url )
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_headers = {'Accept-Encoding': 'gzip'}
+        request_headers.update( headers or dict() )
+        if timeout is None:
+            timeout = self.timeout
+
+        start = time.time()
+        status = None
+        connection, reused = self._acquire( key )
+        try:
+            try:
+                response, data = self._send( connection, method, path, body, request_headers, timeout )
+            except socket.timeout:
+                raise
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                connection.close()
+                reused = False
+                response, data = self._send( connection, method, path, body, request_headers, timeout )
+        except:
+            self._release( key, connection )
+            self._call_hooks( method, url, status, time.time() - start, reused )
+            raise
+        status = response.status
+        self._release( key, connection, reusable=not response.will_close )
+
+        self._call_hooks( method, url, status, time.time() - start, reused )
+
+        response_headers = dict( (name.lower(), value) for name, value in response.getheaders() )
+        if response_headers.get( 'content-encoding', '' ).lower() == 'gzip':
+            try:
+                data = zlib.decompress( data, 16 + zlib.MAX_WBITS )
+            except zlib.error as e:
+                raise httplib.HTTPException( 'Invalid gzip response body: %s' % e )
+        return HTTPResponse( status, response.reason, response_headers, data )
+
+    def _call_hooks( self, method, url, status, elapsed, reused ):
+        for hook in self.hooks:
+            hook( method, url, status, elapsed, reused )
+
+    def close( self ):
+        """
+        Closes all idle connections
+        """
+        with self._condition:
+            for connections in self._idle.values():
+                for last_used, connection in connections:
+                    connection.close()
+            self._idle.clear()
@@ -5,15 +5,17 @@ mp3_tag_fixer.py
 Version 2.0
 """
 
-import sys, json, logging, os, pprint, subprocess, re, shutil, operator
+import sys, json, logging, os, pprint, subprocess, re, shutil, operator, threading, errno, contextlib
 from operator import itemgetter
 from datetime import datetime
 
 from mutagen.easyid3 import EasyID3
 from mutagen.mp3 import MP3
-from mutagen.id3 import ID3NoHeaderError, ID3, TIT2, TPE1, TALB, TRCK
+from mutagen.id3 import ID3NoHeaderError, ID3, ID3AlbumWriter, TIT2, TPE1, TALB, TRCK
 
 import online_resources
+import catalog
+import scheduler
 
 ILLEGAL_NTFS_FILENAME_CHARS = ('/', '?', '<', '>', '\\', ':', '*', '|', '"', '^')
 
@@ -25,6 +27,38 @@ CONFIG_DATA = None
 
 DEVNULL = None
 
+CATALOG = None
+# Serializes the use of `CATALOG` by the worker threads
+CATALOG_LOCK = threading.Lock()
+
+# `scheduler.DeviceSlots` limiting the I/O on each device while
+# `process_root_directories()` runs, see `device_io_procedure()`
+DEVICE_SLOTS = None
+
+# If True, titles are only resolved with local data and albums needing the
+# web services are queued in the catalog for `resolve_queue()`
+OFFLINE_FIRST = False
+
+# Maps absolute path of an MP3 file to the ID3 tag which still has to be
+# written to it, while its album directory is processed
+PENDING_ID3_TAGS = dict()
+
+# Maps absolute path of a processed album directory to the
+# `mutagen.id3.ID3AlbumWriter` with the pending ID3 tags of its MP3 files, see
+# `write_album_directory()`
+PENDING_ALBUM_WRITERS = dict()
+
+# Defaults of the 'scheduler' config section, see `process_root_directories()`.
+# Without 'network_workers', the number of network lane workers follows the
+# web services' rate limits.
+DEFAULT_SCHEDULER_CONFIG = {
+    'local_workers': 8,
+    'local_queue_depth': 64,
+    'network_workers': None,
+    'network_queue_depth': 8,
+    'io_workers_per_device': 1
+}
+
 
 def set_up_logging():
     global log
@@ -99,6 +133,8 @@ def attempt_get_id3_values( absolute_path_to_mp3_file ):
     returned instead
     """
     artist, album, title, track_number = None, None, None, None
+    if absolute_path_to_mp3_file in PENDING_ID3_TAGS:
+        return get_pending_id3_values( absolute_path_to_mp3_file )
     try:
         audio = EasyID3( absolute_path_to_mp3_file )
 
@@ -125,9 +161,110 @@ def attempt_get_id3_values( absolute_path_to_mp3_file ):
     return artist, album, title, track_number
 
 
+def get_pending_id3_values( absolute_path_to_mp3_file ):
+    """
+    Same as `attempt_get_id3_values()`, but for the ID3 tag which is still
+    pending to be written to `absolute_path_to_mp3_file`
+    """
+    audio = PENDING_ID3_TAGS[absolute_path_to_mp3_file]
+    result = list()
+    for frame_id in ('TPE1', 'TALB', 'TIT2', 'TRCK'):
+        frame = audio.get( frame_id )
+        if frame is not None and len(frame.text) > 0:
+            result.append( frame.text[0] )
+        else:
+            result.append( None )
+    return tuple( result )
+
+
+def get_album_id3_frame( album_writer, frame_class, value ):
+    """
+    Returns a text frame of `frame_class` for `value`. It is one of the frames
+    `album_writer` shares among the MP3 files of the album, so it's only
+    encoded once, unless the album's first value for it was a different one.
+    """
+    if album_writer is None:
+        return frame_class( encoding=3, text=value )
+    frame = album_writer.frames.get( frame_class.__name__ )
+    if frame is None:
+        frame = frame_class( encoding=3, text=value )
+        album_writer.frames.add( frame )
+    elif frame.text != [value]:
+        frame = frame_class( encoding=3, text=value )
+    return frame
+
+
+def get_directory_size( absolute_path_directory ):
+    """
+    Returns the total size in bytes of the files in the directory (not in its
+    subdirectories)
+    """
+    size = 0
+    for each_file in get_list_of_directory_content( absolute_path_directory,
+                                                    list_subdirectories=False ) or list():
+        try:
+            size += os.path.getsize( each_file )
+        except OSError:
+            pass
+    return size
+
+
+def move_io_procedure( absolute_path_source, absolute_path_destination_directory ):
+    """
+    Returns `device_io_procedure()` for moving the file or directory at
+    `absolute_path_source` into `absolute_path_destination_directory`: it
+    holds the devices of both, and counts the size of the data as transferred
+    only if it has to be copied to another device rather than renamed
+    """
+    devices = [ scheduler.get_device( absolute_path_source ),
+                scheduler.get_device( absolute_path_destination_directory ) ]
+    num_bytes = 0
+    if devices[0] != devices[1]:
+        if os.path.isdir( absolute_path_source ):
+            num_bytes = get_directory_size( absolute_path_source )
+        else:
+            num_bytes = os.path.getsize( absolute_path_source )
+    return device_io_procedure( devices, num_bytes )
+
+
+@contextlib.contextmanager
+def device_io_procedure( devices, num_bytes=0 ):
+    """
+    Holds the I/O slots of `devices` in `DEVICE_SLOTS`, if set, counting
+    `num_bytes` as transferred on each of them
+    """
+    if DEVICE_SLOTS is None:
+        yield
+        return
+    with DEVICE_SLOTS.io( devices, num_bytes ):
+        yield
+
+
+def is_title_missing( title ):
+    """
+    Returns True if the ID3 title value `title` is missing or a placeholder
+    like 'Track 01'
+    """
+    return title is None or 'track' in title.lower()
+
+
+def make_directories( absolute_path_directory ):
+    """
+    Creates the directory and its parents unless it exists, also if another
+    thread creates it at the same time
+    """
+    try:
+        os.makedirs( absolute_path_directory )
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir( absolute_path_directory ):
+            raise
+
+
 def set_mp3_file_id3_header_and_tag_data(   absolute_path_to_mp3_file,
                                             values,
-                                            attempt_to_append_or_overwrite_data=True ):
+                                            attempt_to_append_or_overwrite_data=True,
+                                            defer_save=False,
+                                            album_writer=None ):
     """
     Returns True if process seemed to go okay, otherwise False
     Attempts to set given ID3 tag data regardless of whether MP3 file has an 
@@ -140,7 +277,12 @@ def set_mp3_file_id3_header_and_tag_data(   absolute_path_to_mp3_file,
     If `attempt_to_append_or_overwrite_data` is True, will attempt to overwrite or preserve 
     existing values and append values supplied in `values` if they don't already
     exist.
+    If `defer_save` is True, or a tag for the file is already pending, the new
+    tag is only stored in `PENDING_ID3_TAGS` and written by
+    `write_album_directory()`. Its TPE1 and TALB frames are shared through
+    `album_writer`, see `get_album_id3_frame()`.
     """
+    defer_save = defer_save or absolute_path_to_mp3_file in PENDING_ID3_TAGS
     if attempt_to_append_or_overwrite_data:
         artist, album, title, track_number = \
             attempt_get_id3_values( absolute_path_to_mp3_file )
@@ -153,8 +295,10 @@ def set_mp3_file_id3_header_and_tag_data(   absolute_path_to_mp3_file,
         if 'track_number' not in values and track_number is not None:
             values['track_number'] = track_number  
     try:
-        old_audio = ID3( absolute_path_to_mp3_file )
-        old_audio.delete()
+        if not defer_save:
+            with device_io_procedure( [ scheduler.get_device( absolute_path_to_mp3_file ) ] ):
+                old_audio = ID3( absolute_path_to_mp3_file )
+                old_audio.delete()
     except ID3NoHeaderError as inhe:
         log.debug('%s seemed to have no ID3 header' % absolute_path_to_mp3_file)
     except Exception as e:
@@ -163,14 +307,18 @@ def set_mp3_file_id3_header_and_tag_data(   absolute_path_to_mp3_file,
     try:        
         audio = ID3()
         if 'artist' in values:
-            audio.add( TPE1( encoding=3, text=unicode( values['artist'] ) ) )
+            audio.add( get_album_id3_frame( album_writer, TPE1, unicode( values['artist'] ) ) )
         if 'album' in values:
-            audio.add( TALB( encoding=3, text=unicode( values['album'] ) ) )
+            audio.add( get_album_id3_frame( album_writer, TALB, unicode( values['album'] ) ) )
         if 'track' in values:
             audio.add( TIT2( encoding=3, text=unicode( values['track'] ) ) )       
         if 'track_number' in values:
             audio.add( TRCK( encoding=3, text=unicode( values['track_number'] ) ) )
-        audio.save( absolute_path_to_mp3_file )
+        if defer_save:
+            PENDING_ID3_TAGS[absolute_path_to_mp3_file] = audio
+        else:
+            with device_io_procedure( [ scheduler.get_device( absolute_path_to_mp3_file ) ] ):
+                audio.save( absolute_path_to_mp3_file )
         return True
     except Exception as e:
         log.error('Failed: %s: <%s> %s' % (absolute_path_to_mp3_file, type(e), str(e)))
@@ -229,6 +377,57 @@ def attempt_get_track_number_as_int(    tag_value,
     return result if type(result) is int else None
 
 
+def get_mp3_file_stream_info( absolute_path_to_mp3_file ):
+    """
+    Returns a dict with the 'length', 'bitrate' and 'sample_rate' of the MP3
+    file's audio stream, or an empty dict on failure
+    """
+    try:
+        info = MP3( absolute_path_to_mp3_file ).info
+        return {
+            'length': info.length,
+            'bitrate': info.bitrate,
+            'sample_rate': info.sample_rate
+        }
+    except Exception as e:
+        log.debug('"%s": <%s> %s' % (absolute_path_to_mp3_file, type(e), str(e)))
+    return dict()
+
+
+def update_catalog_procedure(   absolute_path_album_dir,
+                                album_result,
+                                dict_file_catalog_values ):
+    """
+    Records the album directory and its files in the catalog, in one
+    transaction. `dict_file_catalog_values` maps absolute path of each file to
+    a dict of catalog values (see `catalog.FILE_COLUMNS`), which get completed
+    with the file's stat values and, for MP3 files, its resolved tag values.
+    """
+    if CATALOG is None:
+        return
+    album_directory_value = os.path.split(absolute_path_album_dir)[1]
+    artist_directory_value = os.path.split(os.path.split(absolute_path_album_dir)[0])[1]
+    files = list()
+    for path, values in dict_file_catalog_values.items():
+        values['path'] = path
+        values.update( catalog.get_file_stat_values( path ) )
+        if values.get('format') == 'mp3':
+            artist, album, title, track_number = attempt_get_id3_values( path )
+            values['artist'], values['album'], values['title'] = artist, album, title
+            values['track_number'] = attempt_get_track_number_as_int( track_number, path )
+        files.append( values )
+    try:
+        with CATALOG_LOCK:
+            catalog.update_album(   CATALOG,
+                                    absolute_path_album_dir,
+                                    artist_directory_value,
+                                    album_directory_value,
+                                    album_result,
+                                    files )
+    except Exception as e:
+        log.error('Failed to update catalog for "%s": <%s> %s' % (absolute_path_album_dir, type(e), str(e)))
+
+
 def move_non_mp3_file_procedure(    artist_directory_value,
                                     album_directory_value,
                                     absolute_path_to_file_to_move ):
@@ -238,9 +437,9 @@ def move_non_mp3_file_procedure(    artist_directory_value,
         CONFIG_DATA['non_mp3_file_directory'],
         artist_directory_value,
         album_directory_value )
-    if not os.path.exists( destination_directory ):
-        os.makedirs( destination_directory )
-    shutil.move( absolute_path_to_file_to_move, destination_directory )
+    make_directories( destination_directory )
+    with move_io_procedure( absolute_path_to_file_to_move, destination_directory ):
+        shutil.move( absolute_path_to_file_to_move, destination_directory )
     return 'Moved "%s" to "%s"\n' % (os.path.split(absolute_path_to_file_to_move)[1], destination_directory)
 
 
@@ -273,7 +472,7 @@ def do_remove_album_release_year_procedure( tag_values,
     return report
 
 
-def do_track_number_procedure( dict_mp3_file_track_number ):
+def do_track_number_procedure( dict_mp3_file_track_number, album_writer=None ):
     """
     Called as a procedure for `process_album_directory()`, which should append
     the returned string `report` to its own `report`
@@ -300,20 +499,51 @@ def do_track_number_procedure( dict_mp3_file_track_number ):
         for mapping in dict_mp3_file_track_number.items():
             tag_attempt = set_mp3_file_id3_header_and_tag_data( 
                 mapping[0], # absolute path to MP3 file
-                {'track_number': int(mapping[1])} )     
+                {'track_number': int(mapping[1])},
+                album_writer=album_writer )     
             report += '"%s": %s adding track number to ID3 data\n' % (os.path.split(mapping[0])[1], 'Succeeded' if tag_attempt else 'Failed')
     return report
 
 
+def get_album_tracklist_procedure(  absolute_path_artist_dir,
+                                    album_directory_value,
+                                    existing_album_tag_value,
+                                    file_list ):
+    """
+    Returns the tracklist of the album's Musicbrainz release (see
+    `online_resources.get_release_tracklist()`), or an empty list if it can't
+    be found, in which case tracks are resolved by fingerprinting. The
+    artist's discography is cached for the artist directory, see
+    `process_network_artist_job()`.
+    """
+    if OFFLINE_FIRST:
+        return list()
+    search_values = {'album': album_directory_value}
+    do_remove_album_release_year_procedure( search_values, existing_album_tag_value )
+    tracklist = online_resources.get_release_tracklist(
+        os.path.split(absolute_path_artist_dir)[1],
+        search_values['album'],
+        len( [each_file for each_file in file_list if is_file_mp3(each_file)] ),
+        CONFIG_DATA,
+        log,
+        discography_key=absolute_path_artist_dir )
+    return tracklist or list()
+
+
 def process_album_directory( absolute_path_album_dir ):
     """
     Returns True if all contained mp3 files are tagged satisfactorily and the
     specified album directory contains no subdirectories, else returns False.
+    Returns None if, with `OFFLINE_FIRST`, some files need the web services
+    and the album got queued for `resolve_queue()` instead.
     `absolute_path_album_dir` is assumed to exist.
     Will move non mp3 files out of `absolute_path_album_dir` to appropriate
     subdirectory of directory specified in `mp3_tag_fixer_config.json`.
     """
     report = 'Album directory "%s":\n' % absolute_path_album_dir
+    # Writes the new ID3 tags of the album's MP3 files, sharing their common
+    # frames, see `add_album_writer_procedure()`
+    album_writer = ID3AlbumWriter()
 
     # Check if the given album directory contains any subdirectories (it should not)
     subdir_list = get_list_of_directory_content( absolute_path_album_dir )
@@ -322,6 +552,7 @@ def process_album_directory( absolute_path_album_dir ):
         for sub_dir in subdir_list:
             report += '\n    "%s"' % os.path.split(sub_dir)[1]
         log.info( report )
+        update_catalog_procedure( absolute_path_album_dir, catalog.ALBUM_RESULT_NOT_SUCCESS, dict() )
         return False
 
     contents_are_good = True
@@ -329,8 +560,58 @@ def process_album_directory( absolute_path_album_dir ):
                                                 list_subdirectories=False )
     dict_mp3_file_track_number = dict() # Maps absolute path to candidate track number
     dict_mp3_file_new_filename = dict() # Maps absolute path to desired new filename
+    dict_file_catalog_values = dict() # Maps absolute path to values for the catalog
     album_directory_value = os.path.split(absolute_path_album_dir)[1]
     artist_directory_value = os.path.split(os.path.split(absolute_path_album_dir)[0])[1]
+    # Tracks of the album's Musicbrainz release not matched to a file yet,
+    # fetched when the first file lacking a title is found
+    album_tracklist = None
+    dict_mp3_file_values = dict() # Maps absolute path to catalog values and ID3 values
+    dict_mp3_file_release_track = dict() # Maps absolute path to matched track of the release
+    files_to_fingerprint = list()
+    album_is_queued = False
+
+    # Read all MP3 files first, holding the album's device only meanwhile
+    # (see `device_io_procedure()`), then match those lacking a title to the
+    # album's Musicbrainz release, so the remaining ones can be fingerprinted
+    # together
+    album_device = scheduler.get_device( absolute_path_album_dir )
+    with device_io_procedure( [ album_device ] ):
+        for each_file in file_list:
+            if not is_file_mp3(each_file):
+                continue
+            catalog_values = get_mp3_file_stream_info( each_file )
+            catalog_values['format'] = 'mp3'
+            artist, album, title, track_number = attempt_get_id3_values( each_file )
+            track_number = attempt_get_track_number_as_int( track_number, each_file )
+            dict_mp3_file_values[each_file] = (catalog_values, artist, album, title, track_number)
+    for each_file in file_list:
+        if each_file not in dict_mp3_file_values:
+            continue
+        catalog_values, artist, album, title, track_number = dict_mp3_file_values[each_file]
+        if is_title_missing( title ):
+            if each_file in online_resources.RESOLVED_MATCHES:
+                # Already looked up by `resolve_queue()`
+                files_to_fingerprint.append( each_file )
+                continue
+            if album_tracklist is None:
+                album_tracklist = get_album_tracklist_procedure(    os.path.split(absolute_path_album_dir)[0],
+                                                                    album_directory_value,
+                                                                    album,
+                                                                    file_list )
+            track = online_resources.match_track_in_tracklist(  album_tracklist,
+                                                                track_number,
+                                                                catalog_values.get( 'length' ),
+                                                                CONFIG_DATA )
+            if track is not None:
+                album_tracklist.remove( track )
+                dict_mp3_file_release_track[each_file] = track
+            else:
+                files_to_fingerprint.append( each_file )
+    if len( files_to_fingerprint ) > 0:
+        # fpcalc reads the files, so only one album per device is fingerprinted at a time
+        with device_io_procedure( [ album_device ] ):
+            online_resources.fingerprint_audio_files( files_to_fingerprint, log )
 
     for each_file in file_list:        
         file_name = os.path.split(each_file)[1]
@@ -339,11 +620,17 @@ def process_album_directory( absolute_path_album_dir ):
             report += move_non_mp3_file_procedure(  artist_directory_value,
                                                     album_directory_value,
                                                     each_file )
+            moved_file_dir = os.path.join(  CONFIG_DATA['non_mp3_file_directory'],
+                                            artist_directory_value,
+                                            album_directory_value )
+            dict_file_catalog_values[os.path.join( moved_file_dir, file_name )] = {
+                'album_dir': moved_file_dir,
+                'format': os.path.splitext( file_name )[1][1:].lower(),
+                'result': catalog.FILE_RESULT_NOT_MP3 }
             continue
 
-        artist, album, title, track_number = attempt_get_id3_values( each_file )
-
-        track_number = attempt_get_track_number_as_int( track_number, each_file )
+        catalog_values, artist, album, title, track_number = dict_mp3_file_values[each_file]
+        dict_file_catalog_values[each_file] = catalog_values
 
         if type(track_number) is int:
             dict_mp3_file_track_number[each_file] = track_number
@@ -354,18 +641,37 @@ def process_album_directory( absolute_path_album_dir ):
             'track': title
         }
 
-        if tag_values['track'] is None or 'track' in tag_values['track'].lower():
-            # Check remote music DB for Musicbrainz (mb) data about this track
-            report += '"%s": attempting to fingerprint file and query web service...\n' % file_name
-            mb_track_name, mb_track_id, mb_artist_name, mb_artist_id = \
-                online_resources.get_title_and_artist_from_audio_fingerprint(    
-                    each_file,
-                    artist_directory_value,
-                    album_directory_value,
-                    CONFIG_DATA,
-                    log,
-                    DEVNULL )
+        if is_title_missing( tag_values['track'] ):
+            track = dict_mp3_file_release_track.get( each_file )
+            if track is not None:
+                report += '"%s": matched to track %d of the album\'s Musicbrainz release\n' % (file_name, track['position'])
+                mb_track_name, mb_track_id, mb_artist_name, mb_artist_id = \
+                    track['title'], track['recording_id'], track['artist_name'], track['artist_id']
+            else:
+                # Check remote music DB for Musicbrainz (mb) data about this track
+                report += '"%s": attempting to fingerprint file and query web service...\n' % file_name
+                mb_track_name, mb_track_id, mb_artist_name, mb_artist_id = \
+                    online_resources.get_title_and_artist_from_audio_fingerprint(    
+                        each_file,
+                        artist_directory_value,
+                        album_directory_value,
+                        CONFIG_DATA,
+                        log,
+                        DEVNULL,
+                        offline=OFFLINE_FIRST )
+            fingerprint = online_resources.FINGERPRINTS.pop( each_file, (None, None) )
+            catalog_values['fingerprint'] = fingerprint if fingerprint[1] is not None else None
+            catalog_values['recording_mbid'] = mb_track_id
+            catalog_values['artist_mbid'] = mb_artist_id
+            if None in (mb_track_name, mb_track_id, mb_artist_name, mb_artist_id) \
+            and OFFLINE_FIRST and CATALOG is not None:
+                catalog_values['result'] = catalog.FILE_RESULT_QUEUED
+                album_is_queued = True
+                contents_are_good = False
+                report += '"%s": track title not available locally, queued for resolving\n' % file_name
+                continue
             if None in (mb_track_name, mb_track_id, mb_artist_name, mb_artist_id):
+                catalog_values['result'] = catalog.FILE_RESULT_UNRESOLVED
                 contents_are_good = False
                 report += '"%s": track title not available from ID3 tag, and no good data retrieved from remote music DB\n' % file_name
                 continue
@@ -375,8 +681,11 @@ def process_album_directory( absolute_path_album_dir ):
         report += do_remove_album_release_year_procedure( tag_values, album )
 
         tag_attempt = set_mp3_file_id3_header_and_tag_data( 
-            each_file, tag_values, attempt_to_append_or_overwrite_data=False )
+            each_file, tag_values, attempt_to_append_or_overwrite_data=False,
+            defer_save=True, album_writer=album_writer )
         report += '"%s": %s tagging: %s\n' % (file_name, 'Succeeded' if tag_attempt else 'Failed', str(tag_values))
+        catalog_values['result'] = \
+            catalog.FILE_RESULT_TAGGED if tag_attempt else catalog.FILE_RESULT_TAG_FAILED
         
         # Mark MP3 file as needing to be renamed if track name doesn't seem to be in filename
         if tag_attempt and not tag_values['track'].lower() in file_name.lower():
@@ -386,7 +695,7 @@ def process_album_directory( absolute_path_album_dir ):
         contents_are_good = contents_are_good and tag_attempt  
 
     # Check if candidate track numbers seem valid
-    report += do_track_number_procedure( dict_mp3_file_track_number )
+    report += do_track_number_procedure( dict_mp3_file_track_number, album_writer )
 
     # Rename MP3 files for each mapping in dict_mp3_file_new_filename. If the
     # file has a track number available, prepend it to the new filename (new
@@ -406,39 +715,321 @@ def process_album_directory( absolute_path_album_dir ):
                 just_filename = just_filename.replace( illegal_char, '' )
             filename_to_use = os.path.join( parent_dir, just_filename )
             os.rename( existing_filename, filename_to_use )
+            if existing_filename in PENDING_ID3_TAGS:
+                PENDING_ID3_TAGS[filename_to_use] = PENDING_ID3_TAGS.pop( existing_filename )
+            dict_file_catalog_values[filename_to_use] = dict_file_catalog_values.pop( existing_filename )
             report += 'Renamed "%s" to "%s"\n' % ( os.path.split(existing_filename)[1], os.path.split(filename_to_use)[1] )
         except Exception as e:
             report += 'Failed to rename "%s": %s: %s\n' % (existing_filename, type(e), e)
 
+    if album_is_queued:
+        album_result = catalog.ALBUM_RESULT_QUEUED
+    elif contents_are_good:
+        album_result = catalog.ALBUM_RESULT_SUCCESS
+    else:
+        album_result = catalog.ALBUM_RESULT_NOT_SUCCESS
+    update_catalog_procedure( absolute_path_album_dir, album_result, dict_file_catalog_values )
+    add_album_writer_procedure( absolute_path_album_dir, album_writer )
+
     log.info( report )
+    if album_is_queued:
+        return None
     return contents_are_good
 
 
+def pop_pending_id3_tags( absolute_path_album_dir ):
+    """
+    Removes the pending ID3 tags of the MP3 files in `absolute_path_album_dir`
+    from `PENDING_ID3_TAGS` and returns them
+    """
+    pending = dict()
+    for path in list( PENDING_ID3_TAGS.keys() ):
+        if os.path.split(path)[0] == absolute_path_album_dir:
+            pending[path] = PENDING_ID3_TAGS.pop( path )
+    return pending
+
+
+def add_album_writer_procedure( absolute_path_album_dir, album_writer ):
+    """
+    Moves the pending ID3 tags of the MP3 files in `absolute_path_album_dir`
+    to `album_writer`, without the frames it shares among them, and stores it
+    in `PENDING_ALBUM_WRITERS` for `write_album_directory()`
+    """
+    shared_frames = set( id(frame) for frame in album_writer.frames.values() )
+    for path, audio in sorted( pop_pending_id3_tags( absolute_path_album_dir ).items() ):
+        album_writer.add( path, [ frame for frame in audio.values() if id(frame) not in shared_frames ] )
+    PENDING_ALBUM_WRITERS[absolute_path_album_dir] = album_writer
+
+
+def save_pending_id3_tags_procedure( album_writer ):
+    """
+    Saves the ID3 tags of `album_writer` (see `add_album_writer_procedure()`)
+    in place. A file failing doesn't keep the others from being written.
+    """
+    for path, audio in album_writer or list():
+        try:
+            audio.save( path, v1=0 )
+        except Exception as e:
+            log.error('Failed: %s: <%s> %s' % (path, type(e), str(e)))
+
+
+def write_album_directory( absolute_path_album_dir, destination_directory ):
+    """
+    Writes the pending ID3 tags of the MP3 files in `absolute_path_album_dir`
+    and moves the album directory into `destination_directory`.
+    If both are on different devices, each MP3 file is written to the
+    destination with its new tag in a single pass instead of tagging it in
+    place and copying it afterwards.
+    """
+    album_writer = PENDING_ALBUM_WRITERS.pop( absolute_path_album_dir, None )
+
+    target_dir = os.path.join( destination_directory,
+                               os.path.split(absolute_path_album_dir)[1] )
+    if os.stat( absolute_path_album_dir ).st_dev == os.stat( destination_directory ).st_dev \
+    or os.path.exists( target_dir ) \
+    or len( get_list_of_directory_content( absolute_path_album_dir ) ) > 0:
+        save_pending_id3_tags_procedure( album_writer )
+        shutil.move( absolute_path_album_dir, destination_directory )
+        move_catalog_album_procedure( absolute_path_album_dir, target_dir )
+        return
+
+    pending = dict( album_writer or list() )
+    os.makedirs( target_dir )
+    for each_file in get_list_of_directory_content( absolute_path_album_dir,
+                                                    list_subdirectories=False ):
+        target_file = os.path.join( target_dir, os.path.split(each_file)[1] )
+        audio = pending.get( each_file )
+        try:
+            if audio is not None:
+                audio.save_to( target_file, source=each_file, v1=0 )
+                shutil.copystat( each_file, target_file )
+                continue
+        except Exception as e:
+            log.error('Failed: %s: <%s> %s' % (each_file, type(e), str(e)))
+        shutil.copy2( each_file, target_file )
+        if audio is not None:
+            try:
+                audio.save( target_file, v1=0 )
+            except Exception as e:
+                log.error('Failed: %s: <%s> %s' % (target_file, type(e), str(e)))
+    shutil.copystat( absolute_path_album_dir, target_dir )
+    shutil.rmtree( absolute_path_album_dir )
+    move_catalog_album_procedure( absolute_path_album_dir, target_dir )
+
+
+def move_catalog_album_procedure( absolute_path_album_dir, new_absolute_path_album_dir ):
+    """
+    Updates the catalog after the album directory got moved, or after its
+    files were written in place if both paths are the same
+    """
+    if CATALOG is None:
+        return
+    try:
+        with CATALOG_LOCK:
+            catalog.move_album( CATALOG, absolute_path_album_dir, new_absolute_path_album_dir )
+    except Exception as e:
+        log.error('Failed to update catalog for "%s": <%s> %s' % (new_absolute_path_album_dir, type(e), str(e)))
+
+
+def move_album_procedure( album_dir, artist_dir, result ):
+    """
+    Moves the processed album directory to the output directory matching
+    `result` (see `process_album_directory()`), or only writes its pending
+    ID3 tags if it got queued, refreshing the stat values of its files in
+    the catalog, which recorded them before. Holds the I/O slots of the
+    album's device and of the output directory's device meanwhile (see
+    `move_io_procedure()`).
+    """
+    if result is None:
+        with device_io_procedure( [ scheduler.get_device( album_dir ) ] ):
+            save_pending_id3_tags_procedure( PENDING_ALBUM_WRITERS.pop( album_dir, None ) )
+        move_catalog_album_procedure( album_dir, album_dir )
+        return
+    if result:
+        destination_directory = os.path.join( 
+            CONFIG_DATA['output_directory_success'],
+            os.path.split(artist_dir)[1] )
+    else:
+        destination_directory = os.path.join( 
+            CONFIG_DATA['output_directory_not_success'],
+            os.path.split(artist_dir)[1] )
+    make_directories( destination_directory )
+    with move_io_procedure( album_dir, destination_directory ):
+        write_album_directory( album_dir, destination_directory )
+
+
+def album_needs_lookups( absolute_path_album_dir ):
+    """
+    Cheap pre-scan for `process_root_directories()`, only reading ID3 tags:
+    returns True if an MP3 file of the album directory lacks a title, so
+    processing it needs fingerprinting and the web services, else False.
+    Holds the I/O slot of the album's device meanwhile.
+    """
+    if len( get_list_of_directory_content( absolute_path_album_dir ) or list() ) > 0:
+        # Not processed any further, see `process_album_directory()`
+        return False
+    with device_io_procedure( [ scheduler.get_device( absolute_path_album_dir ) ] ):
+        for each_file in get_list_of_directory_content( absolute_path_album_dir,
+                                                        list_subdirectories=False ) or list():
+            if is_file_mp3( each_file ) and is_title_missing( attempt_get_id3_values( each_file )[2] ):
+                return True
+    return False
+
+
+def process_and_move_album( album_dir, artist_dir ):
+    """
+    Processes and moves the album directory, returns the album result in the
+    catalog's terms ('error' if processing failed)
+    """
+    try:
+        result = process_album_directory( album_dir )
+        move_album_procedure( album_dir, artist_dir, result )
+    except Exception as e:
+        log.error('Failed to process "%s": <%s> %s' % (album_dir, type(e), str(e)))
+        # Drop the tags which weren't written
+        pop_pending_id3_tags( album_dir )
+        PENDING_ALBUM_WRITERS.pop( album_dir, None )
+        return 'error'
+    if result is None:
+        return catalog.ALBUM_RESULT_QUEUED
+    return catalog.ALBUM_RESULT_SUCCESS if result else catalog.ALBUM_RESULT_NOT_SUCCESS
+
+
+def process_local_album_job( job ):
+    """
+    Handler of the local lane, `job` is <album directory>, <artist directory>
+    """
+    album_dir, artist_dir = job
+    return [ process_and_move_album( album_dir, artist_dir ) ]
+
+
+def process_network_artist_job( job ):
+    """
+    Handler of the network lane, `job` is <artist directory>, <list of album
+    directories>. The albums are processed one after the other, so they share
+    the artist's prefetched discography.
+    """
+    artist_dir, album_dirs = job
+    try:
+        return [ process_and_move_album( album_dir, artist_dir ) for album_dir in album_dirs ]
+    finally:
+        # Evict the releases prefetched for this artist directory
+        online_resources.clear_artist_discography( artist_dir )
+
+
 def process_root_directories():
     """
+    Processes the album directories in two lanes (see `scheduler.Lane`), so
+    albums waiting for fingerprinting and rate limited web service lookups
+    don't hold up the others. After a pre-scan of their tags (see
+    `album_needs_lookups()`), albums whose MP3 files all have titles go to
+    the local lane, with the configured number of 'local_workers'. The other
+    albums go to the network lane, one job per artist, whose number of
+    workers follows the web services' rate limits (see
+    `online_resources.get_web_service_concurrency()`) unless configured as
+    'network_workers'.
+    At most 'io_workers_per_device' albums at a time do I/O on the same
+    device (see `scheduler.DeviceSlots`). Jobs of both lanes only hold the
+    device of their album directory while reading its tags, fingerprinting
+    and writing tags, and moving an album also holds the device of the output
+    directory (see `move_io_procedure()`). So albums on other devices, the
+    lookups and the work between the I/O go on meanwhile.
+    The statistics of both lanes and of each device are logged at the end.
+    With `OFFLINE_FIRST`, albums already queued are left for `resolve_queue()`
     """
-    for root_dir in CONFIG_DATA['root_directories']:
-        log.debug('Processing root directory "%s"...' % root_dir)
-        for artist_dir in get_list_of_directory_content( root_dir ):
-            for album_dir in get_list_of_directory_content( artist_dir ):
-                result = process_album_directory( album_dir )
-                if result:
-                    destination_directory = os.path.join( 
-                        CONFIG_DATA['output_directory_success'],
-                        os.path.split(artist_dir)[1] )
-                    if not os.path.exists( destination_directory ):
-                        os.makedirs( destination_directory )
-                    shutil.move( album_dir, destination_directory )
-                else:
-                    destination_directory = os.path.join( 
-                        CONFIG_DATA['output_directory_not_success'],
-                        os.path.split(artist_dir)[1] )
-                    if not os.path.exists( destination_directory ):
-                        os.makedirs( destination_directory )
-                    shutil.move( album_dir, destination_directory )
-            # If `artist_dir` is now empty, delete `artist_dir`
-            if len(os.listdir( artist_dir )) == 0:
+    global DEVICE_SLOTS
+    scheduler_config = dict( DEFAULT_SCHEDULER_CONFIG )
+    scheduler_config.update( CONFIG_DATA.get( 'scheduler', dict() ) )
+    DEVICE_SLOTS = scheduler.DeviceSlots( scheduler_config['io_workers_per_device'] )
+    queued_album_dirs = set()
+    if OFFLINE_FIRST and CATALOG is not None:
+        queued_album_dirs = set( album['album_dir'] for album in catalog.get_queued_albums( CATALOG ) )
+    local_lane = scheduler.Lane(    'Local',
+                                    process_local_album_job,
+                                    scheduler_config['local_workers'],
+                                    scheduler_config['local_queue_depth'],
+                                    log )
+    network_lane = scheduler.Lane(  'Network',
+                                    process_network_artist_job,
+                                    scheduler_config['network_workers']
+                                        or online_resources.get_web_service_concurrency( CONFIG_DATA ),
+                                    scheduler_config['network_queue_depth'],
+                                    log )
+    artist_dirs = list()
+    try:
+        for root_dir in CONFIG_DATA['root_directories']:
+            log.debug('Processing root directory "%s"...' % root_dir)
+            for artist_dir in get_list_of_directory_content( root_dir ):
+                artist_dirs.append( artist_dir )
+                network_album_dirs = list()
+                for album_dir in get_list_of_directory_content( artist_dir ):
+                    if album_dir in queued_album_dirs:
+                        log.debug('Album directory "%s" is queued, skipping' % album_dir)
+                    elif album_needs_lookups( album_dir ):
+                        network_album_dirs.append( album_dir )
+                    else:
+                        local_lane.put( (album_dir, artist_dir) )
+                if len( network_album_dirs ) > 0:
+                    network_lane.put( (artist_dir, network_album_dirs) )
+    except:
+        local_lane.close( cancel=True )
+        network_lane.close( cancel=True )
+        raise
+    local_lane.close()
+    network_lane.close()
+    log.info( '%s\n%s\n%s' % (local_lane.get_report(), network_lane.get_report(), DEVICE_SLOTS.get_report()) )
+    DEVICE_SLOTS = None
+
+    # Delete the artist directories which are now empty
+    for artist_dir in artist_dirs:
+        if os.path.isdir( artist_dir ) and len(os.listdir( artist_dir )) == 0:
+            os.rmdir( artist_dir )
+
+
+def resolve_queue():
+    """
+    Resolves the albums queued by runs with `OFFLINE_FIRST`: the files still
+    lacking titles are looked up in bulk, reusing their queued fingerprints if
+    the files weren't modified since, then each album is processed again and
+    moved like by `process_root_directories()`. Files the bulk lookup found
+    no match for aren't looked up one by one again. Albums stay queued if the
+    lookups fail.
+    """
+    likely_artists = dict()
+    albums = list()
+    for album in catalog.get_queued_albums( CATALOG ):
+        if not os.path.isdir( album['album_dir'] ):
+            log.warning('Queued album directory "%s" does not exist anymore' % album['album_dir'])
+            continue
+        albums.append( album )
+        for queued_file in catalog.get_queued_files( CATALOG, album['album_dir'] ):
+            stat_values = catalog.get_file_stat_values( queued_file['path'] )
+            if len( stat_values ) == 0:
+                continue
+            if queued_file['fingerprint'] is not None \
+            and all( stat_values[name] == queued_file[name] for name in stat_values ):
+                online_resources.FINGERPRINTS[queued_file['path']] = \
+                    (queued_file['duration'], queued_file['fingerprint'])
+            likely_artists[queued_file['path']] = album['artist']
+    log.info('Resolving %d queued file(s) of %d album(s)' % (len(likely_artists), len(albums)))
+    try:
+        if not online_resources.resolve_fingerprints_in_bulk( likely_artists, CONFIG_DATA, log ):
+            log.error('Bulk lookup failed, albums stay queued')
+            return
+
+        previous_artist_dir = None
+        for album in albums:
+            album_dir = album['album_dir']
+            artist_dir = os.path.split(album_dir)[0]
+            if artist_dir != previous_artist_dir:
+                online_resources.clear_artist_discography()
+                previous_artist_dir = artist_dir
+            process_and_move_album( album_dir, artist_dir )
+            if os.path.isdir( artist_dir ) and len(os.listdir( artist_dir )) == 0:
                 os.rmdir( artist_dir )
+    finally:
+        online_resources.FINGERPRINTS.clear()
+        online_resources.RESOLVED_MATCHES.clear()
 
 
 def set_up_input_and_output_directories():
@@ -455,10 +1046,29 @@ def set_up_input_and_output_directories():
             raise RuntimeError('"%s" does not exist.' % root_dir)
 
 
+def print_catalog_report():
+    """
+    Prints what's left to fix according to the catalog, without scanning the
+    library
+    """
+    albums, files = catalog.get_remaining_work( CATALOG )
+    print('%d album(s) not processed successfully:' % len(albums))
+    for album in albums:
+        print('    %s' % album['album_dir'])
+    print('%d MP3 file(s) not tagged:' % len(files))
+    for each_file in files:
+        print('    %s (%s)' % (each_file['path'], each_file['result']))
+
+
 def cleanup_procedure():
     """
     Call this before program exits
     """
+    if CATALOG is not None:
+        CATALOG.close()
+    online_resources.close_fingerprint_index()
+    online_resources.close_acoustid_mirror()
+    online_resources.close_http_transport()
     if LOG_FILE_HANDLER is not None:
         LOG_FILE_HANDLER.close()
     if DEVNULL is not None:
@@ -477,14 +1087,41 @@ if __name__ == '__main__':
     global DEVNULL
     DEVNULL = open( os.devnull, 'wb' )
 
+    global CATALOG
+    CATALOG = catalog.open_catalog(
+        CONFIG_DATA.get( 'catalog_path', 'mp3_tag_fixer_catalog.sqlite' ) )
+
+    if sys.argv[1:] == ['report']:
+        print_catalog_report()
+        cleanup_procedure()
+        sys.exit(0)
+
+    global OFFLINE_FIRST
+    OFFLINE_FIRST = CONFIG_DATA.get( 'offline_first', False ) and sys.argv[1:] != ['resolve-queue']
+
+    if sys.argv[1:2] == ['build-acoustid-mirror']:
+        # Optionally followed by paths of dump files to import
+        online_resources.set_up_fingerprint_index( CONFIG_DATA, log )
+        online_resources.build_acoustid_mirror( CONFIG_DATA, sys.argv[2:], log )
+        cleanup_procedure()
+        sys.exit(0)
+
     try:
         set_up_input_and_output_directories()
 
         online_resources.set_up_musicbrainzngs(  
             CONFIG_DATA['musicbrainz_web_service']['user_agent_app'], 
             CONFIG_DATA['musicbrainz_web_service']['user_agent_version'] )
-
-        process_root_directories()
+        online_resources.set_up_rate_limiting( CONFIG_DATA )
+        online_resources.set_up_fpcalc( CONFIG_DATA )
+        online_resources.set_up_http_transport( CONFIG_DATA, log )
+        online_resources.set_up_fingerprint_index( CONFIG_DATA, log )
+        online_resources.set_up_acoustid_mirror( CONFIG_DATA, log )
+
+        if sys.argv[1:] == ['resolve-queue']:
+            resolve_queue()
+        else:
+            process_root_directories()
 
     except KeyboardInterrupt:
         log.info('Process terminated by user.')
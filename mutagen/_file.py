@@ -7,7 +7,8 @@
 
 import warnings
 
-from mutagen._util import DictMixin, loadfile
+from mutagen._util import DictMixin, loadfile, MutagenError, _openfile, \
+    _same_file, _CopyingFile
 from mutagen._compat import izip
 
 
@@ -124,6 +125,12 @@ class FileType(DictMixin):
 
         Save metadata tags.
 
+        Pass atomic=True to save to a copy of the file in the same
+        directory, which replaces the file once the tags are written.
+        A crash while saving then leaves the original file intact.
+        Symlinks are followed and the file they point to gets replaced;
+        files with more than one hard link are saved in place instead.
+
         Raises:
             MutagenError: if saving wasn't possible
         """
@@ -131,6 +138,36 @@ class FileType(DictMixin):
         if self.tags is not None:
             return self.tags.save(filething, **kwargs)
 
+    def save_to(self, dest, **kwargs):
+        """save_to(dest, **kwargs)
+
+        Write a copy of the loaded file with the current tags to dest,
+        leaving the loaded file untouched. dest gets replaced.
+
+        Where `save` would resize the tags, the part of the file in front
+        of them, the new tags and the rest of the file get written to
+        dest in one sequential pass, with the kernel copying the data if
+        possible. Keyword arguments get passed to `save`.
+
+        Raises:
+            MutagenError: if saving wasn't possible or dest is the
+                loaded file
+        """
+
+        with _openfile(None, self.filename, None, None, False, False) as src:
+            with _openfile(None, dest, None, None, True, True) as dst:
+                if _same_file(src.fileobj, dst.fileobj):
+                    raise MutagenError(
+                        "can't save a copy over the file itself")
+                fileobj = _CopyingFile(src.fileobj, dst.fileobj, dst.name)
+                try:
+                    result = self.save(dst._replace(fileobj=fileobj), **kwargs)
+                    # the tags didn't need to be written
+                    fileobj._copy()
+                except (IOError, EOFError) as e:
+                    raise MutagenError(e)
+                return result
+
     def pprint(self):
         """
         Returns:
@@ -12,10 +12,13 @@ You should not rely on the interfaces here being stable. They are
 intended for internal use in Mutagen only.
 """
 
+import os
 import sys
+import stat
 import struct
 import codecs
 import errno
+import tempfile
 
 from collections import namedtuple
 from contextlib import contextmanager
@@ -80,29 +83,37 @@ def fileobj_name(fileobj):
 
 
 def loadfile(method=True, writable=False, create=False):
+    """A decorator for functions taking a `filething` as a first argument.
+
+    If writable is True the decorated function also accepts an `atomic`
+    keyword argument. If it is True the changes are made to a copy of the
+    file, which replaces the original file once the function returns
+    without an error.
+    """
 
     def convert_file_args(args, kwargs):
         filething = args[0] if args else None
         filename = kwargs.pop("filename", None)
         fileobj = kwargs.pop("fileobj", None)
-        return filething, filename, fileobj, args[1:], kwargs
+        atomic = writable and kwargs.pop("atomic", False)
+        return filething, filename, fileobj, atomic, args[1:], kwargs
 
     def wrap(func):
 
         @wraps(func)
         def wrapper(self, *args, **kwargs):
-            filething, filename, fileobj, args, kwargs = \
+            filething, filename, fileobj, atomic, args, kwargs = \
                 convert_file_args(args, kwargs)
             with _openfile(self, filething, filename, fileobj,
-                           writable, create) as h:
+                           writable, create, atomic) as h:
                 return func(self, h, *args, **kwargs)
 
         @wraps(func)
         def wrapper_func(*args, **kwargs):
-            filething, filename, fileobj, args, kwargs = \
+            filething, filename, fileobj, atomic, args, kwargs = \
                 convert_file_args(args, kwargs)
             with _openfile(None, filething, filename, fileobj,
-                           writable, create) as h:
+                           writable, create, atomic) as h:
                 return func(h, *args, **kwargs)
 
         return wrapper if method else wrapper_func
@@ -138,7 +149,8 @@ can be used for file type detection
 
 
 @contextmanager
-def _openfile(instance, filething, filename, fileobj, writable, create):
+def _openfile(instance, filething, filename, fileobj, writable, create,
+              atomic=False):
     """yields a FileThing
 
     Args:
@@ -148,12 +160,19 @@ def _openfile(instance, filething, filename, fileobj, writable, create):
         writable (bool): if the file should be opened
         create (bool): if the file should be created if it doesn't exist.
             implies writable
+        atomic (bool): if a copy of the file should be opened instead,
+            which replaces the file if no exception gets raised.
+            Symlinks get resolved first, files with more than one hard
+            link are opened in place, since a new file would split them.
+            implies writable
     Raises:
         MutagenError: In case opening the file failed
         TypeError: in case neither a file name or a file object is passed
+        ValueError: in case atomic is passed with a file object
     """
 
     assert not create or writable
+    assert not atomic or writable
 
     # to allow stacked context managers, just pass the result through
     if isinstance(filething, FileThing):
@@ -174,9 +193,16 @@ def _openfile(instance, filething, filename, fileobj, writable, create):
         elif filename is None:
             filename = getattr(instance, "filename", None)
 
+    if atomic and fileobj is not None:
+        raise ValueError("atomic saving needs a file name")
+
     if fileobj is not None:
         verify_fileobj(fileobj, writable=writable)
         yield FileThing(fileobj, filename, filename or fileobj_name(fileobj))
+    elif filename is not None and atomic and _replaceable(filename):
+        verify_filename(filename)
+        with _replacing_copy(os.path.realpath(filename)) as fileobj:
+            yield FileThing(fileobj, filename, filename)
     elif filename is not None:
         verify_filename(filename)
         try:
@@ -197,6 +223,305 @@ def _openfile(instance, filething, filename, fileobj, writable, create):
         raise TypeError("Missing filename or fileobj argument")
 
 
+def _replaceable(filename):
+    """If the file exists and can be replaced by a copy without changing
+    anything besides its content. Not the case for files with multiple
+    hard links.
+    """
+
+    try:
+        return os.stat(filename).st_nlink <= 1
+    except (OSError, TypeError, ValueError):
+        return False
+
+
+class _CopyingFile(object):
+    """A file object for writing a changed copy of the file object src to
+    the file object dst, as done by _replacing_copy() and
+    FileType.save_to().
+
+    Reads come from the original file until something changes. The first
+    insert_bytes() or delete_bytes() then writes the new file in one
+    sequential pass: the data in front of the change, the resized gap and
+    the rest of the file behind it, with the kernel copying the data
+    where possible. Any other change copies the whole file first. After
+    that everything happens in the copy.
+    """
+
+    def __init__(self, src, dst, name):
+        self._src = src
+        self._dst = dst
+        self._fileobj = src
+        self.name = name
+
+    @property
+    def _copied(self):
+        return self._fileobj is self._dst
+
+    def _copy(self):
+        if not self._copied:
+            pos = self._src.tell()
+            clone_file(self._src, self._dst)
+            self._dst.seek(pos)
+            self._fileobj = self._dst
+
+    def _resize(self, size, offset, insert):
+        """Writes the copy with size bytes inserted or deleted at offset.
+
+        Returns False if the copy was already written.
+        """
+
+        if self._copied:
+            return False
+
+        src, dst = self._src, self._dst
+        filesize = get_size(src)
+        assert offset <= filesize
+        rest = offset if insert else offset + size
+        dst_rest = offset + size if insert else offset
+        dst.truncate(0)
+        copy_bytes(src, 0, dst, 0, offset)
+        copy_bytes(src, rest, dst, dst_rest, filesize - rest)
+        # in case nothing follows the inserted gap
+        dst.truncate(dst_rest + filesize - rest)
+        dst.flush()
+        dst.seek(0)
+        self._fileobj = dst
+        return True
+
+    def read(self, *args):
+        return self._fileobj.read(*args)
+
+    def seek(self, *args):
+        return self._fileobj.seek(*args)
+
+    def tell(self):
+        return self._fileobj.tell()
+
+    def flush(self):
+        return self._fileobj.flush()
+
+    def write(self, data):
+        self._copy()
+        return self._dst.write(data)
+
+    def truncate(self, *args):
+        self._copy()
+        return self._dst.truncate(*args)
+
+    def fileno(self):
+        # whoever needs it might write to it directly
+        self._copy()
+        return self._dst.fileno()
+
+
+@contextmanager
+def _replacing_copy(filename):
+    """Yields a new file in the same directory with the content of the
+    file, see _CopyingFile.
+
+    If no exception gets raised the copy gets synced to disk and renamed
+    over the file, otherwise it gets removed. filename must not be a
+    symlink, or the link itself would get replaced.
+
+    Raises:
+        MutagenError: In case creating the file failed
+    """
+
+    dirname, basename = os.path.split(filename)
+    if isinstance(filename, bytes):
+        prefix, suffix = b"." + basename + b".", b".tmp"
+        dirname = dirname or b"."
+    else:
+        prefix, suffix = u"." + basename + u".", u".tmp"
+        dirname = dirname or u"."
+
+    try:
+        src = open(filename, "rb")
+    except EnvironmentError as e:
+        raise MutagenError(e)
+
+    with src:
+        try:
+            st = os.fstat(src.fileno())
+            fd, temp_name = tempfile.mkstemp(suffix, prefix, dirname)
+            fileobj = os.fdopen(fd, "rb+")
+            try:
+                os.chmod(temp_name, stat.S_IMODE(st.st_mode))
+                if hasattr(os, "chown"):
+                    try:
+                        os.chown(temp_name, st.st_uid, st.st_gid)
+                    except OSError:
+                        pass
+            except:
+                fileobj.close()
+                os.remove(temp_name)
+                raise
+        except EnvironmentError as e:
+            raise MutagenError(e)
+
+        try:
+            with fileobj:
+                replacing = _CopyingFile(src, fileobj, temp_name)
+                yield replacing
+                # nothing changed, the file still has to be a copy
+                replacing._copy()
+                fileobj.flush()
+                os.fsync(fileobj.fileno())
+        except:
+            os.remove(temp_name)
+            raise
+
+    try:
+        _replace_file(temp_name, filename)
+    except EnvironmentError as e:
+        os.remove(temp_name)
+        raise MutagenError(e)
+    _sync_dir(dirname)
+
+
+def _replace_file(src, dst):
+    """Renames src to dst, replacing dst"""
+
+    replace = getattr(os, "replace", None)
+    if replace is not None:
+        replace(src, dst)
+    elif os.name == "nt":
+        # py2 can't rename over an existing file on Windows
+        os.remove(dst)
+        os.rename(src, dst)
+    else:
+        os.rename(src, dst)
+
+
+def _sync_dir(dirname):
+    """Makes the last rename in dirname durable, if the platform allows"""
+
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except (OSError, AttributeError):
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+_FICLONE = 0x40049409
+
+
+def _same_file(fileobj, other):
+    """If both file objects refer to the same file on disk, e.g. the same
+    path or a hard link of it.
+    """
+
+    try:
+        return os.path.samestat(
+            os.fstat(fileobj.fileno()), os.fstat(other.fileno()))
+    except (AttributeError, EnvironmentError, ValueError):
+        return False
+
+
+def clone_file(src, dst):
+    """Replaces the content of the file object dst with the content of the
+    file object src. Both are left positioned at their start.
+
+    Tries to share the data with a reflink first and to let the kernel
+    copy it second, before falling back to reading and writing it.
+    """
+
+    src.flush()
+    dst.flush()
+
+    try:
+        import fcntl
+        fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    except (ImportError, EnvironmentError, ValueError, AttributeError):
+        src.seek(0, 2)
+        size = src.tell()
+        dst.truncate(0)
+        copy_bytes(src, 0, dst, 0, size)
+        dst.truncate(size)
+
+    dst.seek(0, 2)
+    dst.seek(0)
+    src.seek(0)
+
+
+_COPY_UNSUPPORTED = set(getattr(errno, name, None) for name in [
+    "EXDEV", "EINVAL", "ENOSYS", "EBADF", "EOPNOTSUPP", "ENOTSUP"])
+
+
+def _copy_file_range(src_fd, src_offset, dst_fd, dst_offset, count):
+    copied = os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+    if not copied:
+        raise EOFError
+    return copied
+
+
+def _sendfile(src_fd, src_offset, dst_fd, dst_offset, count):
+    os.lseek(dst_fd, dst_offset, 0)
+    copied = os.sendfile(dst_fd, src_fd, src_offset, count)
+    if not copied:
+        raise EOFError
+    return copied
+
+
+def copy_bytes(src, src_offset, dst, dst_offset, count, BUFFER_SIZE=2 ** 16):
+    """Copies count bytes at src_offset in the file object src to
+    dst_offset in the file object dst. dst is left after the copied data.
+
+    Lets the kernel copy the data if both are real files, otherwise reads
+    and writes it.
+
+    Raises:
+        EOFError: if src ends early
+        IOError
+    """
+
+    copied = 0
+    try:
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        funcs = []
+    else:
+        src.flush()
+        dst.flush()
+        funcs = [f for f in (getattr(os, "copy_file_range", None) and
+                             _copy_file_range,
+                             getattr(os, "sendfile", None) and _sendfile)
+                 if f]
+
+    for func in funcs:
+        try:
+            while copied < count:
+                copied += func(src_fd, src_offset + copied,
+                               dst_fd, dst_offset + copied, count - copied)
+        except OSError as e:
+            # not supported for this kind of file, try the next way
+            if e.errno not in _COPY_UNSUPPORTED:
+                raise
+        else:
+            break
+    else:
+        src.seek(src_offset + copied)
+        dst.seek(dst_offset + copied)
+        while copied < count:
+            data = src.read(min(BUFFER_SIZE, count - copied))
+            if not data:
+                raise EOFError
+            dst.write(data)
+            copied += len(data)
+        dst.flush()
+
+    # the file might have changed under the buffers of dst
+    dst.seek(0, 2)
+    dst.seek(dst_offset + count)
+
+
 class MutagenError(Exception):
     """Base class for all custom exceptions in mutagen
 
@@ -486,20 +811,211 @@ def seek_end(fileobj, offset):
         fileobj.seek(-offset, 2)
 
 
+@enum
+class ResizeMethod(object):
+    """How insert_bytes(), delete_bytes() and resize_bytes() changed the
+    file.
+    """
+
+    NONE = 0
+    """Nothing had to be moved"""
+
+    FALLOCATE = 1
+    """The file extents were shifted by the file system, no data was
+    moved
+    """
+
+    MMAP = 2
+    """The data was moved using mmap"""
+
+    BUFFERED = 3
+    """The data was moved by reading and writing it"""
+
+    COPY = 4
+    """The data was copied to the new file of an atomic save"""
+
+
+_FALLOC_FL_COLLAPSE_RANGE = 0x08
+_FALLOC_FL_INSERT_RANGE = 0x20
+
+_fallocate = None
+
+
+def _get_fallocate():
+    """Returns the libc fallocate function or None if not available"""
+
+    global _fallocate
+
+    if _fallocate is None:
+        _fallocate = False
+        if sys.platform.startswith("linux"):
+            try:
+                import ctypes
+                libc = ctypes.CDLL(None, use_errno=True)
+                func = getattr(libc, "fallocate64", None) or libc.fallocate
+            except (ImportError, OSError, AttributeError):
+                pass
+            else:
+                func.argtypes = [ctypes.c_int, ctypes.c_int,
+                                 ctypes.c_int64, ctypes.c_int64]
+                func.restype = ctypes.c_int
+                _fallocate = func
+
+    return _fallocate or None
+
+
+_extents_supported = {}
+
+
+def _probe_extents(path, block_size):
+    """Checks if the file system containing path can collapse and insert
+    file ranges by trying it on a temporary file in the same directory.
+    """
+
+    func = _get_fallocate()
+    if func is None:
+        return False
+
+    try:
+        with tempfile.TemporaryFile(dir=os.path.dirname(path)) as temp:
+            temp.write(b"\x00" * (block_size * 2))
+            temp.flush()
+            fd = temp.fileno()
+            return (
+                func(fd, _FALLOC_FL_COLLAPSE_RANGE, 0, block_size) == 0 and
+                func(fd, _FALLOC_FL_INSERT_RANGE, 0, block_size) == 0)
+    except EnvironmentError:
+        return False
+
+
+def resize_alignment(fobj):
+    """Returns the size insertions and deletions in the file should be a
+    multiple of, so insert_bytes() and delete_bytes() can shift the file
+    extents instead of moving the data. Returns None if that isn't
+    possible for the file.
+
+    Whether the file system supports it gets probed once per device.
+    """
+
+    if _get_fallocate() is None or isinstance(fobj, _CopyingFile):
+        # nothing gets shifted when saving to a new file
+        return None
+
+    try:
+        path = os.path.abspath(fobj.name)
+        st = os.fstat(fobj.fileno())
+    except (AttributeError, TypeError, EnvironmentError, ValueError):
+        return None
+
+    block_size = st.st_blksize
+    if not block_size:
+        return None
+
+    if st.st_dev not in _extents_supported:
+        _extents_supported[st.st_dev] = _probe_extents(path, block_size)
+
+    if not _extents_supported[st.st_dev]:
+        return None
+    return block_size
+
+
+def _fallocate_range(fobj, mode, offset, size):
+    """Inserts or collapses a range of size bytes at offset, which both
+    have to be multiples of the file system block size.
+
+    Returns True if it worked.
+    """
+
+    func = _get_fallocate()
+    if func is None:
+        return False
+
+    fobj.flush()
+    if func(fobj.fileno(), mode, offset, size) != 0:
+        try:
+            st = os.fstat(fobj.fileno())
+        except EnvironmentError:
+            pass
+        else:
+            _extents_supported[st.st_dev] = False
+        return False
+
+    # the file changed underneath any read buffer
+    fobj.seek(0, 2)
+    return True
+
+
+def _shift_extents(fobj, size, offset, filesize, insert):
+    """Tries to insert or delete size bytes at offset by shifting the
+    file extents. Only the part of the block in front of offset has to be
+    moved, size has to be a multiple of the block size.
+
+    Returns True if it worked.
+    """
+
+    block_size = resize_alignment(fobj)
+    if block_size is None or size % block_size:
+        return False
+
+    start = offset - offset % block_size
+    head = offset - start
+
+    if insert:
+        if offset >= filesize:
+            return False
+        if not _fallocate_range(
+                fobj, _FALLOC_FL_INSERT_RANGE, start, size):
+            return False
+        if head:
+            fobj.seek(start + size)
+            data = fobj.read(head)
+            fobj.seek(start)
+            fobj.write(data)
+    else:
+        if offset + size >= filesize:
+            return False
+        if head:
+            # this only overwrites data which gets deleted, so falling
+            # back later on is still possible
+            fobj.seek(start)
+            data = fobj.read(head)
+            fobj.seek(start + size)
+            fobj.write(data)
+        if not _fallocate_range(
+                fobj, _FALLOC_FL_COLLAPSE_RANGE, start, size):
+            return False
+
+    fobj.flush()
+    return True
+
+
 def insert_bytes(fobj, size, offset, BUFFER_SIZE=2 ** 16):
     """Insert size bytes of empty space starting at offset.
 
     fobj must be an open file object, open rb+ or
-    equivalent. Mutagen tries to use mmap to resize the file, but
-    falls back to a significantly slower method if mmap fails.
+    equivalent. On Linux, if size is a multiple of the file system block
+    size, Mutagen tries to let the file system shift the data. Otherwise
+    it tries to use mmap to resize the file, but falls back to a
+    significantly slower method if mmap fails.
+
+    Returns:
+        ResizeMethod: how the data was moved
     """
 
     assert 0 < size
     assert 0 <= offset
 
+    if isinstance(fobj, _CopyingFile) and fobj._resize(size, offset, True):
+        return ResizeMethod.COPY
+
     fobj.seek(0, 2)
     filesize = fobj.tell()
     movesize = filesize - offset
+
+    if _shift_extents(fobj, size, offset, filesize, True):
+        return ResizeMethod.FALLOCATE
+
+    fobj.seek(0, 2)
     fobj.write(b'\x00' * size)
     fobj.flush()
 
@@ -510,6 +1026,7 @@ def insert_bytes(fobj, size, offset, BUFFER_SIZE=2 ** 16):
             file_map.move(offset + size, offset, movesize)
         finally:
             file_map.close()
+        return ResizeMethod.MMAP
     except (ValueError, EnvironmentError, ImportError, AttributeError):
         # handle broken mmap scenarios, BytesIO()
         fobj.truncate(filesize)
@@ -542,24 +1059,37 @@ def insert_bytes(fobj, size, offset, BUFFER_SIZE=2 ** 16):
             movesize -= thismove
 
         fobj.flush()
+        return ResizeMethod.BUFFERED
 
 
 def delete_bytes(fobj, size, offset, BUFFER_SIZE=2 ** 16):
     """Delete size bytes of empty space starting at offset.
 
     fobj must be an open file object, open rb+ or
-    equivalent. Mutagen tries to use mmap to resize the file, but
-    falls back to a significantly slower method if mmap fails.
+    equivalent. On Linux, if size is a multiple of the file system block
+    size, Mutagen tries to let the file system shift the data. Otherwise
+    it tries to use mmap to resize the file, but falls back to a
+    significantly slower method if mmap fails.
+
+    Returns:
+        ResizeMethod: how the data was moved
     """
 
     assert 0 < size
     assert 0 <= offset
 
+    if isinstance(fobj, _CopyingFile) and fobj._resize(size, offset, False):
+        return ResizeMethod.COPY
+
     fobj.seek(0, 2)
     filesize = fobj.tell()
     movesize = filesize - offset - size
     assert 0 <= movesize
 
+    if movesize > 0 and _shift_extents(fobj, size, offset, filesize, False):
+        return ResizeMethod.FALLOCATE
+
+    method = ResizeMethod.NONE
     if movesize > 0:
         fobj.flush()
         try:
@@ -569,6 +1099,7 @@ def delete_bytes(fobj, size, offset, BUFFER_SIZE=2 ** 16):
                 file_map.move(offset, offset + size, movesize)
             finally:
                 file_map.close()
+            method = ResizeMethod.MMAP
         except (ValueError, EnvironmentError, ImportError, AttributeError):
             # handle broken mmap scenarios, BytesIO()
             fobj.seek(offset + size)
@@ -579,23 +1110,80 @@ def delete_bytes(fobj, size, offset, BUFFER_SIZE=2 ** 16):
                 offset += len(buf)
                 fobj.seek(offset + size)
                 buf = fobj.read(BUFFER_SIZE)
+            method = ResizeMethod.BUFFERED
     fobj.truncate(filesize - size)
     fobj.flush()
+    return method
+
+
+def move_bytes(fobj, dest, src, count, BUFFER_SIZE=2 ** 16):
+    """Moves count bytes from src to dest in the file. The ranges may
+    overlap and the file has to be large enough already.
+
+    fobj must be an open file object, open rb+ or
+    equivalent. Mutagen tries to use mmap to move the data, but
+    falls back to a significantly slower method if mmap fails.
+    """
+
+    assert 0 <= src and 0 <= dest and 0 <= count
+
+    if dest == src or count == 0:
+        return
+
+    fobj.seek(0, 2)
+    filesize = fobj.tell()
+    assert max(dest, src) + count <= filesize
+
+    fobj.flush()
+    try:
+        import mmap
+        file_map = mmap.mmap(fobj.fileno(), filesize)
+        try:
+            file_map.move(dest, src, count)
+        finally:
+            file_map.close()
+    except (ValueError, EnvironmentError, ImportError, AttributeError):
+        # handle broken mmap scenarios, BytesIO()
+        if dest < src:
+            moved = 0
+            while moved < count:
+                thismove = min(BUFFER_SIZE, count - moved)
+                fobj.seek(src + moved)
+                data = fobj.read(thismove)
+                fobj.seek(dest + moved)
+                fobj.write(data)
+                moved += thismove
+        else:
+            # move from the end so nothing gets overwritten before it
+            # was read
+            left = count
+            while left:
+                thismove = min(BUFFER_SIZE, left)
+                left -= thismove
+                fobj.seek(src + left)
+                data = fobj.read(thismove)
+                fobj.seek(dest + left)
+                fobj.write(data)
+        fobj.flush()
 
 
 def resize_bytes(fobj, old_size, new_size, offset):
     """Resize an area in a file adding and deleting at the end of it.
     Does nothing if no resizing is needed.
+
+    Returns:
+        ResizeMethod: how the data was moved
     """
 
     if new_size < old_size:
         delete_size = old_size - new_size
         delete_at = offset + new_size
-        delete_bytes(fobj, delete_size, delete_at)
+        return delete_bytes(fobj, delete_size, delete_at)
     elif new_size > old_size:
         insert_size = new_size - old_size
         insert_at = offset + old_size
-        insert_bytes(fobj, insert_size, insert_at)
+        return insert_bytes(fobj, insert_size, insert_at)
+    return ResizeMethod.NONE
 
 
 def dict_match(d, key, default=None):
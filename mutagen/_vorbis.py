@@ -17,9 +17,11 @@ The specification is at http://www.xiph.org/vorbis/doc/v-comment.html.
 """
 
 import sys
+import struct
+import binascii
 
 import mutagen
-from ._compat import reraise, BytesIO, text_type, xrange, PY3, PY2
+from ._compat import BytesIO, text_type, xrange, PY3, PY2, reraise
 from mutagen._util import DictMixin, cdata, MutagenError
 
 
@@ -57,6 +59,147 @@ class VorbisEncodingError(error):
     pass
 
 
+_uint_le_from = struct.Struct("<I").unpack_from
+
+# Values of these keys only get decoded on access, as they are base64
+# encoded binary data which tends to be large
+_RAW_VALUE_KEYS = frozenset(["metadata_block_picture"])
+
+
+class _RawValue(object):
+    """A comment value which was loaded but not decoded yet.
+
+    It references the loaded comment data instead of copying the value
+    out of it. VComment replaces it with the decoded text before any
+    value gets returned, so it never shows up outside of this module.
+    """
+
+    __slots__ = ("_data", "_start", "_end", "_errors")
+
+    def __init__(self, data, start, end, errors):
+        self._data = data
+        self._start = start
+        self._end = end
+        self._errors = errors
+
+    def raw(self):
+        """Returns the value as loaded, as a bytes-like object"""
+
+        if PY3:
+            return memoryview(self._data)[self._start:self._end]
+        return self._data[self._start:self._end]
+
+    def decode(self):
+        return self._data[self._start:self._end].decode(
+            'utf-8', self._errors)
+
+
+def _read_data(fileobj, framing):
+    """Reads a complete Vorbis comment from a file-like object one length
+    prefixed string at a time and returns it as bytes. The file object is
+    left right after it.
+    """
+
+    parts = []
+
+    def read_uint():
+        data = fileobj.read(4)
+        parts.append(data)
+        return cdata.uint_le(data)
+
+    def read_string():
+        length = read_uint()
+        try:
+            parts.append(fileobj.read(length))
+        except (OverflowError, MemoryError):
+            raise error("cannot read %d bytes, too large" % length)
+
+    try:
+        read_string()
+        for i in xrange(read_uint()):
+            read_string()
+    except (cdata.error, TypeError):
+        raise error("file is not a valid Vorbis comment")
+
+    if framing:
+        parts.append(fileobj.read(1))
+
+    return b"".join(parts)
+
+
+def _split_data(data):
+    """Splits the Vorbis comment at the start of data without decoding
+    anything.
+
+    Returns the (start, end) offsets of the vendor string, a list with
+    the offsets of every comment string and the offset right after the
+    last comment.
+    """
+
+    size = len(data)
+    spans = []
+    append = spans.append
+    try:
+        length, = _uint_le_from(data, 0)
+        offset = 4 + length
+        vendor = (4, offset)
+        count, = _uint_le_from(data, offset)
+        offset += 4
+        for i in xrange(count):
+            length, = _uint_le_from(data, offset)
+            start = offset + 4
+            offset = start + length
+            if offset > size:
+                # a truncated comment is only an error if something follows
+                offset = size
+            append((start, offset))
+        if vendor[1] <= size:
+            return vendor, spans, offset
+    except struct.error:
+        pass
+
+    raise error("file is not a valid Vorbis comment")
+
+
+def _decode_key(key, errors, cache):
+    """Returns the comment key for the raw key bytes or None if it should
+    be skipped. Valid keys are cached in the passed dict.
+    """
+
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+
+    try:
+        tag = key.decode("ascii")
+    except UnicodeDecodeError:
+        tag = key.decode('utf-8', errors)
+        try:
+            tag = tag.encode('ascii', errors).decode("ascii")
+        except UnicodeEncodeError:
+            raise VorbisEncodingError("invalid tag name %r" % tag)
+
+    # string keys in py3k
+    if PY2:
+        tag = tag.encode("ascii")
+
+    if not is_valid_key(tag):
+        return None
+    cache[key] = tag
+    return tag
+
+
+def _unknown_key(index):
+    """Returns the key for the comment at `index` without a separator"""
+
+    tag = u"unknown%d" % index
+    # string keys in py3k
+    if PY2:
+        tag = tag.encode("ascii")
+    return tag
+
+
 class VComment(mutagen.Tags, list):
     """A Vorbis comment parser, accessor, and renderer.
 
@@ -73,22 +216,21 @@ class VComment(mutagen.Tags, list):
 
     vendor = u"Mutagen " + mutagen.version_string
 
+    # If values loaded as _RawValue might be in the list
+    _has_raw = False
+
     def __init__(self, data=None, *args, **kwargs):
         self._size = 0
         # Collect the args to pass to load, this lets child classes
         # override just load and get equivalent magic for the
         # constructor.
         if data is not None:
-            if isinstance(data, bytes):
-                data = BytesIO(data)
-            elif not hasattr(data, 'read'):
+            if not isinstance(data, bytes) and not hasattr(data, 'read'):
                 raise TypeError("VComment requires bytes or a file-like")
-            start = data.tell()
             self.load(data, *args, **kwargs)
-            self._size = data.tell() - start
 
     def load(self, fileobj, errors='replace', framing=True):
-        """Parse a Vorbis comment from a file-like object.
+        """Parse a Vorbis comment from bytes or a file-like object.
 
         Arguments:
             errors (str): 'strict', 'replace', or 'ignore'.
@@ -100,40 +242,45 @@ class VComment(mutagen.Tags, list):
         but are not used in FLAC Vorbis comment blocks.
         """
 
-        try:
-            vendor_length = cdata.uint_le(fileobj.read(4))
-            self.vendor = fileobj.read(vendor_length).decode('utf-8', errors)
-            count = cdata.uint_le(fileobj.read(4))
-            for i in xrange(count):
-                length = cdata.uint_le(fileobj.read(4))
-                try:
-                    string = fileobj.read(length).decode('utf-8', errors)
-                except (OverflowError, MemoryError):
-                    raise error("cannot read %d bytes, too large" % length)
-                try:
-                    tag, value = string.split('=', 1)
-                except ValueError as err:
-                    if errors == "ignore":
-                        continue
-                    elif errors == "replace":
-                        tag, value = u"unknown%d" % i, string
-                    else:
-                        reraise(VorbisEncodingError, err, sys.exc_info()[2])
-                try:
-                    tag = tag.encode('ascii', errors)
-                except UnicodeEncodeError:
-                    raise VorbisEncodingError("invalid tag name %r" % tag)
-                else:
-                    # string keys in py3k
-                    if PY3:
-                        tag = tag.decode("ascii")
-                    if is_valid_key(tag):
-                        self.append((tag, value))
-
-            if framing and not bytearray(fileobj.read(1))[0] & 0x01:
+        if isinstance(fileobj, bytes):
+            data = fileobj
+        else:
+            data = _read_data(fileobj, framing)
+
+        vendor, spans, end = _split_data(data)
+        self.vendor = data[vendor[0]:vendor[1]].decode('utf-8', errors)
+
+        keys = {}
+        items = []
+        append = items.append
+        for i, (start, stop) in enumerate(spans):
+            eq = data.find(b"=", start, stop)
+            if eq == -1:
+                if errors == "ignore":
+                    continue
+                string = data[start:stop].decode('utf-8', errors)
+                if errors == "replace":
+                    append((_unknown_key(i), string))
+                    continue
+                raise VorbisEncodingError("comment without separator")
+
+            tag = _decode_key(data[start:eq], errors, keys)
+            if tag is None:
+                continue
+            elif tag.lower() in _RAW_VALUE_KEYS:
+                append((tag, _RawValue(data, eq + 1, stop, errors)))
+                self._has_raw = True
+            else:
+                append((tag, data[eq + 1:stop].decode('utf-8', errors)))
+        self.extend(items)
+
+        if framing:
+            flag = bytearray(data[end:end + 1])
+            if not flag or not flag[0] & 0x01:
                 raise VorbisUnsetFrameError("framing bit was unset")
-        except (cdata.error, TypeError):
-            raise error("file is not a valid Vorbis comment")
+            end += 1
+
+        self._size = end
 
     def validate(self):
         """Validate keys and values.
@@ -154,14 +301,16 @@ class VComment(mutagen.Tags, list):
             except UnicodeDecodeError:
                 raise ValueError
 
-        for key, value in self:
+        for key, value in list.__iter__(self):
             try:
                 if not is_valid_key(key):
                     raise ValueError
             except TypeError:
                 raise ValueError("%r is not a valid key" % key)
 
-            if not isinstance(value, text_type):
+            if isinstance(value, _RawValue):
+                continue
+            elif not isinstance(value, text_type):
                 if PY3:
                     raise ValueError("%r needs to be str" % key)
 
@@ -172,11 +321,58 @@ class VComment(mutagen.Tags, list):
 
         return True
 
+    def _resolve(self):
+        """Replaces all values not decoded yet (see _RawValue) with text"""
+
+        if not self._has_raw:
+            return
+        for i, (key, value) in enumerate(list.__iter__(self)):
+            if isinstance(value, _RawValue):
+                list.__setitem__(self, i, (key, value.decode()))
+        self._has_raw = False
+
+    def _resolves(name):
+        method = getattr(list, name)
+
+        def wrapper(self, *args, **kwargs):
+            self._resolve()
+            return method(self, *args, **kwargs)
+
+        wrapper.__name__ = name
+        return wrapper
+
+    # everything returning or comparing values
+    __iter__ = _resolves("__iter__")
+    __reversed__ = _resolves("__reversed__")
+    __getitem__ = _resolves("__getitem__")
+    __contains__ = _resolves("__contains__")
+    __eq__ = _resolves("__eq__")
+    __ne__ = _resolves("__ne__")
+    __lt__ = _resolves("__lt__")
+    __le__ = _resolves("__le__")
+    __gt__ = _resolves("__gt__")
+    __ge__ = _resolves("__ge__")
+    __repr__ = _resolves("__repr__")
+    __add__ = _resolves("__add__")
+    __mul__ = _resolves("__mul__")
+    __rmul__ = _resolves("__rmul__")
+    index = _resolves("index")
+    count = _resolves("count")
+    remove = _resolves("remove")
+    pop = _resolves("pop")
+    sort = _resolves("sort")
+
+    if PY2:
+        __getslice__ = _resolves("__getslice__")
+    else:
+        copy = _resolves("copy")
+
+    del _resolves
+
     def clear(self):
         """Clear all keys from the comment."""
 
-        for i in list(self):
-            self.remove(i)
+        del self[:]
 
     def write(self, framing=True):
         """Return a string representation of the data.
@@ -191,7 +387,9 @@ class VComment(mutagen.Tags, list):
         self.validate()
 
         def _encode(value):
-            if not isinstance(value, bytes):
+            if isinstance(value, _RawValue):
+                return bytes(value.raw())
+            elif not isinstance(value, bytes):
                 return value.encode('utf-8')
             return value
 
@@ -200,7 +398,7 @@ class VComment(mutagen.Tags, list):
         f.write(cdata.to_uint_le(len(vendor)))
         f.write(vendor)
         f.write(cdata.to_uint_le(len(self)))
-        for tag, value in self:
+        for tag, value in list.__iter__(self):
             tag = _encode(tag)
             value = _encode(value)
             comment = tag + b"=" + value
@@ -235,6 +433,60 @@ class VCommentDict(VComment, DictMixin):
     normalized to lowercase ASCII.
     """
 
+    # Maps lowercase keys to the positions of their values in the list.
+    # Built on first use and kept up to date by append(), any other
+    # change to the list throws it away. The owner id makes sure copies
+    # don't share it.
+    _index = None
+    _index_owner = None
+
+    def _get_index(self):
+        if self._index is None or self._index_owner != id(self):
+            index = {}
+            for i, (k, value) in enumerate(list.__iter__(self)):
+                index.setdefault(k.lower(), []).append(i)
+            self._index = index
+            self._index_owner = id(self)
+        return self._index
+
+    def _invalidate(self):
+        self._index = None
+
+    def append(self, item):
+        VComment.append(self, item)
+        if self._index is not None and self._index_owner == id(self):
+            try:
+                key = item[0].lower()
+            except (AttributeError, TypeError, IndexError):
+                self._invalidate()
+            else:
+                self._index.setdefault(key, []).append(len(self) - 1)
+
+    def _invalidates(name):
+        method = getattr(VComment, name)
+
+        def wrapper(self, *args, **kwargs):
+            self._invalidate()
+            return method(self, *args, **kwargs)
+
+        wrapper.__name__ = name
+        return wrapper
+
+    extend = _invalidates("extend")
+    insert = _invalidates("insert")
+    remove = _invalidates("remove")
+    pop = _invalidates("pop")
+    sort = _invalidates("sort")
+    reverse = _invalidates("reverse")
+    __iadd__ = _invalidates("__iadd__")
+    __imul__ = _invalidates("__imul__")
+
+    if PY2:
+        __setslice__ = _invalidates("__setslice__")
+        __delslice__ = _invalidates("__delslice__")
+
+    del _invalidates
+
     def __getitem__(self, key):
         """A list of values for the key.
 
@@ -251,29 +503,40 @@ class VCommentDict(VComment, DictMixin):
 
         key = key.lower()
 
-        values = [value for (k, value) in self if k.lower() == key]
-        if not values:
+        positions = self._get_index().get(key)
+        if not positions:
             raise KeyError(key)
-        else:
-            return values
+
+        values = []
+        for i in positions:
+            key, value = list.__getitem__(self, i)
+            if isinstance(value, _RawValue):
+                value = value.decode()
+                list.__setitem__(self, i, (key, value))
+            values.append(value)
+        return values
 
     def __delitem__(self, key):
         """Delete all values associated with the key."""
 
         # PY3 only
         if isinstance(key, slice):
+            self._invalidate()
             return VComment.__delitem__(self, key)
 
         if not is_valid_key(key):
             raise ValueError
 
         key = key.lower()
-        to_delete = [x for x in self if x[0].lower() == key]
-        if not to_delete:
+        positions = self._get_index().get(key)
+        if not positions:
             raise KeyError(key)
         else:
-            for item in to_delete:
-                self.remove(item)
+            positions = set(positions)
+            keep = [x for i, x in enumerate(list.__iter__(self))
+                    if i not in positions]
+            self._invalidate()
+            VComment.__setitem__(self, slice(None), keep)
 
     def __contains__(self, key):
         """Return true if the key has any values."""
@@ -281,12 +544,7 @@ class VCommentDict(VComment, DictMixin):
         if not is_valid_key(key):
             raise ValueError
 
-        key = key.lower()
-        for k, value in self:
-            if k.lower() == key:
-                return True
-        else:
-            return False
+        return key.lower() in self._get_index()
 
     def __setitem__(self, key, values):
         """Set a key's value or values.
@@ -298,6 +556,7 @@ class VCommentDict(VComment, DictMixin):
 
         # PY3 only
         if isinstance(key, slice):
+            self._invalidate()
             return VComment.__setitem__(self, key, values)
 
         if not is_valid_key(key):
@@ -319,9 +578,40 @@ class VCommentDict(VComment, DictMixin):
     def keys(self):
         """Return all keys in the comment."""
 
-        return list(set([k.lower() for k, v in self]))
+        return list(self._get_index().keys())
 
     def as_dict(self):
         """Return a copy of the comment data in a real dict."""
 
-        return dict([(key, self[key]) for key in self.keys()])
+        self._resolve()
+        item = list.__getitem__
+        return dict([(key, [item(self, i)[1] for i in positions])
+                     for key, positions in self._get_index().items()])
+
+    def pictures(self):
+        """Decode the cover art stored in METADATA_BLOCK_PICTURE comments.
+
+        The base64 encoded data of loaded comments gets decoded here
+        without decoding it to text first.
+
+        Returns:
+            List[`mutagen.flac.Picture`]
+
+        Raises:
+            error: in case a picture can't be decoded
+        """
+
+        from mutagen.flac import Picture
+
+        pictures = []
+        positions = self._get_index().get("metadata_block_picture", [])
+        for i in positions:
+            value = list.__getitem__(self, i)[1]
+            if isinstance(value, _RawValue):
+                value = value.raw()
+            try:
+                pictures.append(Picture(binascii.a2b_base64(value)))
+            except (TypeError, ValueError, binascii.Error, cdata.error,
+                    MutagenError) as e:
+                reraise(error, e, sys.exc_info()[2])
+        return pictures
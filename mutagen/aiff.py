@@ -19,7 +19,7 @@ from mutagen import StreamInfo, FileType
 from mutagen.id3 import ID3
 from mutagen.id3._util import ID3NoHeaderError, error as ID3Error
 from mutagen._util import resize_bytes, delete_bytes, MutagenError, loadfile, \
-    convert_error
+    convert_error, _openfile, _same_file, _CopyingFile
 
 __all__ = ["AIFF", "Open", "delete"]
 
@@ -276,7 +276,12 @@ class _IFFID3(ID3):
     @convert_error(IOError, error)
     @loadfile(writable=True)
     def save(self, filething, v2_version=4, v23_sep='/', padding=None):
-        """Save ID3v2 data to the AIFF file"""
+        """Save ID3v2 data to the AIFF file
+
+        Pass atomic=True to save to a copy of the file which replaces the
+        file once done. Files with more than one hard link are saved in
+        place.
+        """
 
         fileobj = filething.fileobj
 
@@ -302,6 +307,29 @@ class _IFFID3(ID3):
         assert new_size == len(data)
         chunk.write(data)
 
+    @convert_error(IOError, error)
+    def save_to(self, dest, source=None, v2_version=4, v23_sep='/',
+                padding=None):
+        """Write a copy of the AIFF file with these tags to dest, in one
+        pass like `FileType.save_to`
+        """
+
+        if source is None:
+            source = self.filename
+
+        with _openfile(None, source, None, None, False, False) as src:
+            with _openfile(None, dest, None, None, True, True) as dst:
+                if _same_file(src.fileobj, dst.fileobj):
+                    raise error("can't save a copy over the file itself")
+                fileobj = _CopyingFile(src.fileobj, dst.fileobj, dst.name)
+                try:
+                    self.save(dst._replace(fileobj=fileobj),
+                              v2_version=v2_version, v23_sep=v23_sep,
+                              padding=padding)
+                    fileobj._copy()
+                except EOFError as e:
+                    raise error(e)
+
     @loadfile(writable=True)
     def delete(self, filething):
         """Completely removes the ID3 chunk from the AIFF file"""
@@ -251,13 +251,16 @@ class ASF(FileType):
     @convert_error(IOError, error)
     @loadfile(writable=True)
     def save(self, filething, padding=None):
-        """save(filething=None, padding=None)
+        """save(filething=None, padding=None, atomic=False)
 
         Save tag changes back to the loaded file.
 
         Args:
             filething (filething)
             padding (PaddingFunction)
+            atomic (bool): save to a copy of the file and replace the
+                file with it once done, so it is never left half written.
+                Files with more than one hard link are saved in place.
         Raises:
             mutagen.MutagenError
         """
@@ -182,6 +182,10 @@ class EasyID3(DictMixin, Metadata):
         kwargs.pop("v2_version", None)
         self.__id3.save(*args, **kwargs)
 
+    def save_to(self, *args, **kwargs):
+        kwargs.pop("v2_version", None)
+        self.__id3.save_to(*args, **kwargs)
+
     delete = property(lambda s: s.__id3.delete,
                       lambda s, v: setattr(s.__id3, 'delete', v))
 
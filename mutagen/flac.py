@@ -22,13 +22,14 @@ http://flac.sourceforge.net/format.html
 
 __all__ = ["FLAC", "Open", "delete"]
 
+import bisect
 import struct
 from ._vorbis import VCommentDict
 import mutagen
 
 from ._compat import cBytesIO, endswith, chr_, xrange
 from mutagen._util import resize_bytes, MutagenError, get_size, loadfile, \
-    convert_error
+    convert_error, move_bytes
 from mutagen._tags import PaddingInfo
 from mutagen.id3 import BitPaddedInt
 from functools import reduce
@@ -74,6 +75,60 @@ class StrictFileObject(object):
         return self._fileobj.read(*args)
 
 
+class _FileRange(object):
+    """A range of bytes in the file a block was loaded from, which only gets
+    read on request.
+
+    The bytes from the start of the block up to a few bytes into the range
+    get remembered, so reading it after someone else changed the file (e.g.
+    another FLAC instance saving it) raises instead of returning the wrong
+    data.
+    """
+
+    _CHECK_SIZE = 16
+
+    def __init__(self, filename, offset, size):
+        self.filename = filename
+        self.offset = offset
+        self.size = size
+        self._check = None
+
+    def __len__(self):
+        return self.size
+
+    def is_in(self, filething):
+        """If the range belongs to the file in `filething`"""
+
+        return self.filename == filething.filename
+
+    def remember(self, fileobj, start):
+        """Remember the bytes of the block starting at `start` up to a few
+        bytes into the range, as found in `fileobj` now.
+        """
+
+        fileobj.seek(start)
+        self._check = (start, fileobj.read(
+            self.offset - start + min(self.size, self._CHECK_SIZE)))
+
+    def _read(self, fileobj):
+        fileobj.seek(self.offset)
+        data = fileobj.read(self.size)
+        if len(data) != self.size:
+            raise error("file said %d bytes, read %d bytes" % (
+                        self.size, len(data)))
+        return data
+
+    @convert_error(IOError, error)
+    def read(self):
+        with open(self.filename, "rb") as fileobj:
+            if self._check is not None:
+                start, data = self._check
+                fileobj.seek(start)
+                if fileobj.read(len(data)) != data:
+                    raise error("file changed since loading")
+            return self._read(fileobj)
+
+
 class MetadataBlock(object):
     """A generic block of FLAC metadata.
 
@@ -95,6 +150,9 @@ class MetadataBlock(object):
 
     _MAX_SIZE = 2 ** 24 - 1
 
+    _source = None
+    """A _FileRange for the not yet read payload or None"""
+
     def __init__(self, data):
         """Parse the given data string or file-like as a metadata block.
         The metadata header should not be included."""
@@ -108,12 +166,52 @@ class MetadataBlock(object):
                 data = StrictFileObject(data)
             self.load(data)
 
+    @classmethod
+    def _from_file(cls, fileobj, size, filething):
+        """Like passing the block content to the constructor, but only
+        reads what is needed to skip over it. `fileobj` has to be at the
+        start of the block content and will be advanced to its end.
+        The rest gets read from `filething` on access.
+        """
+
+        if filething.filename is None:
+            # the file object belongs to the caller and might be closed
+            # by the time the data gets accessed, so read it now
+            return cls(fileobj.read(size))
+
+        block = cls(None)
+        block._source = _FileRange(filething.filename, fileobj.tell(), size)
+        block._source.remember(fileobj, block._source.offset - 4)
+        fileobj.seek(block._source.offset + size)
+        return block
+
+    @property
+    def data(self):
+        if self._source is not None:
+            self._data = self._source.read()
+            self._source = None
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._source = None
+
     def load(self, data):
         self.data = data.read()
 
     def write(self):
         return self.data
 
+    def _write_parts(self):
+        """Like write(), but returns a list of bytes and _FileRange
+        objects for the parts which haven't been read yet.
+        """
+
+        if self._source is not None:
+            return [self._source]
+        return [self.write()]
+
     @classmethod
     def _writeblock(cls, block, is_last=False):
         """Returns the block content + header.
@@ -121,10 +219,23 @@ class MetadataBlock(object):
         Raises error.
         """
 
+        data = bytearray()
+        for part in cls._writeblock_parts(block, is_last):
+            data += part if isinstance(part, bytes) else part.read()
+        return data
+
+    @classmethod
+    def _writeblock_parts(cls, block, is_last=False):
+        """Like _writeblock, but returns the parts of _write_parts()
+        prefixed with the header.
+
+        Raises error.
+        """
+
         data = bytearray()
         code = (block.code | 128) if is_last else block.code
-        datum = block.write()
-        size = len(datum)
+        parts = block._write_parts()
+        size = sum(len(part) for part in parts)
         if size > cls._MAX_SIZE:
             if block._distrust_size and block._invalid_overflow_size != -1:
                 # The original size of this block was (1) wrong and (2)
@@ -139,20 +250,36 @@ class MetadataBlock(object):
         length = struct.pack(">I", size)[-3:]
         data.append(code)
         data += length
-        data += datum
-        return data
+        return [bytes(data)] + parts
 
     @classmethod
     def _writeblocks(cls, blocks, available, cont_size, padding_func):
-        """Render metadata block as a byte string."""
+        """Render metadata blocks as byte strings."""
 
-        # write everything except padding
         data = bytearray()
+        parts, starts = cls._writeblocks_parts(
+            blocks, available, cont_size, padding_func)
+        for part in parts:
+            data += part if isinstance(part, bytes) else part.read()
+        return bytes(data)
+
+    @classmethod
+    def _writeblocks_parts(cls, blocks, available, cont_size, padding_func):
+        """Like _writeblocks, but returns a list of bytes and _FileRange
+        objects (see _write_parts) and the offsets where the blocks start.
+        """
+
+        # write everything except padding
+        data = []
+        starts = []
+        blockssize = 0
         for block in blocks:
             if isinstance(block, Padding):
                 continue
-            data += cls._writeblock(block)
-        blockssize = len(data)
+            parts = cls._writeblock_parts(block)
+            starts.append(blockssize)
+            blockssize += sum(len(part) for part in parts)
+            data.extend(parts)
 
         # take the padding overhead into account. we always add one
         # to make things simple.
@@ -163,9 +290,10 @@ class MetadataBlock(object):
         info = PaddingInfo(available - blockssize, cont_size)
         padding_block.length = min(info._get_padding(padding_func),
                                    cls._MAX_SIZE)
-        data += cls._writeblock(padding_block, is_last=True)
+        starts.append(sum(len(part) for part in data))
+        data.extend(cls._writeblock_parts(padding_block, is_last=True))
 
-        return data
+        return data, starts
 
 
 class StreamInfo(MetadataBlock, mutagen.StreamInfo):
@@ -348,9 +476,28 @@ class VCFLACDict(VCommentDict):
     def load(self, data, errors='replace', framing=False):
         super(VCFLACDict, self).load(data, errors=errors, framing=framing)
 
+    @classmethod
+    def _from_file(cls, fileobj, size, filething):
+        # Parse the block in one go if the size is right, otherwise
+        # follow the comment lengths (see FLAC.__read_metadata_block)
+        start = fileobj.tell()
+        try:
+            block = cls(fileobj.read(size))
+        except MutagenError:
+            block = None
+        if block is None or block._size != size:
+            fileobj.seek(start, 0)
+            block = cls(fileobj)
+        return block
+
     def write(self, framing=False):
         return super(VCFLACDict, self).write(framing=framing)
 
+    _source = None
+
+    def _write_parts(self):
+        return [self.write()]
+
 
 class CueSheetTrackIndex(tuple):
     """CueSheetTrackIndex(index_number, index_offset)
@@ -596,16 +743,43 @@ class Picture(MetadataBlock):
 
     __hash__ = MetadataBlock.__hash__
 
-    def load(self, data):
+    def __load_header(self, data):
+        """Reads everything up to the picture data, returns its length"""
+
         self.type, length = struct.unpack('>2I', data.read(8))
         self.mime = data.read(length).decode('UTF-8', 'replace')
         length, = struct.unpack('>I', data.read(4))
         self.desc = data.read(length).decode('UTF-8', 'replace')
         (self.width, self.height, self.depth,
          self.colors, length) = struct.unpack('>5I', data.read(20))
+        return length
+
+    def load(self, data):
+        length = self.__load_header(data)
         self.data = data.read(length)
 
-    def write(self):
+    @classmethod
+    def _from_file(cls, fileobj, size, filething):
+        # the size can't be trusted, see FLAC.__read_metadata_block,
+        # so skip over the picture data instead
+        block = cls(None)
+        if filething.filename is None:
+            block.load(fileobj)
+            return block
+
+        start = fileobj.tell() - 4
+        length = block.__load_header(fileobj)
+        block._source = _FileRange(filething.filename, fileobj.tell(), length)
+        block._source.remember(fileobj, start)
+        fileobj.seek(block._source.offset + length)
+        return block
+
+    def __data_size(self):
+        if self._source is not None:
+            return len(self._source)
+        return len(self.data)
+
+    def __write_header(self):
         f = cBytesIO()
         mime = self.mime.encode('UTF-8')
         f.write(struct.pack('>2I', self.type, len(mime)))
@@ -614,13 +788,20 @@ class Picture(MetadataBlock):
         f.write(struct.pack('>I', len(desc)))
         f.write(desc)
         f.write(struct.pack('>5I', self.width, self.height, self.depth,
-                            self.colors, len(self.data)))
-        f.write(self.data)
+                            self.colors, self.__data_size()))
         return f.getvalue()
 
+    def write(self):
+        return self.__write_header() + self.data
+
+    def _write_parts(self):
+        if self._source is not None:
+            return [self.__write_header(), self._source]
+        return [self.write()]
+
     def __repr__(self):
         return "<%s '%s' (%d bytes)>" % (type(self).__name__, self.mime,
-                                         len(self.data))
+                                         self.__data_size())
 
 
 class Padding(MetadataBlock):
@@ -644,6 +825,13 @@ class Padding(MetadataBlock):
     def load(self, data):
         self.length = len(data.read())
 
+    @classmethod
+    def _from_file(cls, fileobj, size, filething):
+        block = cls(None)
+        block.length = size
+        fileobj.seek(size, 1)
+        return block
+
     def write(self):
         try:
             return b"\x00" * self.length
@@ -690,12 +878,15 @@ class FLAC(mutagen.FileType):
                        CueSheet, Picture]
     """Known metadata block types, indexed by ID."""
 
+    _LAZY_BLOCKS = [MetadataBlock, Padding, Picture]
+    """Block types which don't get read while loading, only skipped"""
+
     @staticmethod
     def score(filename, fileobj, header_data):
         return (header_data.startswith(b"fLaC") +
                 endswith(filename.lower(), ".flac") * 3)
 
-    def __read_metadata_block(self, fileobj):
+    def __read_metadata_block(self, fileobj, filething):
         byte = ord(fileobj.read(1))
         size = to_int_be(fileobj.read(3))
         code = byte & 0x7F
@@ -717,10 +908,12 @@ class FLAC(mutagen.FileType):
             # ..same for the Picture block:
             # https://github.com/quodlibet/mutagen/issues/106
             start = fileobj.tell()
-            block = block_type(fileobj)
+            block = block_type._from_file(fileobj, size, filething)
             real_size = fileobj.tell() - start
             if real_size > MetadataBlock._MAX_SIZE:
                 block._invalid_overflow_size = size
+        elif block_type in self._LAZY_BLOCKS:
+            block = block_type._from_file(fileobj, size, filething)
         else:
             data = fileobj.read(size)
             block = block_type(data)
@@ -784,9 +977,12 @@ class FLAC(mutagen.FileType):
         self.seektable = None
 
         fileobj = StrictFileObject(fileobj)
-        self.__check_header(fileobj, filething.name)
-        while self.__read_metadata_block(fileobj):
-            pass
+        header = self.__check_header(fileobj, filething.name)
+        starts = [header]
+        while self.__read_metadata_block(fileobj, filething):
+            starts.append(fileobj.tell())
+        self._loaded_blocks = list(self.metadata_blocks)
+        self.__set_layout(filething, header, fileobj.tell() - header, starts)
 
         try:
             self.metadata_blocks[0].length
@@ -829,13 +1025,27 @@ class FLAC(mutagen.FileType):
             filething (filething)
             deleteid3 (bool): delete id3 tags while at it
             padding (PaddingFunction)
+            atomic (bool): save to a copy of the file and replace the
+                file with it once done, so it is never left half written.
+                Files with more than one hard link are saved in place.
 
         If no filename is given, the one most recently loaded is used.
         """
 
-        f = StrictFileObject(filething.fileobj)
-        header = self.__check_header(f, filething.name)
-        audio_offset = self.__find_audio_offset(f)
+        fileobj = filething.fileobj
+        layout = self._layout
+        if layout is not None and layout.is_in(filething) and \
+                self.__layout_is_valid(fileobj):
+            # nothing changed since we loaded or saved it last, so we can
+            # skip parsing all blocks again
+            header = layout.offset
+            audio_offset = layout.offset + layout.size
+        else:
+            layout = None
+            fileobj.seek(0)
+            f = StrictFileObject(fileobj)
+            header = self.__check_header(f, filething.name)
+            audio_offset = self.__find_audio_offset(f, filething)
         # "fLaC" and maybe ID3
         available = audio_offset - header
 
@@ -844,29 +1054,152 @@ class FLAC(mutagen.FileType):
             available += header - 4
             header = 4
 
-        content_size = get_size(f) - audio_offset
+        content_size = get_size(fileobj) - audio_offset
         assert content_size >= 0
-        data = MetadataBlock._writeblocks(
+        parts, starts = MetadataBlock._writeblocks_parts(
             self.metadata_blocks, available, content_size, padding)
-        data_size = len(data)
-
-        resize_bytes(filething.fileobj, available, data_size, header)
-        f.seek(header - 4)
-        f.write(b"fLaC")
-        f.write(data)
+        data_size = sum(len(part) for part in parts)
+
+        # Blocks which weren't read get copied from where they are in the
+        # file, anything else has to be read before we start changing it.
+        for i, part in enumerate(parts):
+            if isinstance(part, _FileRange):
+                if not part.is_in(filething):
+                    parts[i] = part.read()
+                elif layout is None:
+                    raise error("file changed since loading")
+        saved = set(id(block) for block in self.metadata_blocks)
+        for block in self._loaded_blocks:
+            if id(block) not in saved and block._source is not None and \
+                    block._source.is_in(filething):
+                block.data
+
+        # Write in place if possible, otherwise move the audio data
+        # first (or last if it gets smaller) so nothing we still need gets
+        # overwritten.
+        if data_size > available:
+            resize_bytes(fileobj, available, data_size, header)
+        self.__write_parts(fileobj, header, parts)
+        if data_size < available:
+            resize_bytes(fileobj, available, data_size, header)
+        offset = header
+        for part in parts:
+            if isinstance(part, _FileRange):
+                index = bisect.bisect_right(starts, offset - header) - 1
+                part.remember(fileobj, header + starts[index])
+            offset += len(part)
+        fileobj.seek(header - 4)
+        fileobj.write(b"fLaC")
 
         # Delete ID3v1
         if deleteid3:
             try:
-                f.seek(-128, 2)
+                fileobj.seek(-128, 2)
             except IOError:
                 pass
             else:
-                if f.read(3) == b"TAG":
-                    f.seek(-128, 2)
-                    f.truncate()
+                if fileobj.read(3) == b"TAG":
+                    fileobj.seek(-128, 2)
+                    fileobj.truncate()
+
+        # all blocks now match the file, even if it had changed before.
+        # Copies made by save_to() don't change which file that is.
+        if filething.filename == self.filename:
+            self.__set_layout(filething, header, data_size,
+                              [header + start for start in starts])
+
+    def __set_layout(self, filething, header, size, starts):
+        """Remember where the metadata blocks are located in the file
+        (after the "fLaC" marker, up to the audio data), so save() doesn't
+        have to parse them again.
+
+        `starts` are the offsets of the blocks. The start of each block
+        gets saved as well, so changes by someone else can be detected.
+        """
 
-    def __find_audio_offset(self, fileobj):
+        if filething.filename is None:
+            # file objects might be changed by the caller in any way
+            self._layout = None
+            return
+
+        fileobj = filething.fileobj
+        self._layout = _FileRange(filething.filename, header, size)
+        self._layout_file_size = get_size(fileobj)
+        self._layout_blocks = []
+        for start in starts:
+            fileobj.seek(start)
+            self._layout_blocks.append((start, fileobj.read(64)))
+
+    def __layout_is_valid(self, fileobj):
+        """Check if the file still looks like it did when the layout was
+        saved: same size, "fLaC" marker and block starts. Blocks which got
+        moved, resized or replaced by someone else (e.g. another FLAC
+        instance of the same file) are noticed that way.
+        """
+
+        layout = self._layout
+        if get_size(fileobj) != self._layout_file_size:
+            return False
+        fileobj.seek(layout.offset - 4)
+        if fileobj.read(4) != b"fLaC":
+            return False
+        for start, data in self._layout_blocks:
+            fileobj.seek(start)
+            if fileobj.read(len(data)) != data:
+                return False
+        return True
+
+    def __write_parts(self, fileobj, offset, parts):
+        """Writes the result of MetadataBlock._writeblocks_parts at offset.
+
+        _FileRange parts get moved to their new place in the file and
+        updated accordingly.
+        """
+
+        # Moving the parts in place only works if they keep their order
+        # and don't overlap, otherwise some would get overwritten before
+        # they are moved (e.g. pictures added back in a different order).
+        # Read them instead, writing them is enough to move them then.
+        ranges = [p for p in parts if isinstance(p, _FileRange)]
+        in_order = all(a.offset + a.size <= b.offset
+                       for a, b in zip(ranges, ranges[1:]))
+        if not in_order:
+            data = dict((id(p), p._read(fileobj)) for p in ranges)
+
+        moves = []
+        literals = []
+        for part in parts:
+            if isinstance(part, _FileRange):
+                if in_order:
+                    moves.append((offset, part))
+                else:
+                    fileobj.seek(offset)
+                    fileobj.write(data[id(part)])
+                    part.offset = offset
+            elif literals and literals[-1][0] + len(literals[-1][1]) == offset:
+                literals[-1][1] += part
+            else:
+                literals.append([offset, bytearray(part)])
+            offset += len(part)
+
+        # The order of the parts doesn't change, so first moving all parts
+        # which move towards the end starting with the last one, and then
+        # all others starting with the first one never overwrites data
+        # which isn't moved yet.
+        for dest, part in reversed(moves):
+            if dest > part.offset:
+                move_bytes(fileobj, dest, part.offset, part.size)
+                part.offset = dest
+        for dest, part in moves:
+            if dest < part.offset:
+                move_bytes(fileobj, dest, part.offset, part.size)
+                part.offset = dest
+
+        for offset, data in literals:
+            fileobj.seek(offset)
+            fileobj.write(data)
+
+    def __find_audio_offset(self, fileobj, filething):
         byte = 0x00
         while not (byte & 0x80):
             byte = ord(fileobj.read(1))
@@ -876,12 +1209,14 @@ class FLAC(mutagen.FileType):
             except IndexError:
                 block_type = None
 
-            if block_type and block_type._distrust_size:
+            if block_type in self._LAZY_BLOCKS:
+                block_type._from_file(fileobj, size, filething)
+            elif block_type and block_type._distrust_size:
                 # See comments in read_metadata_block; the size can't
                 # be trusted for Vorbis comment blocks and Picture block
-                block_type(fileobj)
+                block_type._from_file(fileobj, size, filething)
             else:
-                fileobj.read(size)
+                fileobj.seek(size, 1)
         return fileobj.tell()
 
     def __check_header(self, fileobj, name):
@@ -30,7 +30,8 @@ Since this file's documentation is a little unwieldy, you are probably
 interested in the :class:`ID3` class to start with.
 """
 
-__all__ = ['ID3', 'ID3FileType', 'Frames', 'Open', 'delete']
+__all__ = ['ID3', 'ID3FileType', 'ID3AlbumWriter', 'Frames', 'Open',
+           'delete']
 
 import struct
 import errno
@@ -39,7 +40,8 @@ from struct import unpack, pack, error as StructError
 
 import mutagen
 from mutagen._util import insert_bytes, delete_bytes, DictProxy, enum, \
-    loadfile, convert_error
+    loadfile, convert_error, resize_alignment, copy_bytes, _openfile, \
+    _same_file
 from mutagen._tags import PaddingInfo
 from .._compat import chr_, PY3
 
@@ -495,7 +497,7 @@ class ID3(DictProxy, mutagen.Metadata):
                         pass
 
     def _prepare_data(self, fileobj, start, available, v2_version, v23_sep,
-                      pad_func):
+                      pad_func, align=None):
         if v2_version == 3:
             version = ID3Header._V23
         elif v2_version == 4:
@@ -510,8 +512,12 @@ class ID3(DictProxy, mutagen.Metadata):
         frames = sorted(self.items(),
                         key=lambda a: (order.get(a[0][:4], last), a[0]))
 
-        framedata = [self.__save_frame(frame, version=version, v23_sep=v23_sep)
-                     for (key, frame) in frames]
+        # header and data of each frame, kept apart to not copy large
+        # frame data more often than needed
+        framedata = []
+        for (key, frame) in frames:
+            framedata.extend(
+                self.__encode_frame(frame, version=version, v23_sep=v23_sep))
 
         # only write unknown frames if they were loaded from the version
         # we are saving with or upgraded to it
@@ -529,6 +535,9 @@ class ID3(DictProxy, mutagen.Metadata):
         if new_padding < 0:
             raise error("invalid padding")
         new_size = needed + new_padding
+        if align:
+            # extend the padding so the size changes by a multiple of align
+            new_size += (available - new_size) % align
 
         new_framesize = BitPaddedInt.to_str(new_size - 10, width=4)
         header = pack('>3sBBB4s', b'ID3', v2_version, 0, 0, new_framesize)
@@ -564,6 +573,10 @@ class ID3(DictProxy, mutagen.Metadata):
                 if v2_version == 3. Defaults to '/' but if it's None
                 will be the ID3v2v2.4 null separator.
             padding (PaddingFunction)
+            atomic (bool):
+                save to a copy of the file and replace the file with it
+                once done, so it is never left half written. Files with
+                more than one hard link are saved in place.
 
         Raises:
             mutagen.MutagenError
@@ -583,8 +596,10 @@ class ID3(DictProxy, mutagen.Metadata):
         else:
             old_size = header.size
 
+        # only round the default padding, a custom one is taken as is
+        align = resize_alignment(f) if padding is None else None
         data = self._prepare_data(
-            f, 0, old_size, v2_version, v23_sep, padding)
+            f, 0, old_size, v2_version, v23_sep, padding, align=align)
         new_size = len(data)
 
         if (old_size < new_size):
@@ -596,6 +611,66 @@ class ID3(DictProxy, mutagen.Metadata):
 
         self.__save_v1(f, v1)
 
+    @convert_error(IOError, error)
+    def save_to(self, dest, source=None, v1=1, v2_version=4, v23_sep='/',
+                padding=None):
+        """save_to(dest, source=None, v1=1, v2_version=4, v23_sep='/',
+        padding=None)
+
+        Write a copy of a file with these tags to dest, leaving the file
+        itself untouched.
+
+        The new tag gets written first, followed by the rest of the file
+        without its old ID3 tags, in one sequential pass. The data gets
+        copied by the kernel if possible.
+
+        Args:
+            dest (filething): the file to write to, gets replaced
+            source (filething): the file to copy, or `None` to use the one
+                used when loading
+            v1, v2_version, v23_sep, padding: see `save`
+
+        Raises:
+            mutagen.MutagenError: also if dest and source are the same
+                file, use `save` for that
+        """
+
+        if source is None:
+            source = self.filename
+
+        with _openfile(None, source, None, None, False, False) as src:
+            fileobj = src.fileobj
+            try:
+                header = ID3Header(fileobj)
+            except ID3NoHeaderError:
+                old_size = 0
+            else:
+                old_size = header.size
+
+            data = self._prepare_data(
+                fileobj, 0, old_size, v2_version, v23_sep, padding)
+
+            tag, offset = _find_id3v1(fileobj)
+            fileobj.seek(offset, 2)
+            end = fileobj.tell()
+
+            with _openfile(None, dest, None, None, True, True) as dst:
+                f = dst.fileobj
+                if _same_file(fileobj, f):
+                    raise error("can't save a copy over the file itself")
+                f.seek(0)
+                f.truncate()
+                f.write(data)
+                try:
+                    copy_bytes(fileobj, old_size, f, len(data),
+                               max(end - old_size, 0))
+                except EOFError:
+                    raise error("file changed while copying")
+                if v1 == ID3v1SaveOptions.UPDATE and tag is not None or \
+                        v1 == ID3v1SaveOptions.CREATE:
+                    f.write(MakeID3v1(self))
+                f.truncate()
+
     def __save_v1(self, f, v1):
         tag, offset = _find_id3v1(f)
         has_v1 = tag is not None
@@ -627,16 +702,33 @@ class ID3(DictProxy, mutagen.Metadata):
 
     def __save_frame(self, frame, name=None, version=ID3Header._V24,
                      v23_sep=None):
+        return b"".join(self.__encode_frame(frame, name, version, v23_sep))
+
+    def __encode_frame(self, frame, name=None, version=ID3Header._V24,
+                       v23_sep=None):
+        """Returns a list containing the frame header and the frame data,
+        or an empty list if the frame shouldn't be written.
+        """
+
         flags = 0
         if isinstance(frame, TextFrame):
             if len(str(frame)) == 0:
-                return b''
+                return []
 
+        # reuse the data of frames which haven't changed since they were
+        # loaded or last saved
         if version == ID3Header._V23:
-            framev23 = frame._get_v23_frame(sep=v23_sep)
-            framedata = framev23._writeData()
+            key = (version, v23_sep)
         else:
-            framedata = frame._writeData()
+            key = (version,)
+        framedata = frame._get_encoded(key)
+        if framedata is None:
+            if version == ID3Header._V23:
+                framev23 = frame._get_v23_frame(sep=v23_sep)
+                framedata = framev23._writeData()
+            else:
+                framedata = frame._writeData()
+            frame._set_encoded(key, framedata)
 
         usize = len(framedata)
         if usize > 2048:
@@ -665,7 +757,7 @@ class ID3(DictProxy, mutagen.Metadata):
                 frame_name = frame_name.encode("ascii")
 
         header = pack('>4s4sH', frame_name, datasize, flags)
-        return header + framedata
+        return [header, framedata]
 
     def __update_common(self):
         """Updates done by both v23 and v24 update"""
@@ -815,6 +907,82 @@ class ID3(DictProxy, mutagen.Metadata):
                 del(self[key])
 
 
+class ID3AlbumWriter(object):
+    """ID3AlbumWriter(frames=None)
+
+    Writes new ID3v2 tags to a group of files, like all tracks of an
+    album, which share most of their frames.
+
+    The shared frames are encoded once and their data is reused for every
+    file, only the frames specific to a file get encoded for each of them.
+
+    ::
+
+        writer = ID3AlbumWriter([TPE1(encoding=3, text=u"Artist"),
+                                 TALB(encoding=3, text=u"Album")])
+        for i, path in enumerate(paths):
+            writer.add(path, [TIT2(encoding=3, text=titles[i]),
+                              TRCK(encoding=3, text=u"%d" % (i + 1))])
+        writer.save()
+
+    Arguments:
+        frames (List[Frame]): frames to write to every file
+
+    Attributes:
+        frames (ID3): the shared frames
+    """
+
+    def __init__(self, frames=None):
+        self.frames = ID3()
+        for frame in frames or []:
+            self.frames.add(frame)
+        self.__files = []
+
+    def add(self, filething, frames=None):
+        """add(filething, frames=None)
+
+        Add a file to write to.
+
+        Args:
+            filething (filething)
+            frames (List[Frame]): frames only for this file, they replace
+                shared frames with the same HashKey
+        """
+
+        self.__files.append((filething, list(frames or [])))
+
+    def __len__(self):
+        return len(self.__files)
+
+    def __iter__(self):
+        """Yields a (filething, ID3) tuple for each added file, in the
+        order they were added. The tags share the frame instances of
+        `frames`.
+        """
+
+        for filething, frames in self.__files:
+            tag = ID3()
+            tag.update(self.frames)
+            for frame in frames:
+                tag.add(frame)
+            yield filething, tag
+
+    def save(self, v1=1, v2_version=4, v23_sep='/', padding=None):
+        """save(v1=1, v2_version=4, v23_sep='/', padding=None)
+
+        Replace the tags of all added files, one after another. See
+        `ID3.save` for the arguments.
+
+        Raises:
+            mutagen.MutagenError: if writing a file failed, files added
+                before it have been written already
+        """
+
+        for filething, tag in self:
+            tag.save(filething, v1=v1, v2_version=v2_version,
+                     v23_sep=v23_sep, padding=padding)
+
+
 @convert_error(IOError, error)
 @loadfile(method=False, writable=True)
 def delete(filething, delete_v1=True, delete_v2=True):
@@ -1102,6 +1270,17 @@ class ID3FileType(mutagen.FileType):
     def score(filename, fileobj, header_data):
         return header_data.startswith(b"ID3")
 
+    def save_to(self, dest, **kwargs):
+        """save_to(dest, v1=1, v2_version=4, v23_sep='/', padding=None)
+
+        Write a copy of the file with the current tags to dest, see
+        `ID3.save_to`.
+        """
+
+        if self.tags is None:
+            return super(ID3FileType, self).save_to(dest)
+        return self.tags.save_to(dest, source=self.filename, **kwargs)
+
     def add_tags(self, ID3=None):
         """Add an empty ID3 tag to the file.
 
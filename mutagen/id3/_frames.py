@@ -16,7 +16,7 @@ from ._specs import (
     VolumeAdjustmentsSpec, VolumePeakSpec, VolumeAdjustmentSpec,
     ChannelSpec, MultiSpec, SynchronizedTextSpec, KeyEventSpec, TimeStampSpec,
     EncodedNumericPartTextSpec, EncodedNumericTextSpec, SpecError,
-    PictureTypeSpec)
+    PictureTypeSpec, ID3TimeStamp)
 from .._compat import text_type, string_types, swap_to_string, iteritems, izip
 
 
@@ -30,6 +30,16 @@ def _bytes2key(b):
     return b.decode("latin1")
 
 
+def _freeze(value):
+    """Returns an immutable copy of a frame value for change detection"""
+
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    elif isinstance(value, ID3TimeStamp):
+        return (ID3TimeStamp, value.text)
+    return value
+
+
 class Frame(object):
     """Fundamental unit of ID3 data.
 
@@ -55,6 +65,9 @@ class Frame(object):
 
     _framespec = []
 
+    _encoded = None
+    """(key, state, data) of the last known encoding of the frame data"""
+
     def __init__(self, *args, **kwargs):
         if len(args) == 1 and len(kwargs) == 0 and \
                 isinstance(args[0], type(self)):
@@ -71,9 +84,31 @@ class Frame(object):
         for checker in self._framespec:
             if checker.name == name:
                 self.__dict__[name] = checker.validate(self, value)
+                self.__dict__.pop("_encoded", None)
                 return
         super(Frame, self).__setattr__(name, value)
 
+    def _get_state(self):
+        """A snapshot of all values, so changes made in place (like
+        appending to the text list) can be detected.
+        """
+
+        specs = self._framespec + getattr(self, "_optionalspec", [])
+        return tuple(_freeze(getattr(self, s.name, None)) for s in specs)
+
+    def _get_encoded(self, key):
+        """Returns the cached frame data for key, or None if the frame
+        has changed since or was never encoded that way.
+        """
+
+        encoded = self._encoded
+        if encoded is not None and encoded[0] == key and \
+                encoded[1] == self._get_state():
+            return encoded[2]
+
+    def _set_encoded(self, key, data):
+        self._encoded = (key, self._get_state(), data)
+
     def _to_other(self, other):
         # this impl covers subclasses with the same framespec
         if other._framespec is not self._framespec:
@@ -204,7 +239,17 @@ class Frame(object):
                     raise ID3JunkFrameError('zlib: %s: %r' % (err, data))
 
         frame = cls()
-        frame._readData(data)
+        leftover = frame._readData(data)
+
+        # remember the data of unchanged v2.4 frames so saving can reuse it
+        if id3.version >= id3._V24 and not id3.f_unsynch and not leftover \
+                and not tflags & (Frame.FLAG24_COMPRESS |
+                                  Frame.FLAG24_DATALEN |
+                                  Frame.FLAG24_UNSYNCH |
+                                  Frame.FLAG24_ENCRYPT |
+                                  Frame.FLAG24_GROUPID):
+            frame._set_encoded((id3._V24,), data)
+
         return frame
 
     def __hash__(self):
@@ -232,6 +277,7 @@ class FrameOpt(Frame):
         for checker in self._optionalspec:
             if checker.name == name:
                 self.__dict__[name] = checker.validate(self, value)
+                self.__dict__.pop("_encoded", None)
                 return
         super(FrameOpt, self).__setattr__(name, value)
 
@@ -28,12 +28,12 @@ import sys
 
 from mutagen import FileType, Tags, StreamInfo, PaddingInfo
 from mutagen._constants import GENRES
-from mutagen._util import cdata, insert_bytes, DictProxy, MutagenError, \
+from mutagen._util import cdata, DictProxy, MutagenError, \
     hashable, enum, get_size, resize_bytes, loadfile, convert_error
 from mutagen._compat import (reraise, PY2, string_types, text_type, chr_,
                              iteritems, PY3, cBytesIO, izip, xrange)
 from ._atom import Atoms, Atom, AtomError
-from ._util import parse_full_atom
+from ._util import parse_full_atom, shift_offsets
 from ._as_entry import AudioSampleEntry, ASEntryError
 
 
@@ -53,7 +53,8 @@ class MP4MetadataValueError(ValueError, MP4MetadataError):
     pass
 
 
-__all__ = ['MP4', 'Open', 'delete', 'MP4Cover', 'MP4FreeForm', 'AtomDataType']
+__all__ = ['MP4', 'Open', 'delete', 'MP4Cover', 'MP4FreeForm', 'AtomDataType',
+           'MP4SaveInfo', 'MP4SaveStrategy']
 
 
 @enum
@@ -201,6 +202,57 @@ class MP4FreeForm(bytes):
 
 
 
+@enum
+class MP4SaveStrategy(object):
+    """Enum for the ``strategy`` argument of `MP4Tags.save`.
+
+    In all cases free space ('free' or 'skip' atoms) following the tags
+    gets used first if the tags grow, as long as there is no media data in
+    between.
+    """
+
+    IN_PLACE = 0
+    """resize the tags where they are, moving all data following them
+       if needed"""
+
+    MOVE_MOOV = 1
+    """if the tags grow and the 'moov' atom is in front of the media data,
+       move it to the end of the file and replace the old one with a 'free'
+       atom, so the media data stays where it is"""
+
+    AUTO = 2
+    """use whichever of the above moves fewer bytes"""
+
+
+class MP4SaveInfo(object):
+    """MP4SaveInfo()
+
+    Returned by `MP4Tags.save` and `MP4.save`, describes the work needed
+    to save the tags.
+
+    Attributes:
+        strategy (`MP4SaveStrategy`): the strategy used, either
+            ``IN_PLACE`` or ``MOVE_MOOV``
+        bytes_moved (`int`): number of bytes written, including data
+            that had to be moved
+        offset_tables (`int`): number of chunk offset tables ('stco',
+            'co64') and fragment headers ('tfhd') that had to be rewritten
+        offset_entries (`int`): number of offsets changed in them
+    """
+
+    def __init__(self):
+        self.strategy = MP4SaveStrategy.IN_PLACE
+        self.bytes_moved = 0
+        self.offset_tables = 0
+        self.offset_entries = 0
+
+    def __repr__(self):
+        return ("<%s strategy=%s bytes_moved=%d offset_tables=%d "
+                "offset_entries=%d>") % (
+            type(self).__name__, self.strategy, self.bytes_moved,
+            self.offset_tables, self.offset_entries)
+
+
 def _name2key(name):
     if PY2:
         return name
@@ -213,27 +265,59 @@ def _key2name(key):
     return key.encode("latin-1")
 
 
+_FREE_ATOMS = [b"free", b"skip"]
+
+
 def _find_padding(atom_path):
-    # Check for padding "free" atom
-    # XXX: we only use them if they are adjacent to ilst, and only one.
-    # and there also is a top level free atom which we could use maybe..?
+    """Returns the padding atoms ("free" or "skip") directly in front of
+    and after the ilst atom, ordered by offset.
+    """
 
+    # XXX: there also is a top level free atom which we could use maybe..?
     meta, ilst = atom_path[-2:]
     assert meta.name == b"meta" and ilst.name == b"ilst"
-    index = meta.children.index(ilst)
-    try:
-        prev = meta.children[index - 1]
-        if prev.name == b"free":
-            return prev
-    except IndexError:
-        pass
-
-    try:
-        next_ = meta.children[index + 1]
-        if next_.name == b"free":
-            return next_
-    except IndexError:
-        pass
+    children = meta.children
+    index = children.index(ilst)
+
+    start = index
+    while start > 0 and children[start - 1].name in _FREE_ATOMS:
+        start -= 1
+    end = index + 1
+    while end < len(children) and children[end].name in _FREE_ATOMS:
+        end += 1
+    return children[start:index] + children[index + 1:end]
+
+
+def _find_free_after(atoms, parents, offset):
+    """Yields (atom, grown) for all padding atoms following `offset` in
+    `parents` or on the top level, up to the first media data.
+
+    `grown` are the atoms in `parents` which don't contain the padding
+    atom and would grow if the padding atom gets resized instead.
+    """
+
+    levels = [(parents[i].children, parents[i + 1:])
+              for i in reversed(xrange(len(parents)))]
+    levels.append((atoms, parents))
+    for children, grown in levels:
+        for atom in children:
+            if atom.offset < offset:
+                continue
+            if atom.name in _FREE_ATOMS:
+                yield atom, grown
+            elif atom.name in (b"mdat", b"moof"):
+                return
+
+
+def _resize_header(data, offset, delta):
+    """Changes the size of the atom at `offset` in the bytearray `data`"""
+
+    size = cdata.uint_be(bytes(data[offset:offset + 4]))
+    if size == 1:  # 64bit
+        size = cdata.ulonglong_be(bytes(data[offset + 8:offset + 16]))
+        data[offset + 8:offset + 16] = cdata.to_ulonglong_be(size + delta)
+    else:  # 32bit
+        data[offset:offset + 4] = cdata.to_uint_be(size + delta)
 
 
 def _item_sort_key(key, value):
@@ -331,8 +415,7 @@ class MP4Tags(DictProxy, Tags):
         except KeyError as key:
             raise MP4MetadataError(key)
 
-        free = _find_padding(path)
-        self._padding = free.datalength if free is not None else 0
+        self._padding = sum(free.datalength for free in _find_padding(path))
 
         ilst = path[-1]
         for atom in ilst.children:
@@ -373,7 +456,19 @@ class MP4Tags(DictProxy, Tags):
 
     @convert_error(IOError, error)
     @loadfile(writable=True)
-    def save(self, filething, padding=None):
+    def save(self, filething, padding=None,
+             strategy=MP4SaveStrategy.IN_PLACE):
+        """save(filething=None, padding=None,
+        strategy=MP4SaveStrategy.IN_PLACE, atomic=False)
+
+        Args:
+            strategy (MP4SaveStrategy): how to make room if the tags grow
+            atomic (bool): save to a copy of the file and replace the
+                file with it once done, so it is never left half written.
+                Files with more than one hard link are saved in place.
+        Returns:
+            MP4SaveInfo
+        """
 
         values = []
         items = sorted(self.items(), key=lambda kv: _item_sort_key(*kv))
@@ -399,20 +494,21 @@ class MP4Tags(DictProxy, Tags):
         # Find the old atoms.
         try:
             atoms = Atoms(filething.fileobj)
+            return self.__save(
+                filething.fileobj, atoms, data, padding, strategy)
         except AtomError as err:
             reraise(error, err, sys.exc_info()[2])
 
-        self.__save(filething.fileobj, atoms, data, padding)
-
-    def __save(self, fileobj, atoms, data, padding):
+    def __save(self, fileobj, atoms, data, padding, strategy):
         try:
             path = atoms.path(b"moov", b"udta", b"meta", b"ilst")
         except KeyError:
-            self.__save_new(fileobj, atoms, data, padding)
+            return self.__save_new(fileobj, atoms, data, padding, strategy)
         else:
-            self.__save_existing(fileobj, atoms, path, data, padding)
+            return self.__save_existing(
+                fileobj, atoms, path, data, padding, strategy)
 
-    def __save_new(self, fileobj, atoms, ilst_data, padding_func):
+    def __save_new(self, fileobj, atoms, ilst_data, padding_func, strategy):
         hdlr = Atom.render(b"hdlr", b"\x00" * 8 + b"mdirappl" + b"\x00" * 9)
         meta_data = b"\x00\x00\x00\x00" + hdlr + ilst_data
 
@@ -421,7 +517,9 @@ class MP4Tags(DictProxy, Tags):
         except KeyError:
             path = atoms.path(b"moov")
 
-        offset = path[-1]._dataoffset
+        # append, so only the end of the container has to be moved in case
+        # free space after it can be used
+        offset = path[-1].offset + path[-1].length
 
         # ignoring some atom overhead... but we don't have padding left anyway
         # and padding_size is guaranteed to be less than zero
@@ -440,21 +538,18 @@ class MP4Tags(DictProxy, Tags):
         else:
             data = meta
 
-        insert_bytes(fileobj, len(data), offset)
-        fileobj.seek(offset)
-        fileobj.write(data)
-        self.__update_parents(fileobj, path, len(data))
-        self.__update_offsets(fileobj, atoms, len(data), offset)
+        return self.__replace(
+            fileobj, atoms, path, offset, 0, data, strategy)
 
-    def __save_existing(self, fileobj, atoms, path, ilst_data, padding_func):
+    def __save_existing(self, fileobj, atoms, path, ilst_data, padding_func,
+                        strategy):
         # Replace the old ilst atom.
         ilst = path[-1]
         offset = ilst.offset
         length = ilst.length
 
-        # Use adjacent free atom if there is one
-        free = _find_padding(path)
-        if free is not None:
+        # Use adjacent free atoms if there are any
+        for free in _find_padding(path):
             offset = min(offset, free.offset)
             length += free.length
 
@@ -470,13 +565,125 @@ class MP4Tags(DictProxy, Tags):
 
         ilst_data += Atom.render(b"free", b"\x00" * new_padding)
 
-        resize_bytes(fileobj, length, len(ilst_data), offset)
-        delta = len(ilst_data) - length
+        return self.__replace(
+            fileobj, atoms, path[:-1], offset, length, ilst_data, strategy)
+
+    def __replace(self, fileobj, atoms, parents, offset, length, data,
+                  strategy):
+        """Replace `length` bytes at `offset` contained in the atoms
+        `parents` with `data`. Returns a MP4SaveInfo.
+        """
+
+        # The atoms describe the file as it was loaded, so everything we
+        # need to update has to be looked up before the file gets changed.
+        tables = self.__find_offset_tables(atoms)
+
+        delta = len(data) - length
+        end = offset + length
+        moved = get_size(fileobj) - end if delta != 0 else 0
+        options = [(len(data) + moved, MP4SaveStrategy.IN_PLACE, None)]
+
+        if delta > 0:
+            for free, grown in _find_free_after(atoms, parents, end):
+                left = free.length - delta
+                if left == 0 or 8 <= left <= 0xFFFFFFFF:
+                    size = len(data) + (free.offset - end) + 8
+                    options.append(
+                        (size, MP4SaveStrategy.IN_PLACE, (free, grown)))
+                    break
+
+        if strategy != MP4SaveStrategy.IN_PLACE and \
+                self.__can_move_moov(fileobj, atoms, delta):
+            size = parents[0].length + delta
+            options.append((size, MP4SaveStrategy.MOVE_MOOV, None))
+
+        if strategy == MP4SaveStrategy.AUTO:
+            size, used, free = min(options, key=lambda o: o[0])
+        else:
+            # free space first, then the requested strategy, then the
+            # fallback
+            options.sort(key=lambda o: (o[2] is None, o[1] != strategy))
+            size, used, free = options[0]
+
+        if used == MP4SaveStrategy.MOVE_MOOV:
+            info = self.__move_moov(fileobj, parents, offset, length, data)
+        elif free is not None:
+            info = self.__resize_free(
+                fileobj, free[0], free[1], offset, length, data)
+        else:
+            resize_bytes(fileobj, length, len(data), offset)
+            fileobj.seek(offset)
+            fileobj.write(data)
+            self.__update_parents(fileobj, parents, delta)
+            info = self.__update_offsets(fileobj, tables, delta, offset)
+
+        info.strategy = used
+        info.bytes_moved = size
+        return info
+
+    def __resize_free(self, fileobj, free, grown, offset, length, data):
+        """Replace the data like __replace, but take the needed space from
+        the padding atom `free` instead of moving everything after it.
+        """
+
+        delta = len(data) - length
+        end = offset + length
+        fileobj.seek(end)
+        between = fileobj.read(free.offset - end)
+
+        # only the header of the remaining padding atom needs to be written
+        left = free.length - delta
+        if left:
+            between += struct.pack(">I4s", left, b"free")
 
         fileobj.seek(offset)
-        fileobj.write(ilst_data)
-        self.__update_parents(fileobj, path[:-1], delta)
-        self.__update_offsets(fileobj, atoms, delta, offset)
+        fileobj.write(data + between)
+        self.__update_parents(fileobj, grown, delta)
+        return MP4SaveInfo()
+
+    def __can_move_moov(self, fileobj, atoms, delta):
+        """If the moov atom is in front of the media data and can be moved
+        to the end of the file.
+
+        Never for fragmented files, where moov has to come before all moof
+        atoms and mfra has to be the last atom.
+        """
+
+        if delta <= 0:
+            return False
+        for name in (b"moof", b"mfra"):
+            if any(True for a in atoms.findall(name)):
+                return False
+        moov = atoms[b"moov"]
+        if moov.length + delta > 0xFFFFFFFF:
+            return False
+        if not any(a.offset > moov.offset for a in atoms.findall(b"mdat")):
+            return False
+        # a last atom with a size of zero extends to the end of the file
+        # and would include the moved atom
+        fileobj.seek(atoms.last().offset)
+        return cdata.uint_be(fileobj.read(4)) != 0
+
+    def __move_moov(self, fileobj, parents, offset, length, data):
+        """Replace the data like __replace, but write the changed moov atom
+        to the end of the file and turn the old one into a padding atom.
+        """
+
+        moov = parents[0]
+        fileobj.seek(moov.offset)
+        moov_data = bytearray(fileobj.read(moov.length))
+        start = offset - moov.offset
+        moov_data[start:start + length] = data
+        for atom in parents:
+            _resize_header(moov_data, atom.offset - moov.offset,
+                           len(data) - length)
+
+        fileobj.seek(0, 2)
+        fileobj.write(bytes(moov_data))
+        # only give up the old one once the new one is written
+        fileobj.seek(moov.offset + 4)
+        fileobj.write(b"free")
+        return MP4SaveInfo()
 
     def __update_parents(self, fileobj, path, delta):
         """Update all parent atoms with the new size."""
@@ -496,45 +703,75 @@ class MP4Tags(DictProxy, Tags):
                 fileobj.seek(atom.offset)
                 fileobj.write(cdata.to_uint_be(size + delta))
 
-    def __update_offset_table(self, fileobj, fmt, atom, delta, offset):
-        """Update offset table in the specified atom."""
+    def __update_offset_table(self, fileobj, size, atom, delta, offset):
+        """Update offset table in the specified atom.
+        Returns the number of changed offsets.
+        """
         if atom.offset > offset:
             atom.offset += delta
         fileobj.seek(atom.offset + 12)
         data = fileobj.read(atom.length - 12)
-        fmt = fmt % cdata.uint_be(data[:4])
-        offsets = struct.unpack(fmt, data[4:])
-        offsets = [o + (0, delta)[offset < o] for o in offsets]
-        fileobj.seek(atom.offset + 16)
-        fileobj.write(struct.pack(fmt, *offsets))
+        count = cdata.uint_be(data[:4])
+        data, changed = shift_offsets(
+            data[4:4 + count * size], size, delta, offset)
+        if changed:
+            fileobj.seek(atom.offset + 16)
+            fileobj.write(data)
+        return changed
 
     def __update_tfhd(self, fileobj, atom, delta, offset):
+        """Update the base data offset in the specified atom.
+        Returns the number of changed offsets.
+        """
         if atom.offset > offset:
             atom.offset += delta
         fileobj.seek(atom.offset + 9)
-        data = fileobj.read(atom.length - 9)
+        data = fileobj.read(15)
         flags = cdata.uint_be(b"\x00" + data[:3])
         if flags & 1:
             o = cdata.ulonglong_be(data[7:15])
             if o > offset:
-                o += delta
-            fileobj.seek(atom.offset + 16)
-            fileobj.write(cdata.to_ulonglong_be(o))
+                fileobj.seek(atom.offset + 16)
+                fileobj.write(cdata.to_ulonglong_be(o + delta))
+                return 1
+        return 0
+
+    def __find_offset_tables(self, atoms):
+        """Returns all 'stco', 'co64' and 'tfhd' atoms as lists."""
 
-    def __update_offsets(self, fileobj, atoms, delta, offset):
-        """Update offset tables in all 'stco' and 'co64' atoms."""
-        if delta == 0:
-            return
-        moov = atoms[b"moov"]
-        for atom in moov.findall(b'stco', True):
-            self.__update_offset_table(fileobj, ">%dI", atom, delta, offset)
-        for atom in moov.findall(b'co64', True):
-            self.__update_offset_table(fileobj, ">%dQ", atom, delta, offset)
         try:
-            for atom in atoms[b"moof"].findall(b'tfhd', True):
-                self.__update_tfhd(fileobj, atom, delta, offset)
+            moov = atoms[b"moov"]
         except KeyError:
-            pass
+            stco, co64 = [], []
+        else:
+            stco = list(moov.findall(b'stco', True))
+            co64 = list(moov.findall(b'co64', True))
+        tfhd = []
+        for moof in atoms.findall(b"moof"):
+            tfhd.extend(moof.findall(b'tfhd', True))
+        return stco, co64, tfhd
+
+    def __update_offsets(self, fileobj, tables, delta, offset):
+        """Update offset tables in all 'stco', 'co64' and 'tfhd' atoms.
+        Returns a MP4SaveInfo.
+        """
+        info = MP4SaveInfo()
+        if delta == 0:
+            return info
+        stco, co64, tfhd = tables
+        for size, atoms in [(4, stco), (8, co64)]:
+            for atom in atoms:
+                changed = self.__update_offset_table(
+                    fileobj, size, atom, delta, offset)
+                if changed:
+                    info.offset_tables += 1
+                    info.offset_entries += changed
+        for atom in tfhd:
+            changed = self.__update_tfhd(fileobj, atom, delta, offset)
+            if changed:
+                info.offset_tables += 1
+                info.offset_entries += changed
+        return info
 
     def __parse_data(self, atom, data):
         pos = 0
@@ -995,7 +1232,12 @@ class MP4(FileType):
         except Exception as err:
             reraise(MP4StreamInfoError, err, sys.exc_info()[2])
 
-        if not MP4Tags._can_load(atoms):
+        try:
+            can_load = MP4Tags._can_load(atoms)
+        except AtomError as err:
+            reraise(error, err, sys.exc_info()[2])
+
+        if not can_load:
             self.tags = None
             self._padding = 0
         else:
@@ -1009,9 +1251,13 @@ class MP4(FileType):
                 self._padding = self.tags._padding
 
     def save(self, *args, **kwargs):
-        """save(filething=None, padding=None)"""
+        """save(filething=None, padding=None, atomic=False)
+
+        Returns:
+            MP4SaveInfo or `None` if there are no tags
+        """
 
-        super(MP4, self).save(*args, **kwargs)
+        return super(MP4, self).save(*args, **kwargs)
 
     def add_tags(self):
         if self.tags is None:
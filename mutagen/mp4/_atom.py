@@ -7,6 +7,7 @@
 # published by the Free Software Foundation.
 
 import struct
+from array import array
 
 from mutagen._compat import PY2
 from mutagen._util import convert_error
@@ -22,6 +23,151 @@ class AtomError(Exception):
     pass
 
 
+def _read_header(fileobj, level):
+    """Reads the atom header at the current position.
+
+    Returns (name, offset, length, dataoffset).
+    Can raise AtomError or IOError.
+    """
+
+    offset = fileobj.tell()
+    try:
+        length, name = struct.unpack(">I4s", fileobj.read(8))
+    except struct.error:
+        raise AtomError("truncated data")
+    dataoffset = offset + 8
+    if length == 1:
+        try:
+            length, = struct.unpack(">Q", fileobj.read(8))
+        except struct.error:
+            raise AtomError("truncated data")
+        dataoffset += 8
+        if length < 16:
+            raise AtomError(
+                "64 bit atom length can only be 16 and higher")
+    elif length == 0:
+        if level != 0:
+            raise AtomError(
+                "only a top-level atom can have zero length")
+        # Only the last atom is supposed to have a zero-length, meaning it
+        # extends to the end of file.
+        fileobj.seek(0, 2)
+        length = fileobj.tell() - offset
+    elif length < 8:
+        raise AtomError(
+            "atom length can only be 0, 1 or 8 and higher")
+    return name, offset, length, dataoffset
+
+
+def _offset_array():
+    """An empty array able to hold 64 bit file offsets"""
+
+    # 'Q' is Python 3 only, but 'L' is 64 bit on most Python 2 platforms
+    for typecode in ("Q", "L"):
+        try:
+            offsets = array(typecode)
+        except ValueError:
+            continue
+        if offsets.itemsize >= 8:
+            return offsets
+    return []
+
+
+class _AtomTree(object):
+    """The headers of a range of atoms and everything below them.
+
+    Only names, offsets and lengths are kept, in compact arrays and in
+    file order, so the descendants of an entry directly follow it. Atom
+    objects get created the first time an entry is accessed, which keeps
+    files with many atoms (e.g. fragmented files with a moof per fragment)
+    cheap to load. All headers are read on creation, so the file doesn't
+    have to stay open afterwards.
+    """
+
+    def __init__(self):
+        self._names = bytearray()
+        self._offsets = _offset_array()
+        self._lengths = _offset_array()
+        self._header_sizes = bytearray()
+        # index of the entry following the last descendant of each entry
+        self._ends = _offset_array()
+        self._atoms = {}
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def read_range(self, fileobj, start, end, level):
+        """Reads all atoms between start and end.
+
+        Can raise AtomError or IOError.
+        """
+
+        # Top level atoms are allowed to be followed by some garbage
+        # smaller than a header, child atoms have to fill their parent.
+        min_size = 8 if level == 0 else 1
+        pos = start
+        while pos + min_size <= end:
+            pos = self.read_atom(fileobj, pos, level)
+
+    def read_atom(self, fileobj, pos, level):
+        """Reads the atom at `pos` and its children.
+
+        Returns the offset following the atom.
+        Can raise AtomError or IOError.
+        """
+
+        fileobj.seek(pos, 0)
+        name, offset, length, dataoffset = _read_header(fileobj, level)
+        i = len(self._offsets)
+        self._names.extend(name)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._header_sizes.append(dataoffset - offset)
+        self._ends.append(i + 1)
+        if name in _CONTAINERS:
+            self.read_range(fileobj, dataoffset + _SKIP_SIZE.get(name, 0),
+                            offset + length, level + 1)
+            self._ends[i] = len(self._offsets)
+        return offset + length
+
+    def name(self, i):
+        return bytes(self._names[i * 4:i * 4 + 4])
+
+    def children(self, i=None):
+        """Yields the indices of the children of entry `i`, or of the
+        top-level entries if `i` is None.
+        """
+
+        if i is None:
+            j, end = 0, len(self)
+        else:
+            j, end = i + 1, self._ends[i]
+        ends = self._ends
+        while j < end:
+            yield j
+            j = ends[j]
+
+    def find(self, name, i=None):
+        """Yields the indices of all children of entry `i` named `name`"""
+
+        for j in self.children(i):
+            if self.name(j) == name:
+                yield j
+
+    def atom(self, i):
+        """Returns the Atom for entry `i`, creating it if needed"""
+
+        try:
+            return self._atoms[i]
+        except KeyError:
+            offset = self._offsets[i]
+            atom = Atom._from_entry(
+                self, i, self.name(i), offset, self._lengths[i],
+                offset + self._header_sizes[i])
+            self._atoms[i] = atom
+            return atom
+
+
 class Atom(object):
     """An individual atom.
 
@@ -35,47 +181,38 @@ class Atom(object):
     This structure should only be used internally by Mutagen.
     """
 
-    children = None
-
     @convert_error(IOError, AtomError)
     def __init__(self, fileobj, level=0):
         """May raise AtomError"""
 
-        self.offset = fileobj.tell()
-        try:
-            self.length, self.name = struct.unpack(">I4s", fileobj.read(8))
-        except struct.error:
-            raise AtomError("truncated data")
-        self._dataoffset = self.offset + 8
-        if self.length == 1:
-            try:
-                self.length, = struct.unpack(">Q", fileobj.read(8))
-            except struct.error:
-                raise AtomError("truncated data")
-            self._dataoffset += 8
-            if self.length < 16:
-                raise AtomError(
-                    "64 bit atom length can only be 16 and higher")
-        elif self.length == 0:
-            if level != 0:
-                raise AtomError(
-                    "only a top-level atom can have zero length")
-            # Only the last atom is supposed to have a zero-length, meaning it
-            # extends to the end of file.
-            fileobj.seek(0, 2)
-            self.length = fileobj.tell() - self.offset
-            fileobj.seek(self.offset + 8, 0)
-        elif self.length < 8:
-            raise AtomError(
-                "atom length can only be 0, 1 or 8 and higher")
+        tree = _AtomTree()
+        end = tree.read_atom(fileobj, fileobj.tell(), level)
+        offset = tree._offsets[0]
+        self.__setup(tree, 0, tree.name(0), offset, tree._lengths[0],
+                     offset + tree._header_sizes[0])
+        tree._atoms[0] = self
+        fileobj.seek(end, 0)
+
+    @classmethod
+    def _from_entry(cls, tree, i, name, offset, length, dataoffset):
+        atom = cls.__new__(cls)
+        atom.__setup(tree, i, name, offset, length, dataoffset)
+        return atom
+
+    def __setup(self, tree, i, name, offset, length, dataoffset):
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self._dataoffset = dataoffset
+        self._tree = tree
+        self._i = i
 
-        if self.name in _CONTAINERS:
-            self.children = []
-            fileobj.seek(_SKIP_SIZE.get(self.name, 0), 1)
-            while fileobj.tell() < self.offset + self.length:
-                self.children.append(Atom(fileobj, level + 1))
-        else:
-            fileobj.seek(self.offset + self.length, 0)
+    @property
+    def children(self):
+        if self.name not in _CONTAINERS:
+            return None
+        tree = self._tree
+        return [tree.atom(j) for j in tree.children(self._i)]
 
     @property
     def datalength(self):
@@ -100,13 +237,18 @@ class Atom(object):
 
     def findall(self, name, recursive=False):
         """Recursively find all child atoms by specified name."""
-        if self.children is not None:
-            for child in self.children:
-                if child.name == name:
-                    yield child
-                if recursive:
-                    for atom in child.findall(name, True):
-                        yield atom
+
+        if self.name not in _CONTAINERS:
+            return
+        tree = self._tree
+        # only create atoms which match or which we have to look into
+        for j in tree.children(self._i):
+            child_name = tree.name(j)
+            if child_name == name:
+                yield tree.atom(j)
+            if recursive and child_name in _CONTAINERS:
+                for atom in tree.atom(j).findall(name, True):
+                    yield atom
 
     def __getitem__(self, remaining):
         """Look up a child atom, potentially recursively.
@@ -115,21 +257,21 @@ class Atom(object):
         """
         if not remaining:
             return self
-        elif self.children is None:
+        if self.name not in _CONTAINERS:
             raise KeyError("%r is not a container" % self.name)
-        for child in self.children:
-            if child.name == remaining[0]:
-                return child[remaining[1:]]
+        for j in self._tree.find(remaining[0], self._i):
+            return self._tree.atom(j)[remaining[1:]]
         else:
             raise KeyError("%r not found" % remaining[0])
 
     def __repr__(self):
         cls = self.__class__.__name__
-        if self.children is None:
+        children = self.children
+        if children is None:
             return "<%s name=%r length=%r offset=%r>" % (
                 cls, self.name, self.length, self.offset)
         else:
-            children = "\n".join([" " + line for child in self.children
+            children = "\n".join([" " + line for child in children
                                   for line in repr(child).splitlines()])
             return "<%s name=%r length=%r offset=%r\n%s>" % (
                 cls, self.name, self.length, self.offset, children)
@@ -141,17 +283,42 @@ class Atoms(object):
     Attributes:
     atoms -- a list of top-level atoms as Atom objects
 
+    All atom headers get read on creation, the Atom objects are created
+    on access (see _AtomTree).
+
     This structure should only be used internally by Mutagen.
     """
 
     @convert_error(IOError, AtomError)
     def __init__(self, fileobj):
-        self.atoms = []
         fileobj.seek(0, 2)
         end = fileobj.tell()
-        fileobj.seek(0)
-        while fileobj.tell() + 8 <= end:
-            self.atoms.append(Atom(fileobj))
+        self._tree = _AtomTree()
+        self._tree.read_range(fileobj, 0, end, 0)
+
+    @property
+    def atoms(self):
+        return list(self)
+
+    def __iter__(self):
+        tree = self._tree
+        for i in tree.children():
+            yield tree.atom(i)
+
+    def last(self):
+        """Returns the last top-level atom or None"""
+
+        last = None
+        for last in self._tree.children():
+            pass
+        if last is not None:
+            return self._tree.atom(last)
+
+    def findall(self, name):
+        """Find all top-level atoms by specified name."""
+
+        for i in self._tree.find(name):
+            yield self._tree.atom(i)
 
     def path(self, *names):
         """Look up and return the complete path of an atom.
@@ -187,9 +354,8 @@ class Atoms(object):
             if isinstance(names, bytes):
                 names = names.split(b".")
 
-        for child in self.atoms:
-            if child.name == names[0]:
-                return child[names[1:]]
+        for i in self._tree.find(names[0]):
+            return self._tree.atom(i)[names[1:]]
         else:
             raise KeyError("%r not found" % names[0])
 
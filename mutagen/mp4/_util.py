@@ -5,7 +5,17 @@
 # it under the terms of the GNU General Public License version 2 as
 # published by the Free Software Foundation.
 
+import sys
+import struct
+from array import array
+
 from mutagen._util import cdata
+from mutagen._compat import PY2
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def parse_full_atom(data):
@@ -19,3 +29,71 @@ def parse_full_atom(data):
     version = ord(data[0:1])
     flags = cdata.uint_be(b"\x00" + data[1:4])
     return version, flags, data[4:]
+
+
+def _array_typecode(size):
+    """Returns an array typecode for unsigned ints of `size` bytes or None"""
+
+    for typecode in ("I", "L", "Q"):
+        try:
+            if array(typecode).itemsize == size:
+                return typecode
+        except ValueError:
+            pass
+
+
+def _check_range(low, high, size, delta):
+    """Raises struct.error if adding `delta` to values between `low` and
+    `high` leaves the range of `size` byte unsigned ints.
+    """
+
+    if low + delta < 0 or high + delta >= 1 << (size * 8):
+        raise struct.error("shifted offset out of range")
+
+
+def shift_offsets(data, size, delta, offset):
+    """Takes `data` as a list of big-endian unsigned integers of `size` bytes
+    (4 or 8) and adds `delta` to all values larger than `offset`.
+
+    Returns the new data and the number of changed values.
+    Can raise struct.error if a changed value doesn't fit into `size` bytes.
+    Uses numpy if available.
+    """
+
+    count = len(data) // size
+    data = data[:count * size]
+
+    if numpy is not None:
+        values = numpy.frombuffer(data, ">u%d" % size).copy()
+        mask = values > offset
+        changed = int(numpy.count_nonzero(mask))
+        if changed:
+            shifted = values[mask]
+            _check_range(int(shifted.min()), int(shifted.max()), size, delta)
+            if delta < 0:
+                values[mask] -= -delta
+            else:
+                values[mask] += delta
+        return values.tobytes(), changed
+
+    typecode = _array_typecode(size)
+    if typecode is not None:
+        values = array(typecode, data)
+        if sys.byteorder == "little":
+            values.byteswap()
+    else:
+        values = list(struct.unpack(">%d%s" % (count, "IQ"[size // 8]), data))
+
+    indices = [i for i, v in enumerate(values) if v > offset]
+    if indices:
+        shifted = [values[i] for i in indices]
+        _check_range(min(shifted), max(shifted), size, delta)
+        for i in indices:
+            values[i] += delta
+
+    if typecode is None:
+        return struct.pack(">%d%s" % (count, "IQ"[size // 8]), *values), \
+            len(indices)
+    if sys.byteorder == "little":
+        values.byteswap()
+    return (values.tostring() if PY2 else values.tobytes()), len(indices)
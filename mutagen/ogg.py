@@ -22,6 +22,7 @@ import zlib
 
 from mutagen import FileType
 from mutagen._util import cdata, resize_bytes, MutagenError, loadfile, seek_end
+from mutagen._tags import PaddingInfo
 from ._compat import cBytesIO, reraise, chr_, izip, xrange
 
 
@@ -31,6 +32,62 @@ class error(MutagenError):
     pass
 
 
+class OggPaddingInfo(PaddingInfo):
+    """OggPaddingInfo()
+
+    Padding information for a comment packet in an Ogg stream.
+
+    Next to `get_default_padding` this provides `get_page_aligned_padding`,
+    which can be used in the padding callback instead.
+
+    Attributes:
+        padding (`int`): The amount of padding left after saving in bytes
+            (can be negative if more data needs to be added as padding is
+            available)
+        size (`int`): The amount of data following the padding
+        packet_size (`int`): The size of the comment packet without padding
+    """
+
+    def __init__(self, padding, size, packet_size, packets=None,
+                 old_pages=None):
+        super(OggPaddingInfo, self).__init__(padding, size)
+        self.packet_size = packet_size
+        # the old comment packet, followed by the other packets on its pages
+        self._packets = packets
+        self._old_pages = old_pages
+
+    def get_page_aligned_padding(self):
+        """Like `get_default_padding`, but in case the comment packet has to
+        grow so much that it no longer fits into its pages, the padding
+        gets extended so the packet fills up the last of its new pages.
+        This leaves enough room for the next edits to keep the size and
+        number of the pages the same.
+
+        Returns:
+            int: Amount of padding after saving
+        """
+
+        padding = self.get_default_padding()
+        if self.padding >= 0 or self._old_pages is None:
+            return padding
+
+        # while the packets fit, they get spread over the old pages
+        # (see OggPage._from_packets_keep_pages)
+        sizes = [self.packet_size + padding]
+        sizes.extend(len(p) for p in self._packets[1:])
+        if OggPage._fits_pages(sizes, self._old_pages):
+            return padding
+
+        # otherwise from_packets() puts the comment packet on pages of its
+        # own, each of them holding _PAGE_DATA_SIZE bytes of it
+        end = self.packet_size + padding
+        return padding + (-end) % OggPage._PAGE_DATA_SIZE
+
+    def __repr__(self):
+        return "<%s size=%d padding=%d packet_size=%d>" % (
+            type(self).__name__, self.size, self.padding, self.packet_size)
+
+
 class OggPage(object):
     """A single Ogg page (not necessarily a single encoded packet).
 
@@ -59,6 +116,9 @@ class OggPage(object):
     attributes will be filled in based on it.
     """
 
+    # the amount of data from_packets() puts into a page by default
+    _PAGE_DATA_SIZE = (4096 // 255) * 255
+
     version = 0
     __type_flags = 0
     position = 0
@@ -308,6 +368,95 @@ class OggPage(object):
 
         return new_pages
 
+    @classmethod
+    def _from_packets_keep_pages(cls, packets, old_pages):
+        """Like _from_packets_try_preserve, but in case only the sizes of
+        the packets differ, they get spread over the same number of pages
+        if they fit, so the following pages don't need to be renumbered.
+        """
+
+        old_packets = cls.to_packets(old_pages)
+        if [len(p) for p in packets] != [len(p) for p in old_packets]:
+            new_pages = cls._from_packets_fit(packets, old_pages)
+            if new_pages is not None:
+                return new_pages
+        return cls._from_packets_try_preserve(packets, old_pages)
+
+    @staticmethod
+    def _fits_pages(sizes, old_pages):
+        """If packets of the given sizes can be spread over as many pages as
+        there are in old_pages (see _from_packets_fit)
+        """
+
+        if old_pages[0].continued:
+            return False
+
+        complete = old_pages[-1].complete
+        if not complete and sizes[-1] % 255:
+            return False
+
+        # every packet ends with a segment shorter than 255 bytes, except
+        # for a last one continuing on the next page
+        segments = sum(size // 255 + 1 for size in sizes)
+        if not complete:
+            segments -= 1
+        count = len(old_pages)
+        return count <= segments <= count * 255
+
+    @classmethod
+    def _from_packets_fit(cls, packets, old_pages):
+        """Spread the packets evenly over as many pages as there are in
+        old_pages, or return None if they don't fit.
+
+        The last packet is expected to continue on the next page if the
+        last old page isn't complete.
+        """
+
+        if not cls._fits_pages([len(p) for p in packets], old_pages):
+            return None
+
+        complete = old_pages[-1].complete
+
+        # (packet index, offset, length, ends the packet) for each segment
+        segments = []
+        for i, packet in enumerate(packets):
+            quot, rem = divmod(len(packet), 255)
+            segments.extend((i, j * 255, 255, False) for j in xrange(quot))
+            if complete or i != len(packets) - 1:
+                segments.append((i, quot * 255, rem, True))
+
+        count = len(old_pages)
+
+        # header pages are positioned at 0, keep what was there
+        position = 0
+        for page in old_pages:
+            if page.position != -1:
+                position = page.position
+
+        new_pages = []
+        per_page, extra = divmod(len(segments), count)
+        start = 0
+        for i, old in enumerate(old_pages):
+            end = start + per_page + (i < extra)
+            new = OggPage()
+            new.sequence = old.sequence
+            new.continued = segments[start][1] != 0
+            new.complete = segments[end - 1][3]
+            new.position = -1
+            last = None
+            for index, offset, length, ends in segments[start:end]:
+                if index != last:
+                    pstart = offset
+                    new.packets.append(b"")
+                    last = index
+                if ends:
+                    new.position = position
+                new.packets[-1] = packets[index][pstart:offset + length]
+            new_pages.append(new)
+            start = end
+
+        return new_pages
+
     @staticmethod
     def from_packets(packets, sequence=0, default_size=4096,
                      wiggle_room=2048):
@@ -380,6 +529,9 @@ class OggPage(object):
 
         fileobj will be resized and pages renumbered as necessary. As
         such, it must be opened r+b or w+b.
+
+        Returns:
+            bool: True if the following pages had to be renumbered
         """
 
         if not len(old_pages) or not len(new_pages):
@@ -432,6 +584,8 @@ class OggPage(object):
             serial = new_pages[-1].serial
             sequence = new_pages[-1].sequence + 1
             cls.renumber(fileobj, serial, sequence)
+            return True
+        return False
 
     @staticmethod
     def find_last(fileobj, serial):
@@ -558,7 +712,7 @@ class OggFileType(FileType):
 
     @loadfile(writable=True)
     def save(self, filething, padding=None):
-        """save(filething=None, padding=None)
+        """save(filething=None, padding=None, atomic=False)
 
         Save a tag to a file.
 
@@ -566,13 +720,19 @@ class OggFileType(FileType):
 
         Args:
             filething (filething)
-            padding (PaddingFunction)
+            padding (PaddingFunction): gets passed an `OggPaddingInfo`
+            atomic (bool): save to a copy of the file and replace the
+                file with it once done, so it is never left half written.
+                Files with more than one hard link are saved in place.
+        Returns:
+            bool: True if the pages following the comment had to be
+            renumbered, which means the whole stream was rewritten
         Raises:
             mutagen.MutagenError
         """
 
         try:
-            self.tags._inject(filething.fileobj, padding)
+            return self.tags._inject(filething.fileobj, padding)
         except (IOError, error) as e:
             reraise(self._Error, e, sys.exc_info()[2])
         except EOFError:
@@ -99,7 +99,7 @@ class OggFLACVComment(VCommentDict):
             if page.serial == info.serial:
                 pages.append(page)
                 complete = page.complete or (len(page.packets) > 1)
-        comment = cBytesIO(OggPage.to_packets(pages)[0][4:])
+        comment = OggPage.to_packets(pages)[0][4:]
         super(OggFLACVComment, self).__init__(comment, framing=False)
 
     def _inject(self, fileobj, padding_func):
@@ -129,8 +129,8 @@ class OggFLACVComment(VCommentDict):
         data = packets[0][:1] + struct.pack(">I", len(data))[-3:] + data
         packets[0] = data
 
-        new_pages = OggPage.from_packets(packets, old_pages[0].sequence)
-        OggPage.replace(fileobj, old_pages, new_pages)
+        new_pages = OggPage._from_packets_keep_pages(packets, old_pages)
+        return OggPage.replace(fileobj, old_pages, new_pages)
 
 
 class OggFLAC(OggFileType):
@@ -19,11 +19,10 @@ __all__ = ["OggOpus", "Open", "delete"]
 import struct
 
 from mutagen import StreamInfo
-from mutagen._compat import BytesIO
 from mutagen._util import get_size, loadfile, convert_error
-from mutagen._tags import PaddingInfo
 from mutagen._vorbis import VCommentDict
-from mutagen.ogg import OggPage, OggFileType, error as OggError
+from mutagen.ogg import OggPage, OggFileType, OggPaddingInfo, \
+    error as OggError
 
 
 class error(OggError):
@@ -100,15 +99,14 @@ class OggOpusVComment(VCommentDict):
     def __init__(self, fileobj, info):
         pages = self.__get_comment_pages(fileobj, info)
         data = OggPage.to_packets(pages)[0][8:]  # Strip OpusTags
-        fileobj = BytesIO(data)
-        super(OggOpusVComment, self).__init__(fileobj, framing=False)
+        super(OggOpusVComment, self).__init__(data, framing=False)
         self._padding = len(data) - self._size
 
         # in case the LSB of the first byte after v-comment is 1, preserve the
         # following data
-        padding_flag = fileobj.read(1)
+        padding_flag = data[self._size:self._size + 1]
         if padding_flag and ord(padding_flag) & 0x1:
-            self._pad_data = padding_flag + fileobj.read()
+            self._pad_data = data[self._size:]
             self._padding = 0  # we have to preserve, so no padding
         else:
             self._pad_data = b""
@@ -128,12 +126,13 @@ class OggOpusVComment(VCommentDict):
         else:
             content_size = get_size(fileobj) - len(packets[0])  # approx
             padding_left = len(packets[0]) - len(vcomment_data)
-            info = PaddingInfo(padding_left, content_size)
+            info = OggPaddingInfo(padding_left, content_size,
+                                  len(vcomment_data), packets, old_pages)
             new_padding = info._get_padding(padding_func)
             packets[0] = vcomment_data + b"\x00" * new_padding
 
-        new_pages = OggPage._from_packets_try_preserve(packets, old_pages)
-        OggPage.replace(fileobj, old_pages, new_pages)
+        new_pages = OggPage._from_packets_keep_pages(packets, old_pages)
+        return OggPage.replace(fileobj, old_pages, new_pages)
 
 
 class OggOpus(OggFileType):
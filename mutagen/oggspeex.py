@@ -21,9 +21,9 @@ __all__ = ["OggSpeex", "Open", "delete"]
 
 from mutagen import StreamInfo
 from mutagen._vorbis import VCommentDict
-from mutagen.ogg import OggPage, OggFileType, error as OggError
+from mutagen.ogg import OggPage, OggFileType, OggPaddingInfo, \
+    error as OggError
 from mutagen._util import cdata, get_size, loadfile, convert_error
-from mutagen._tags import PaddingInfo
 
 
 class error(OggError):
@@ -119,14 +119,15 @@ class OggSpeexVComment(VCommentDict):
         vcomment_data = self.write(framing=False)
         padding_left = len(packets[0]) - len(vcomment_data)
 
-        info = PaddingInfo(padding_left, content_size)
+        info = OggPaddingInfo(padding_left, content_size,
+                              len(vcomment_data), packets, old_pages)
         new_padding = info._get_padding(padding_func)
 
         # Set the new comment packet.
         packets[0] = vcomment_data + b"\x00" * new_padding
 
-        new_pages = OggPage._from_packets_try_preserve(packets, old_pages)
-        OggPage.replace(fileobj, old_pages, new_pages)
+        new_pages = OggPage._from_packets_keep_pages(packets, old_pages)
+        return OggPage.replace(fileobj, old_pages, new_pages)
 
 
 class OggSpeex(OggFileType):
@@ -4,13 +4,177 @@
 Functions for interfacing Acoustid and Musicbrainz online databases, and helper
 functions dealing with data returned from these services
 """
-import logging, subprocess, os
+import logging, subprocess, os, time, threading, itertools, json, gzip, io, socket
 from operator import itemgetter
 
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 import acoustid
 from acoustid import *
 import musicbrainzngs
 
+import http_transport
+
+try:
+    import fingerprint_index
+except ImportError:
+    # NumPy is missing
+    fingerprint_index = None
+
+try:
+    import acoustid_mirror
+except ImportError:
+    # NumPy is missing
+    acoustid_mirror = None
+
+
+# Default request rates and burst sizes, following the usage policies of the
+# web services
+DEFAULT_RATE_LIMITS = {
+    'acoustid_web_service': (3.0, 3),
+    'musicbrainz_web_service': (1.0, 1)
+}
+
+# Maps a config section name of a web service to its `RateLimiter`
+RATE_LIMITERS = dict()
+
+# `http_transport.HTTPTransport` used for the requests of both web services,
+# see `set_up_http_transport()`
+HTTP_TRANSPORT = None
+
+# Maps absolute path of an audio file to <int: duration>, <str: fingerprint>
+# as calculated by fpcalc (None, None if that failed), e.g. for recording the
+# fingerprint in the catalog
+FINGERPRINTS = dict()
+
+# Settings of fpcalc runs, see `set_up_fpcalc()`: the command, the seconds of
+# audio analysed, the number of fpcalc processes run at a time for a batch of
+# files, the number of files passed to one fpcalc process at most (keeping
+# its command line short), and the seconds after which fpcalc is killed if it
+# produces no result for a file or doesn't complete a batch
+DEFAULT_FPCALC_CONFIG = {
+    'command': 'fpcalc',
+    'length': 120,
+    'processes': 2,
+    'max_files_per_run': 50,
+    'file_timeout': 60,
+    'batch_timeout': 600
+}
+FPCALC_CONFIG = dict( DEFAULT_FPCALC_CONFIG )
+
+# Maps absolute path of an audio file to the match found for it by
+# `resolve_fingerprints_in_bulk()`, until it is used. Files without a match
+# map to None, None, None, None, so they aren't looked up again.
+RESOLVED_MATCHES = dict()
+
+# Number of fingerprints sent in one Acoustid lookup request by default
+DEFAULT_LOOKUP_BATCH_SIZE = 20
+
+# `fingerprint_index.FingerprintIndex` of previously fingerprinted files, its
+# config section and the lock serializing its use by several threads
+FINGERPRINT_INDEX = None
+FINGERPRINT_INDEX_CONFIG = dict()
+FINGERPRINT_INDEX_LOCK = threading.Lock()
+
+# Defaults for resolving whole albums at once, see `get_release_tracklist()`
+DEFAULT_RELEASE_SEARCH_SCORE = 90
+DEFAULT_TRACK_LENGTH_TOLERANCE = 3.0
+
+# Discographies of the artists whose albums are being processed, see
+# `prefetch_artist_discography()`: maps the discography key (e.g. the path of
+# the artist directory, by default the lower case artist name) to a dict
+# mapping 'releases' to Musicbrainz releases with their tracklists and
+# 'recording_releases' to a dict mapping recording ID to release titles.
+# Discographies are only added once complete.
+ARTIST_DISCOGRAPHY = dict()
+
+# At most this many releases are kept for an artist by default
+DEFAULT_DISCOGRAPHY_MAX_RELEASES = 500
+# Maximum page size of Musicbrainz browse requests
+_BROWSE_PAGE_SIZE = 100
+
+# `acoustid_mirror.AcoustidMirror` tried before the Acoustid web service, and
+# its config section
+ACOUSTID_MIRROR = None
+ACOUSTID_MIRROR_CONFIG = dict()
+
+
+class RateLimiter(object):
+    """
+    Token bucket limiting the requests sent to a web service, shared by all
+    processes using the same `state_path`.
+    The bucket is stored as the time at which it will be full again
+    (theoretical arrival time), along with the time it was written. Each call
+    of `wait()` reserves the next free slot while holding an exclusive lock on `state_path` and then sleeps
+    outside of the lock until that slot, so workers are served in the order
+    they asked and none of them can starve the others.
+    Without fcntl (e.g. Windows), requests are only limited per process.
+    """
+
+    def __init__( self, state_path, requests_per_second, burst=1 ):
+        self.state_path = state_path
+        self.interval = 1.0 / requests_per_second
+        self.tolerance = (max(int(burst), 1) - 1) * self.interval
+        self._lock = threading.Lock()
+        self._local_tat = 0.0
+
+    def _reserve( self, stored_tat, now ):
+        """
+        Returns <float: time the request may be sent>, <float: new
+        theoretical arrival time>
+        """
+        tat = max( stored_tat, now )
+        send_at = max( now, tat - self.tolerance )
+        return send_at, tat + self.interval
+
+    def _reserve_shared( self, now ):
+        fd = os.open( self.state_path, os.O_RDWR | os.O_CREAT, 0o666 )
+        try:
+            fcntl.flock( fd, fcntl.LOCK_EX )
+            try:
+                stored_tat, written_at = map( float, os.read( fd, 64 ).split() )
+            except ValueError:
+                # Empty or corrupt
+                stored_tat, written_at = 0.0, now
+            # Ignore state written in the future, i.e. before the clock was
+            # set back, and values that aren't finite
+            if not (written_at <= now + 1.0 and stored_tat < float( 'inf' )):
+                stored_tat = now
+            send_at, tat = self._reserve( stored_tat, now )
+            data = ('%r %r' % (tat, now)).encode( 'ascii' )
+            os.lseek( fd, 0, os.SEEK_SET )
+            os.write( fd, data )
+            os.ftruncate( fd, len(data) )
+            return send_at
+        finally:
+            os.close( fd )
+
+    def wait( self ):
+        """
+        Blocks until one more request may be sent
+        """
+        with self._lock:
+            now = time.time()
+            send_at = None
+            if fcntl is not None:
+                try:
+                    send_at = self._reserve_shared( now )
+                except (IOError, OSError):
+                    pass
+            if send_at is None:
+                send_at, self._local_tat = self._reserve( self._local_tat, now )
+        delay = send_at - time.time()
+        if delay > 0:
+            time.sleep( delay )
+
 
 def set_up_musicbrainzngs( user_agent_app, user_agent_version ):
     """
@@ -20,37 +184,435 @@ def set_up_musicbrainzngs( user_agent_app, user_agent_version ):
     musicbrainzngs.set_rate_limit( limit_or_interval=1.0, new_requests=1 )
 
 
+def set_up_rate_limiting( CONFIG_DATA ):
+    """
+    Sets up the `RateLimiter` for each web service from `CONFIG_DATA`, each
+    service's section may contain 'requests_per_second' and 'burst'. Call
+    this after `set_up_musicbrainzngs()`, as it replaces musicbrainzngs' own
+    per process rate limit.
+    """
+    state_directory = CONFIG_DATA.get( 'rate_limit_directory', '/tmp/' )
+    for service, (requests_per_second, burst) in DEFAULT_RATE_LIMITS.items():
+        service_config = CONFIG_DATA.get( service, dict() )
+        RATE_LIMITERS[service] = RateLimiter(
+            os.path.join( state_directory, 'mp3_tag_fixer_%s.ratelimit' % service ),
+            float( service_config.get( 'requests_per_second', requests_per_second ) ),
+            service_config.get( 'burst', burst ) )
+    musicbrainzngs.set_rate_limit( limit_or_interval=False )
+
+
+def get_web_service_concurrency( CONFIG_DATA ):
+    """
+    Returns the number of requests the web services may get at the same time
+    according to their configured 'burst' (see `set_up_rate_limiting()`).
+    Workers beyond that would only wait for their `RateLimiter`.
+    """
+    return max( [1] + [ int( CONFIG_DATA.get( service, dict() ).get( 'burst', burst ) )
+                        for service, (requests_per_second, burst) in DEFAULT_RATE_LIMITS.items() ] )
+
+
+def set_up_http_transport( CONFIG_DATA, log, transport=None ):
+    """
+    Sends the requests of both web services through `transport`, by default a
+    new `http_transport.HTTPTransport` configured by the 'http_transport'
+    section of `CONFIG_DATA`, keeping connections alive between requests.
+    Request timings are logged at debug level.
+    """
+    global HTTP_TRANSPORT
+    if transport is None:
+        transport_config = CONFIG_DATA.get( 'http_transport', dict() )
+        transport = http_transport.HTTPTransport(
+            max_connections=transport_config.get(
+                'max_connections', http_transport.DEFAULT_MAX_CONNECTIONS ),
+            max_connections_per_host=transport_config.get(
+                'max_connections_per_host', http_transport.DEFAULT_MAX_CONNECTIONS_PER_HOST ),
+            timeout=transport_config.get( 'timeout', http_transport.DEFAULT_TIMEOUT ) )
+    def log_timing( method, url, status, elapsed, reused ):
+        log.debug('%s %s: %s in %.3fs%s' % (method, url, status, elapsed, ' (reused connection)' if reused else ''))
+    transport.hooks.append( log_timing )
+    HTTP_TRANSPORT = transport
+    if hasattr( musicbrainzngs, 'musicbrainz' ) \
+    and hasattr( musicbrainzngs.musicbrainz, '_safe_read' ):
+        musicbrainzngs.musicbrainz._safe_read = _musicbrainz_safe_read
+    else:
+        log.warning('Unknown musicbrainzngs version, its requests are not pooled')
+
+
+def close_http_transport():
+    """
+    Closes the idle connections of `HTTP_TRANSPORT` and lets musicbrainzngs
+    send its requests itself again
+    """
+    global HTTP_TRANSPORT
+    if HTTP_TRANSPORT is not None:
+        HTTP_TRANSPORT.close()
+        HTTP_TRANSPORT = None
+    if getattr( getattr( musicbrainzngs, 'musicbrainz', None ), '_safe_read', None ) is _musicbrainz_safe_read:
+        musicbrainzngs.musicbrainz._safe_read = _original_musicbrainz_safe_read
+
+
+def _musicbrainz_safe_read( opener, req, body=None, max_retries=8, retry_delay_delta=2.0 ):
+    """
+    Replaces `musicbrainzngs.musicbrainz._safe_read()`, sending musicbrainzngs'
+    request `req` through `HTTP_TRANSPORT` instead of `opener` with the same
+    retries and exceptions. Returns the response body.
+    Only installed by `set_up_http_transport()` if musicbrainzngs has that
+    private function, falls back to it without `HTTP_TRANSPORT`.
+    """
+    if HTTP_TRANSPORT is None:
+        return _original_musicbrainz_safe_read( opener, req, body, max_retries, retry_delay_delta )
+    if body is None:
+        body = req.data if hasattr( req, 'data' ) else req.get_data()
+    last_exc = None
+    for retry_num in range( max_retries ):
+        if retry_num:
+            time.sleep( retry_num * retry_delay_delta )
+        try:
+            response = HTTP_TRANSPORT.request(  req.get_method(),
+                                                req.get_full_url(),
+                                                body,
+                                                dict( req.header_items() ) )
+        except socket.timeout as exc:
+            last_exc = exc
+            continue
+        except http_transport.httplib.HTTPException as exc:
+            last_exc = exc
+            continue
+        except socket.error as exc:
+            if exc.errno == 104:
+                # Connection reset by peer
+                last_exc = exc
+                continue
+            raise musicbrainzngs.NetworkError( cause=exc )
+        if response.status < 300:
+            return response.body
+        last_exc = http_transport.HTTPError( response )
+        if response.status in (400, 404, 411):
+            raise musicbrainzngs.ResponseError( cause=last_exc )
+        elif response.status == 401:
+            raise musicbrainzngs.AuthenticationError( cause=last_exc )
+    raise musicbrainzngs.NetworkError( 'retried %i times' % max_retries, last_exc )
+
+
+try:
+    _original_musicbrainz_safe_read = musicbrainzngs.musicbrainz._safe_read
+except AttributeError:
+    _original_musicbrainz_safe_read = None
+
+
+def _post_acoustid_lookup( params ):
+    """
+    Sends an Acoustid lookup request with the form parameters `params` and
+    returns the parsed response, through `HTTP_TRANSPORT` if it is set up.
+    Raises `acoustid.WebServiceError` on failure.
+    """
+    if HTTP_TRANSPORT is None:
+        return acoustid._api_request( acoustid._get_lookup_url(), params )
+    compressed = io.BytesIO()
+    with gzip.GzipFile( fileobj=compressed, mode='wb' ) as gzip_file:
+        gzip_file.write( urlencode( params ).encode( 'ascii' ) )
+    url = getattr( acoustid, 'API_BASE_URL', 'https://api.acoustid.org/v2/' ) + 'lookup'
+    try:
+        response = HTTP_TRANSPORT.request(  'POST',
+                                            url,
+                                            compressed.getvalue(),
+                                            {'Content-Encoding': 'gzip',
+                                             'Content-Type': 'application/x-www-form-urlencoded'} )
+    except (socket.error, http_transport.httplib.HTTPException) as exc:
+        raise WebServiceError( 'HTTP request failed: %s' % exc )
+    try:
+        return json.loads( response.body.decode( 'utf-8' ) )
+    except ValueError:
+        raise WebServiceError( 'response is not valid JSON' )
+
+
+def _get_acoustid_meta():
+    meta = getattr( acoustid, 'DEFAULT_META', 'recordings' )
+    if isinstance( meta, list ):
+        meta = ' '.join( meta )
+    return meta
+
+
+def _acoustid_lookup_batch( api_key, items ):
+    """
+    Looks up all <int: duration>, <str: fingerprint> of `items` with a single
+    Acoustid request and returns a response like `acoustid.lookup()` for each
+    of them, in the same order.
+    Raises `acoustid.WebServiceError` on failure.
+    """
+    params = {
+        'format': 'json',
+        'client': api_key,
+        'meta': _get_acoustid_meta()
+    }
+    for i, (duration, fingerprint) in enumerate( items ):
+        params['duration.%d' % i] = int( duration )
+        params['fingerprint.%d' % i] = fingerprint
+    response = _post_acoustid_lookup( params )
+    if response.get( 'status' ) != 'ok' or 'fingerprints' not in response:
+        raise WebServiceError( 'lookup failed: %s' % str( response.get( 'error', response ) ) )
+    responses = [{'status': 'ok', 'results': list()} for item in items]
+    for result in response['fingerprints']:
+        responses[int( result['index'] )]['results'] = result.get( 'results', list() )
+    return responses
+
+
+def _acoustid_lookup( api_key, fingerprint, duration ):
+    """
+    Same as `acoustid.lookup()`, but sent through `HTTP_TRANSPORT` if it is
+    set up. Raises `acoustid.WebServiceError` on failure.
+    """
+    if HTTP_TRANSPORT is None:
+        return lookup( api_key, fingerprint, duration )
+    return _post_acoustid_lookup( {
+        'format': 'json',
+        'client': api_key,
+        'duration': int( duration ),
+        'fingerprint': fingerprint,
+        'meta': _get_acoustid_meta()
+    } )
+
+
+def set_up_fpcalc( CONFIG_DATA ):
+    """
+    Applies the 'fpcalc' section of `CONFIG_DATA` to `FPCALC_CONFIG`
+    """
+    FPCALC_CONFIG.update( CONFIG_DATA.get( 'fpcalc', dict() ) )
+
+
+def set_up_fingerprint_index( CONFIG_DATA, log ):
+    """
+    Opens the local fingerprint index configured in the 'fingerprint_index'
+    section of `CONFIG_DATA`, if NumPy is available
+    """
+    global FINGERPRINT_INDEX, FINGERPRINT_INDEX_CONFIG
+    if fingerprint_index is None:
+        log.warning('NumPy is not available, local fingerprint index disabled')
+        return
+    FINGERPRINT_INDEX_CONFIG = CONFIG_DATA.get( 'fingerprint_index', dict() )
+    FINGERPRINT_INDEX = fingerprint_index.FingerprintIndex(
+        FINGERPRINT_INDEX_CONFIG.get( 'path', 'mp3_tag_fixer_fingerprints.sqlite' ) )
+
+
+def close_fingerprint_index():
+    global FINGERPRINT_INDEX
+    if FINGERPRINT_INDEX is not None:
+        FINGERPRINT_INDEX.close()
+        FINGERPRINT_INDEX = None
+
+
+def set_up_acoustid_mirror( CONFIG_DATA, log ):
+    """
+    Opens the local Acoustid mirror configured in the 'acoustid_mirror' section
+    of `CONFIG_DATA`, if it was built and NumPy is available
+    """
+    global ACOUSTID_MIRROR, ACOUSTID_MIRROR_CONFIG
+    if acoustid_mirror is None:
+        log.warning('NumPy is not available, local Acoustid mirror disabled')
+        return
+    ACOUSTID_MIRROR_CONFIG = CONFIG_DATA.get( 'acoustid_mirror', dict() )
+    path = ACOUSTID_MIRROR_CONFIG.get( 'path', 'mp3_tag_fixer_acoustid_mirror.bin' )
+    if not os.path.exists( path ):
+        log.debug('No local Acoustid mirror at "%s"' % path)
+        return
+    try:
+        ACOUSTID_MIRROR = acoustid_mirror.AcoustidMirror( path )
+    except (IOError, OSError, ValueError) as e:
+        log.warning('Failed to open local Acoustid mirror "%s": %s: %s' % (path, type(e), str(e)))
+
+
+def close_acoustid_mirror():
+    global ACOUSTID_MIRROR
+    if ACOUSTID_MIRROR is not None:
+        ACOUSTID_MIRROR.close()
+        ACOUSTID_MIRROR = None
+
+
+def build_acoustid_mirror( CONFIG_DATA, dump_paths, log ):
+    """
+    (Re)builds the local Acoustid mirror configured in the 'acoustid_mirror'
+    section of `CONFIG_DATA` from the matches in the local fingerprint index
+    (if set up) and the dump files at `dump_paths` (see
+    `acoustid_mirror.records_from_dump()`)
+    """
+    if acoustid_mirror is None:
+        log.error('NumPy is not available, can not build local Acoustid mirror')
+        return
+    path = CONFIG_DATA.get( 'acoustid_mirror', dict() ).get(
+        'path', 'mp3_tag_fixer_acoustid_mirror.bin' )
+    sources = list()
+    if FINGERPRINT_INDEX is not None:
+        sources.append( acoustid_mirror.records_from_fingerprint_index( FINGERPRINT_INDEX ) )
+    for dump_path in dump_paths:
+        sources.append( acoustid_mirror.records_from_dump( dump_path ) )
+    num_records = acoustid_mirror.build_mirror( path, itertools.chain( *sources ) )
+    log.info('Built local Acoustid mirror "%s" with %d record(s)' % (path, num_records))
+
+
+def _wait_for_web_service( service ):
+    """
+    Blocks until a request may be sent to `service` (a config section name),
+    if rate limiting was set up
+    """
+    rate_limiter = RATE_LIMITERS.get( service )
+    if rate_limiter is not None:
+        rate_limiter.wait()
+
+
+def _run_fpcalc( paths ):
+    """
+    Runs a single fpcalc process for the files at `paths`, reading its JSON
+    output as it is produced. fpcalc is killed if it doesn't produce anything
+    for 'file_timeout' seconds or doesn't complete in 'batch_timeout' seconds.
+    Returns <list: <int: duration>, <str: fingerprint> in the order printed>,
+    <int: number of errors reported>, <bool: fpcalc was killed>.
+    Raises OSError if fpcalc can't be run.
+    """
+    command = [ FPCALC_CONFIG['command'], '-json',
+                '-length', str( int( FPCALC_CONFIG['length'] ) ) ] + list( paths )
+    process = subprocess.Popen( command, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+    progress = {'time': time.time(), 'errors': 0, 'timed_out': False}
+    finished = threading.Event()
+
+    def read_stderr():
+        # fpcalc also complains here about e.g. missing mp3 headers, while
+        # still fingerprinting the file
+        for line in iter( process.stderr.readline, b'' ):
+            progress['time'] = time.time()
+            if line.startswith( b'ERROR' ):
+                progress['errors'] += 1
+
+    def watch():
+        start = time.time()
+        while not finished.wait( 0.1 ):
+            now = time.time()
+            if now - progress['time'] > FPCALC_CONFIG['file_timeout'] \
+            or now - start > FPCALC_CONFIG['batch_timeout']:
+                progress['timed_out'] = True
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+                return
+
+    threads = [ threading.Thread( target=read_stderr ), threading.Thread( target=watch ) ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    results = list()
+    for line in iter( process.stdout.readline, b'' ):
+        progress['time'] = time.time()
+        try:
+            data = json.loads( line.decode( 'utf-8' ) )
+            results.append( (int( data['duration'] ), data['fingerprint']) )
+        except (ValueError, KeyError, TypeError):
+            continue
+    process.wait()
+    finished.set()
+    for thread in threads:
+        thread.join()
+    return results, progress['errors'], progress['timed_out']
+
+
+def _fingerprint_batch( paths, log ):
+    """
+    Fingerprints the files at `paths` with as few fpcalc runs as possible and
+    stores the results in `FINGERPRINTS`.
+    fpcalc prints one result per successfully fingerprinted file, without its
+    path, so results are mapped back to files by their order. When some files
+    failed, the batch is split in halves until the failing ones are found.
+    """
+    pending = list( paths )
+    while pending:
+        try:
+            results, errors, timed_out = _run_fpcalc( pending )
+        except OSError as e:
+            log.warning('Failed to run fpcalc: %s: %s' % (type(e), str(e)))
+            FINGERPRINTS.update( (path, (None, None)) for path in pending )
+            return
+        if len(results) == len(pending):
+            FINGERPRINTS.update( zip( pending, results ) )
+            return
+        if timed_out:
+            # fpcalc got stuck on the file after the last result and the
+            # files it failed on, which is marked as failed right away so it
+            # isn't run again. With errors, the results can't be mapped to
+            # the files before it, so these are run again without it.
+            hung = min( len(results) + errors, len(pending) - 1 )
+            log.warning('%s: fpcalc timed out' % pending[hung])
+            FINGERPRINTS[pending[hung]] = (None, None)
+            if errors == 0:
+                FINGERPRINTS.update( zip( pending, results ) )
+            elif hung > 0:
+                _fingerprint_batch( pending[:hung], log )
+            pending = pending[hung + 1:]
+        elif len(pending) == 1:
+            log.warning('%s: fpcalc failed to fingerprint file' % pending[0])
+            FINGERPRINTS[pending[0]] = (None, None)
+            return
+        else:
+            half = len(pending) // 2
+            _fingerprint_batch( pending[:half], log )
+            pending = pending[half:]
+
+
+def fingerprint_audio_files( paths, log ):
+    """
+    Fingerprints all files at `paths` (e.g. all files of an album which need
+    a fingerprint) not fingerprinted yet, split between up to the configured
+    number of fpcalc processes instead of running fpcalc for each of them.
+    Each process gets at most 'max_files_per_run' files, further batches are
+    run once a process is done.
+    Results are stored in `FINGERPRINTS`.
+    """
+    paths = [path for path in paths if path not in FINGERPRINTS]
+    num_processes = max( 1, min( int( FPCALC_CONFIG['processes'] ), len(paths) ) )
+    batch_size = max( 1, min( int( FPCALC_CONFIG['max_files_per_run'] ),
+                              -( -len(paths) // num_processes ) ) )
+    batches = [paths[start:start + batch_size] for start in range( 0, len(paths), batch_size )]
+    batches_lock = threading.Lock()
+
+    def run_batches():
+        while True:
+            with batches_lock:
+                if len(batches) == 0:
+                    return
+                batch = batches.pop( 0 )
+            _fingerprint_batch( batch, log )
+
+    threads = list()
+    for i in range( 1, num_processes ):
+        thread = threading.Thread( target=run_batches )
+        thread.start()
+        threads.append( thread )
+    run_batches()
+    for thread in threads:
+        thread.join()
+
+
 def _get_duration_and_fingerprint_from_audio_file(  absolute_path_to_mp3_file,
                                                     log,
                                                     DEVNULL ):
     """
     Given an absolute path to an mp3 file (other file types not tested), this 
     function returns <int: song duration in seconds>, <str: audio fingerprint
-    value> on success, or None, None on failure
+    value> on success, or None, None on failure. Files already fingerprinted
+    by `fingerprint_audio_files()` aren't fingerprinted again.
     """
-    duration = None
-    fingerprint = None
-    try:
-        # Send stderr to /dev/null because fpcalc will complain, for example,
-        #   a mp3 header is missing, but still successfully generate fingerprint
-        string_output = subprocess.check_output(
-            ['fpcalc', absolute_path_to_mp3_file],
-            stderr=DEVNULL )
-        temp = string_output.split('DURATION=')[1].split('\nFINGERPRINT=')
-        duration = int( temp[0] )
-        fingerprint = temp[1][:-1]
-    except Exception as e:
-        log.warning('%s: %s: %s' % (absolute_path_to_mp3_file, type(e), str(e)))
-        return None, None
-    return duration, fingerprint
+    if absolute_path_to_mp3_file not in FINGERPRINTS:
+        fingerprint_audio_files( [absolute_path_to_mp3_file], log )
+    return FINGERPRINTS[absolute_path_to_mp3_file]
 
 
 def _return_acoustid_response(  api_key, 
                                 absolute_path_to_mp3_file,
                                 log,
-                                DEVNULL ):
+                                DEVNULL,
+                                offline=False ):
     """
-    Returns None on failure, else a dict containing data from Acoustid web service
+    Returns None on failure, else a dict containing data from the local
+    Acoustid mirror or, if it has no results and not `offline`, from Acoustid
+    web service
     """ 
     file_duration, fingerprint = \
         _get_duration_and_fingerprint_from_audio_file(  absolute_path_to_mp3_file,
@@ -58,20 +620,91 @@ def _return_acoustid_response(  api_key,
                                                         DEVNULL )
     if file_duration is None or fingerprint is None:
         return None
+    if ACOUSTID_MIRROR is not None:
+        try:
+            response = ACOUSTID_MIRROR.lookup(
+                fingerprint,
+                file_duration,
+                ACOUSTID_MIRROR_CONFIG.get( 'max_bit_error_rate', 0.1 ) )
+        except ValueError as e:
+            log.warning('%s: %s: %s' % (absolute_path_to_mp3_file, type(e), str(e)))
+        else:
+            if response['results']:
+                log.debug('%s: found in local Acoustid mirror' % absolute_path_to_mp3_file)
+                return response
     response = None
+    if offline:
+        return response
     try:        
-        response = lookup( api_key, fingerprint, file_duration )
+        _wait_for_web_service( 'acoustid_web_service' )
+        response = _acoustid_lookup( api_key, fingerprint, file_duration )
     except WebServiceError as wse:
         log.warning('WebServiceError thrown for %s, API key is %s: %s' % ( absolute_path_to_mp3_file, api_key, wse.message ) )        
     return response
 
 
+def _find_match_in_fingerprint_index(   absolute_path_to_mp3_file,
+                                        log,
+                                        DEVNULL ):
+    """
+    Returns the match (see `get_title_and_artist_from_audio_fingerprint()`)
+    previously found for the same audio according to the local fingerprint
+    index, or None. Logs other indexed files which seem to have the same audio.
+    """
+    if FINGERPRINT_INDEX is None:
+        return None
+    file_duration, fingerprint = \
+        _get_duration_and_fingerprint_from_audio_file(  absolute_path_to_mp3_file,
+                                                        log,
+                                                        DEVNULL )
+    if fingerprint is None:
+        return None
+    try:
+        with FINGERPRINT_INDEX_LOCK:
+            duplicates = FINGERPRINT_INDEX.find_duplicates(
+                absolute_path_to_mp3_file,
+                fingerprint,
+                FINGERPRINT_INDEX_CONFIG.get( 'duplicate_bit_error_rate', 0.15 ) )
+            match = FINGERPRINT_INDEX.find_match(
+                fingerprint,
+                FINGERPRINT_INDEX_CONFIG.get( 'match_bit_error_rate', 0.05 ) )
+        for path in duplicates:
+            log.info('"%s" seems to have the same audio as "%s"' % (absolute_path_to_mp3_file, path))
+    except Exception as e:
+        log.warning('%s: %s: %s' % (absolute_path_to_mp3_file, type(e), str(e)))
+        return None
+    if match is not None:
+        log.debug('%s: reusing match from local fingerprint index: %s' % (absolute_path_to_mp3_file, str(match)))
+    return match
+
+
+def _add_to_fingerprint_index( absolute_path_to_mp3_file, match, log ):
+    """
+    Adds the file's fingerprint, if calculated, to the local fingerprint index
+    along with `match` if it is complete
+    """
+    if FINGERPRINT_INDEX is None or absolute_path_to_mp3_file not in FINGERPRINTS:
+        return
+    file_duration, fingerprint = FINGERPRINTS[absolute_path_to_mp3_file]
+    if fingerprint is None:
+        return
+    try:
+        with FINGERPRINT_INDEX_LOCK:
+            FINGERPRINT_INDEX.add(  absolute_path_to_mp3_file,
+                                    file_duration,
+                                    fingerprint,
+                                    None if None in match else match )
+    except Exception as e:
+        log.warning('%s: %s: %s' % (absolute_path_to_mp3_file, type(e), str(e)))
+
+
 def get_title_and_artist_from_audio_fingerprint(    absolute_path_to_mp3_file,
                                                     likely_artist,
                                                     likely_album,
                                                     CONFIG_DATA,
                                                     log,
-                                                    DEVNULL ):
+                                                    DEVNULL,
+                                                    offline=False ):
     """
     Queries Acoustid online database with an internally generated audio 
     fingerprint. This function is quite slow.
@@ -84,12 +717,78 @@ def get_title_and_artist_from_audio_fingerprint(    absolute_path_to_mp3_file,
     <str: track ID value (Musicbrainz) from online DB>,
     <str: artist name value from online DB>,
     <str: artist ID value (Musicbrainz) from online DB>
+    If a match was found by `resolve_fingerprints_in_bulk()`, or the local
+    fingerprint index knows one for the same audio, it is returned without
+    querying Acoustid. If `offline`, only local data is used.
     """
+    match = RESOLVED_MATCHES.pop( absolute_path_to_mp3_file, None )
+    if match is not None:
+        return match
+    match = _find_match_in_fingerprint_index(   absolute_path_to_mp3_file,
+                                                log,
+                                                DEVNULL )
+    if match is not None:
+        return match
     api_key = CONFIG_DATA['acoustid_web_service']['api_key']
     response = _return_acoustid_response(   api_key, 
                                             absolute_path_to_mp3_file,
                                             log,
-                                            DEVNULL )
+                                            DEVNULL,
+                                            offline )
+    match = _get_title_and_artist_from_acoustid_response(   response,
+                                                            likely_artist,
+                                                            CONFIG_DATA )
+    _add_to_fingerprint_index( absolute_path_to_mp3_file, match, log )
+    return match
+
+
+def resolve_fingerprints_in_bulk(   likely_artists,
+                                    CONFIG_DATA,
+                                    log ):
+    """
+    Looks up the files which are keys of `likely_artists` (mapping their
+    absolute path to the artist they probably belong to) with as few Acoustid
+    requests as possible, sending up to the configured 'lookup_batch_size'
+    fingerprints in each. Files are fingerprinted first if needed. Matches
+    are kept in `RESOLVED_MATCHES` and the local fingerprint index, for
+    `get_title_and_artist_from_audio_fingerprint()`, and so are misses (also
+    for files which couldn't be fingerprinted), which are final.
+    Returns False if a request failed, else True.
+    """
+    acoustid_config = CONFIG_DATA['acoustid_web_service']
+    batch_size = acoustid_config.get( 'lookup_batch_size', DEFAULT_LOOKUP_BATCH_SIZE )
+    fingerprint_audio_files( list( likely_artists.keys() ), log )
+    paths = list()
+    for path in sorted( likely_artists ):
+        if FINGERPRINTS[path][1] is not None:
+            paths.append( path )
+        else:
+            RESOLVED_MATCHES[path] = (None, None, None, None)
+    for start in range( 0, len(paths), batch_size ):
+        batch = paths[start:start + batch_size]
+        try:
+            _wait_for_web_service( 'acoustid_web_service' )
+            responses = _acoustid_lookup_batch( acoustid_config['api_key'],
+                                                [FINGERPRINTS[path] for path in batch] )
+        except WebServiceError as wse:
+            log.warning('WebServiceError thrown for bulk lookup: %s' % wse.message)
+            return False
+        for path, response in zip( batch, responses ):
+            match = _get_title_and_artist_from_acoustid_response(   response,
+                                                                    likely_artists[path],
+                                                                    CONFIG_DATA )
+            _add_to_fingerprint_index( path, match, log )
+            RESOLVED_MATCHES[path] = match
+    return True
+
+
+def _get_title_and_artist_from_acoustid_response(   response,
+                                                    likely_artist,
+                                                    CONFIG_DATA ):
+    """
+    Picks the track and artist matching `likely_artist` from the Acoustid
+    `response`, see `get_title_and_artist_from_audio_fingerprint()`
+    """
     if response is None or response['status'] != 'ok' or len( response['results'] ) == 0:
         return None, None, None, None
     highest_scoring_result = sorted(    response['results'], 
@@ -117,9 +816,15 @@ def get_album_name( recording_id,
     """
     `recording_id` should be a Musicbrainz ID value for a recording (track) as
     a string. Returns None on failure, else returns the recording's album's 
-    name as it is most commonly known in the Musicbrainz DB as a string
+    name as it is most commonly known in the Musicbrainz DB as a string.
+    The cached `ARTIST_DISCOGRAPHY` is consulted before the web service.
     """
+    for discography in list( ARTIST_DISCOGRAPHY.values() ):
+        release_titles = discography['recording_releases'].get( recording_id )
+        if release_titles:
+            return max( set( release_titles ), key=release_titles.count )
     try:
+        _wait_for_web_service( 'musicbrainz_web_service' )
         result = musicbrainzngs.get_recording_by_id( recording_id, includes=['releases'] )
     except Exception as exc:
         log.warning("get_album_name(): web service call failed: %s" % exc)
@@ -138,4 +843,271 @@ def get_album_name( recording_id,
     except Exception as e:
         log.warning("get_album_name(): result parsing failed: %s: %s\nresult was %s" % ( type(e), e, str(result) ))
         return None
-    return most_common_album_name
\ No newline at end of file
+    return most_common_album_name
+
+
+def _get_artist_from_artist_credit( artist_credit ):
+    """
+    Returns <str: name>, <str: ID> of the first artist in a Musicbrainz
+    'artist-credit' list, or None, None
+    """
+    for credit in artist_credit or list():
+        if isinstance( credit, dict ) and 'artist' in credit:
+            return credit['artist'].get( 'name' ), credit['artist'].get( 'id' )
+    return None, None
+
+
+def _get_length_in_seconds( length ):
+    """
+    Converts a Musicbrainz length in milliseconds (string or int) to seconds,
+    None if unknown
+    """
+    try:
+        return int( length ) / 1000.0
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_release_track_count( release ):
+    try:
+        return int( release['medium-track-count'] )
+    except (KeyError, TypeError, ValueError):
+        return sum( int( medium.get( 'track-count', 0 ) )
+                    for medium in release.get( 'medium-list', list() ) )
+
+
+def _get_tracklist_from_release( release ):
+    """
+    Returns the tracklist (see `get_release_tracklist()`) of a Musicbrainz
+    release including its recordings and artist credits
+    """
+    tracklist = list()
+    release_artist = _get_artist_from_artist_credit( release.get( 'artist-credit' ) )
+    for medium in release['medium-list']:
+        for track in medium['track-list']:
+            recording = track['recording']
+            artist = _get_artist_from_artist_credit(
+                track.get( 'artist-credit' ) or recording.get( 'artist-credit' ) )
+            if None in artist:
+                artist = release_artist
+            tracklist.append( {
+                'position': len(tracklist) + 1,
+                'title': track.get( 'title' ) or recording['title'],
+                'length': _get_length_in_seconds( track.get( 'length' ) or recording.get( 'length' ) ),
+                'recording_id': recording['id'],
+                'artist_name': artist[0],
+                'artist_id': artist[1]
+            } )
+    return tracklist
+
+
+def _get_discography_key( artist_name, discography_key ):
+    return artist_name.lower() if discography_key is None else discography_key
+
+
+def prefetch_artist_discography( artist_name,
+                                 CONFIG_DATA,
+                                 log,
+                                 discography_key=None ):
+    """
+    Adds the discography of `artist_name` to `ARTIST_DISCOGRAPHY`, under
+    `discography_key` (see `get_release_tracklist()`): the
+    artist's Musicbrainz ID is searched once, then its releases along with
+    their recordings are browsed in pages of up to `_BROWSE_PAGE_SIZE`, at most
+    the configured 'discography_max_releases' of them. Album and recording
+    lookups for the artist consult it before sending their own requests.
+    On failure, the artist is cached with no releases, so the failing requests
+    aren't repeated for each of its albums.
+    """
+    releases = _browse_artist_releases( artist_name, CONFIG_DATA, log )
+    recording_releases = dict()
+    for release in releases:
+        for medium in release.get( 'medium-list', list() ):
+            for track in medium.get( 'track-list', list() ):
+                if 'recording' in track and 'title' in release:
+                    recording_releases.setdefault( track['recording']['id'], list() ).append( release['title'] )
+    ARTIST_DISCOGRAPHY[_get_discography_key( artist_name, discography_key )] = {
+        'releases': releases,
+        'recording_releases': recording_releases
+    }
+    log.debug('Prefetched %d release(s) of "%s"' % (len(releases), artist_name))
+
+
+def _browse_artist_releases( artist_name,
+                             CONFIG_DATA,
+                             log ):
+    """
+    Returns the Musicbrainz releases of `artist_name` for
+    `prefetch_artist_discography()`, an empty list on failure
+    """
+    releases = list()
+    mb_config = CONFIG_DATA['musicbrainz_web_service']
+    max_releases = mb_config.get( 'discography_max_releases', DEFAULT_DISCOGRAPHY_MAX_RELEASES )
+    if max_releases <= 0:
+        return releases
+    try:
+        _wait_for_web_service( 'musicbrainz_web_service' )
+        result = musicbrainzngs.search_artists( artist=artist_name, limit=5 )
+    except Exception as exc:
+        log.warning("prefetch_artist_discography(): web service call failed: %s" % exc)
+        return releases
+    artist_id = None
+    for artist in result.get( 'artist-list', list() ):
+        try:
+            score = int( artist.get( 'ext:score', 0 ) )
+        except (TypeError, ValueError):
+            continue
+        if score >= mb_config.get( 'release_search_score', DEFAULT_RELEASE_SEARCH_SCORE ) \
+        and artist.get( 'name', '' ).lower() == artist_name.lower():
+            artist_id = artist['id']
+            break
+    if artist_id is None:
+        log.debug('prefetch_artist_discography(): no artist found for "%s"' % artist_name)
+        return releases
+
+    while len(releases) < max_releases:
+        try:
+            _wait_for_web_service( 'musicbrainz_web_service' )
+            result = musicbrainzngs.browse_releases(    artist=artist_id,
+                                                        includes=['recordings', 'artist-credits'],
+                                                        limit=min( _BROWSE_PAGE_SIZE, max_releases - len(releases) ),
+                                                        offset=len(releases) )
+        except Exception as exc:
+            log.warning("prefetch_artist_discography(): web service call failed: %s" % exc)
+            break
+        page = result.get( 'release-list', list() )
+        releases.extend( page )
+        if len(page) == 0 or len(releases) >= int( result.get( 'release-count', 0 ) ):
+            break
+    return releases
+
+
+def clear_artist_discography( discography_key=None ):
+    """
+    Evicts the cached discography stored under `discography_key` (see
+    `get_release_tracklist()`), or of all artists if None, call this when done
+    with the artist's albums
+    """
+    if discography_key is None:
+        ARTIST_DISCOGRAPHY.clear()
+    else:
+        ARTIST_DISCOGRAPHY.pop( discography_key, None )
+
+
+def _find_release_in_artist_discography( discography_key,
+                                         album_name,
+                                         num_tracks ):
+    """
+    Returns the release titled `album_name` from the cached discography
+    stored under `discography_key`, preferring one with `num_tracks` tracks,
+    or None
+    """
+    discography = ARTIST_DISCOGRAPHY.get( discography_key )
+    if discography is None:
+        return None
+    candidates = [release for release in discography['releases']
+                  if release.get( 'title', '' ).lower() == album_name.lower()]
+    candidates.sort( key=lambda release: _get_release_track_count( release ) != num_tracks )
+    return candidates[0] if candidates else None
+
+
+def get_release_tracklist( artist_name,
+                           album_name,
+                           num_tracks,
+                           CONFIG_DATA,
+                           log,
+                           discography_key=None ):
+    """
+    Searches Musicbrainz for the release `album_name` by `artist_name` and
+    returns its tracklist, so all tracks of an album directory can be resolved
+    with two web service calls instead of one fingerprint lookup per file.
+    Among the releases scoring at least the configured 'release_search_score',
+    credited to `artist_name`, the first one with `num_tracks` tracks is
+    preferred. The artist's discography is prefetched first (see
+    `prefetch_artist_discography()`) unless already cached, and the release is
+    only searched if it isn't found there. The discography is cached under
+    `discography_key`, by default the lower case artist name; albums of
+    different artist directories should pass their path, so they don't share
+    (and evict) each other's discographies.
+    Returns None on failure, else a list of dicts with 'position' (counted
+    over all media), 'title', 'length' (in seconds, or None), 'recording_id',
+    'artist_name' and 'artist_id'
+    """
+    discography_key = _get_discography_key( artist_name, discography_key )
+    if discography_key not in ARTIST_DISCOGRAPHY:
+        prefetch_artist_discography( artist_name, CONFIG_DATA, log, discography_key )
+    release = _find_release_in_artist_discography( discography_key, album_name, num_tracks )
+    if release is not None:
+        try:
+            return _get_tracklist_from_release( release )
+        except Exception as e:
+            log.warning("get_release_tracklist(): cached release parsing failed: %s: %s" % ( type(e), e ))
+
+    min_score = CONFIG_DATA['musicbrainz_web_service'].get(
+        'release_search_score', DEFAULT_RELEASE_SEARCH_SCORE )
+    try:
+        _wait_for_web_service( 'musicbrainz_web_service' )
+        result = musicbrainzngs.search_releases(    artist=artist_name,
+                                                    release=album_name,
+                                                    limit=10 )
+    except Exception as exc:
+        log.warning("get_release_tracklist(): web service call failed: %s" % exc)
+        return None
+    candidates = list()
+    for release in result.get( 'release-list', list() ):
+        try:
+            score = int( release.get( 'ext:score', 0 ) )
+        except (TypeError, ValueError):
+            continue
+        if score >= min_score \
+        and release.get( 'artist-credit-phrase', '' ).lower() == artist_name.lower():
+            candidates.append( release )
+    if len(candidates) == 0:
+        log.debug('get_release_tracklist(): no release found for "%s" - "%s"' % (artist_name, album_name))
+        return None
+    candidates.sort( key=lambda release: _get_release_track_count( release ) != num_tracks )
+
+    try:
+        _wait_for_web_service( 'musicbrainz_web_service' )
+        result = musicbrainzngs.get_release_by_id(  candidates[0]['id'],
+                                                    includes=['recordings', 'artist-credits'] )
+    except Exception as exc:
+        log.warning("get_release_tracklist(): web service call failed: %s" % exc)
+        return None
+    try:
+        tracklist = _get_tracklist_from_release( result['release'] )
+    except Exception as e:
+        log.warning("get_release_tracklist(): result parsing failed: %s: %s\nresult was %s" % ( type(e), e, str(result) ))
+        return None
+    return tracklist
+
+
+def match_track_in_tracklist(   tracklist,
+                                track_number,
+                                length,
+                                CONFIG_DATA ):
+    """
+    Returns the track of `tracklist` (see `get_release_tracklist()`) which
+    confidently matches a file with track number `track_number` and audio
+    length `length` (in seconds, e.g. from `MPEGInfo.length`), else None.
+    Either may be None if unknown. The track at `track_number` matches if its
+    length differs by at most the configured 'track_length_tolerance' (or
+    either length is unknown). Otherwise, a track matches by length alone if
+    it is the only one within the tolerance.
+    """
+    tolerance = CONFIG_DATA['musicbrainz_web_service'].get(
+        'track_length_tolerance', DEFAULT_TRACK_LENGTH_TOLERANCE )
+    def is_within_tolerance( track ):
+        return length is None or track['length'] is None \
+            or abs( track['length'] - length ) <= tolerance
+    if track_number is not None:
+        for track in tracklist:
+            if track['position'] == track_number:
+                if is_within_tolerance( track ):
+                    return track
+                break
+    if length is None:
+        return None
+    matches = [track for track in tracklist
+               if track['length'] is not None and is_within_tolerance( track )]
+    return matches[0] if len(matches) == 1 else None
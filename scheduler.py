@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lanes of worker threads processing jobs (e.g. album directories) concurrently,
+see `mp3_tag_fixer.process_root_directories()`. Each lane has its own bounded
+queue and statistics, so jobs waiting for one kind of work don't hold up the
+jobs of another lane. `DeviceSlots` limits how many threads do I/O on the
+same device (`st_dev`) at a time, so spinning disks aren't thrashed by
+interleaved seeks while I/O on other devices goes on. The jobs only take the
+slots around their actual reads and writes, see
+`mp3_tag_fixer.device_io_procedure()`.
+"""
+import os, threading, time, contextlib
+from collections import defaultdict, deque
+
+# Seconds between checks for KeyboardInterrupt while waiting
+_POLL_INTERVAL = 0.5
+
+# Returned to a worker to stop it
+_STOP = object()
+
+
+def get_device( absolute_path ):
+    """
+    Returns the `st_dev` of the file or directory at `absolute_path`, or of
+    its nearest existing parent directory
+    """
+    while True:
+        try:
+            return os.stat( absolute_path ).st_dev
+        except OSError:
+            parent = os.path.dirname( absolute_path )
+            if parent == absolute_path:
+                raise
+            absolute_path = parent
+
+
+def get_device_name( device ):
+    """
+    Returns '<major>:<minor>' of the `st_dev` value `device`
+    """
+    return '%d:%d' % (os.major( device ), os.minor( device ))
+
+
+class DeviceSlots(object):
+    """
+    At most `slots_per_device` threads at a time may do I/O on each device.
+    A thread takes the slots of all devices it needs at once (see `io()`),
+    waiting until all of them are free. Devices the thread already holds are
+    taken again without waiting; if it has to wait for others, it gives its
+    slots back meanwhile, so threads never wait for each other in a cycle.
+    Keeps statistics of each device: the seconds its slots were taken, how
+    often, and the bytes transferred.
+    """
+
+    def __init__( self, slots_per_device ):
+        self.slots_per_device = max( 1, int( slots_per_device ) )
+        self.condition = threading.Condition()
+        self._in_use = defaultdict( int )
+        # Maps each device held by the thread to the number of times it took
+        # it, see `_get_held()`
+        self._held = threading.local()
+        self.busy_seconds = defaultdict( float )
+        self.uses = defaultdict( int )
+        self.bytes = defaultdict( int )
+
+    def _get_held( self ):
+        if not hasattr( self._held, 'devices' ):
+            self._held.devices = dict()
+            # Seconds the thread gave its slots back, see `_wait()`
+            self._held.released_seconds = 0.0
+        return self._held.devices
+
+    def can_acquire( self, devices ):
+        """
+        Call with `condition` acquired
+        """
+        held = self._get_held()
+        return all( device in held or self._in_use[device] < self.slots_per_device
+                    for device in devices )
+
+    def acquire( self, devices ):
+        """
+        Takes the slots of `devices`, call with `condition` acquired once
+        `can_acquire()` returned True. Returns a token for `release()`.
+        """
+        held = self._get_held()
+        acquired = list()
+        for device in set( devices ):
+            if device in held:
+                held[device] += 1
+            else:
+                held[device] = 1
+                self._in_use[device] += 1
+                acquired.append( device )
+        return acquired, time.time() - self._held.released_seconds
+
+    def release( self, devices, token, num_bytes=0 ):
+        """
+        Gives back the slots of `devices` taken by `acquire()`, which returned
+        `token`, counting `num_bytes` as transferred on each of them
+        """
+        acquired, start = token
+        held = self._get_held()
+        elapsed = time.time() - self._held.released_seconds - start
+        with self.condition:
+            for device in set( devices ):
+                self.bytes[device] += num_bytes
+                held[device] -= 1
+                if held[device] == 0:
+                    del held[device]
+            for device in acquired:
+                self._in_use[device] -= 1
+                self.busy_seconds[device] += elapsed
+                self.uses[device] += 1
+            self.condition.notify_all()
+
+    def _wait( self, devices ):
+        """
+        Waits until `can_acquire(devices)`, call with `condition` acquired.
+        The slots held by the thread are given back while waiting.
+        """
+        if self.can_acquire( devices ):
+            return
+        held = self._get_held()
+        for device in held:
+            self._in_use[device] -= 1
+        self.condition.notify_all()
+        start = time.time()
+        wanted = set( devices ) | set( held )
+        while not all( self._in_use[device] < self.slots_per_device for device in wanted ):
+            self.condition.wait( _POLL_INTERVAL )
+        for device in held:
+            self._in_use[device] += 1
+        self._held.released_seconds += time.time() - start
+
+    @contextlib.contextmanager
+    def io( self, devices, num_bytes=0 ):
+        """
+        Context manager holding the slots of `devices` (`st_dev` values),
+        counting `num_bytes` as transferred on each of them
+        """
+        with self.condition:
+            self._wait( devices )
+            token = self.acquire( devices )
+        try:
+            yield
+        finally:
+            self.release( devices, token, num_bytes )
+
+    def get_report( self ):
+        """
+        Returns the statistics of each device as lines of text
+        """
+        lines = list()
+        for device in sorted( self.uses ):
+            megabytes = self.bytes[device] / 1e6
+            lines.append( 'Device %s: %.1f MB in %.1fs of I/O (%.1f MB/s), %d use(s) of %d slot(s)' % (
+                get_device_name( device ), megabytes, self.busy_seconds[device],
+                megabytes / max( self.busy_seconds[device], 1e-9 ),
+                self.uses[device], self.slots_per_device ) )
+        return '\n'.join( lines )
+
+
+class Lane(object):
+    """
+    `workers` threads calling `handler(job)` for the jobs put into the lane,
+    in the order they were put. At most `queue_depth` jobs wait at a time,
+    `put()` blocks beyond that. `handler` returns a list of outcomes (e.g. the
+    result of each album of the job), which are counted in `outcomes`.
+    Exceptions raised by `handler` are logged with `log` and counted as the
+    outcome 'error'.
+    """
+
+    def __init__(   self,
+                    name,
+                    handler,
+                    workers,
+                    queue_depth,
+                    log ):
+        self.name = name
+        self.handler = handler
+        self.workers = max( 1, int( workers ) )
+        self.queue_depth = max( 1, int( queue_depth ) )
+        self.log = log
+        self.jobs = 0
+        self.outcomes = defaultdict( int )
+        # Seconds spent by the workers in `handler`, and by `put()` waiting
+        # for a free slot in the queue
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.max_queued = 0
+        # Times the lane was created and its last job was done
+        self.start_time = time.time()
+        self.end_time = None
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._closing = False
+        self._threads = list()
+        for i in range( self.workers ):
+            thread = threading.Thread( target=self._work, name='%s lane %d' % (name, i + 1) )
+            thread.daemon = True
+            thread.start()
+            self._threads.append( thread )
+
+    def _get_next_job( self ):
+        """
+        Returns the first queued job, or `_STOP` once the lane is closed
+        """
+        with self._condition:
+            while True:
+                if len(self._queue) > 0:
+                    job = self._queue.popleft()
+                    self._condition.notify_all()
+                    return job
+                if self._closing:
+                    return _STOP
+                self._condition.wait( _POLL_INTERVAL )
+
+    def _work( self ):
+        while True:
+            job = self._get_next_job()
+            if job is _STOP:
+                return
+            start = time.time()
+            try:
+                outcomes = self.handler( job )
+            except Exception as e:
+                self.log.error('%s lane: job %r failed: <%s> %s' % (self.name, job, type(e), str(e)))
+                outcomes = ['error']
+            with self._condition:
+                self.jobs += 1
+                self.end_time = time.time()
+                self.busy_seconds += self.end_time - start
+                for outcome in outcomes:
+                    self.outcomes[outcome] += 1
+
+    def put( self, job ):
+        """
+        Queues `job`, waiting while the queue is full
+        """
+        start = time.time()
+        with self._condition:
+            while len(self._queue) >= self.queue_depth:
+                self._condition.wait( _POLL_INTERVAL )
+            self._queue.append( job )
+            self.blocked_seconds += time.time() - start
+            self.max_queued = max( self.max_queued, len(self._queue) )
+            self._condition.notify_all()
+
+    def close( self, cancel=False ):
+        """
+        Waits until all queued jobs are done, or with `cancel` only the ones
+        being processed, then stops the workers
+        """
+        with self._condition:
+            if cancel:
+                self._queue.clear()
+            self._closing = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join( _POLL_INTERVAL )
+
+    def get_report( self ):
+        """
+        Returns the lane's statistics as a line of text
+        """
+        wall_seconds = (self.end_time or self.start_time) - self.start_time
+        outcomes = ', '.join( '%d %s' % (count, outcome)
+                              for outcome, count in sorted( self.outcomes.items() ) )
+        return '%s lane: %d job(s) (%s) done by %d worker(s) in %.1fs, %.0f%% busy; ' \
+               'max queue depth %d of %d, %.1fs waited for a free slot' % (
+                    self.name, self.jobs, outcomes or 'none', self.workers,
+                    wall_seconds,
+                    100.0 * self.busy_seconds / max( wall_seconds * self.workers, 1e-9 ),
+                    self.max_queued, self.queue_depth, self.blocked_seconds )
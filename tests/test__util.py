@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mutagen._util import _openfile, insert_bytes, delete_bytes, \
+    ResizeMethod
+
+
+class TAtomicOpen(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "file")
+        with open(self.filename, "wb") as h:
+            h.write(b"old")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, filename, data):
+        with _openfile(None, filename, None, None, True, False,
+                       atomic=True) as h:
+            h.fileobj.seek(0)
+            h.fileobj.write(data)
+            h.fileobj.truncate()
+
+    def read(self, filename):
+        with open(filename, "rb") as h:
+            return h.read()
+
+    def test_replace(self):
+        inode = os.stat(self.filename).st_ino
+        self.write(self.filename, b"new")
+        self.assertEqual(self.read(self.filename), b"new")
+        self.assertNotEqual(os.stat(self.filename).st_ino, inode)
+        self.assertEqual(os.listdir(self.dir), ["file"])
+
+    @unittest.skipUnless(hasattr(os, "symlink"), "no symlinks")
+    def test_symlink(self):
+        link = os.path.join(self.dir, "link")
+        os.symlink(self.filename, link)
+        self.write(link, b"new")
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(self.filename), b"new")
+        self.assertEqual(sorted(os.listdir(self.dir)), ["file", "link"])
+
+    @unittest.skipUnless(hasattr(os, "link"), "no hard links")
+    def test_hard_link(self):
+        link = os.path.join(self.dir, "link")
+        os.link(self.filename, link)
+        self.write(self.filename, b"new")
+        self.assertEqual(self.read(link), b"new")
+        self.assertTrue(os.path.samefile(self.filename, link))
+
+    def resize(self, resize, size, offset):
+        with _openfile(None, self.filename, None, None, True, False,
+                       atomic=True) as h:
+            self.assertEqual(resize(h.fileobj, size, offset),
+                             ResizeMethod.COPY)
+            h.fileobj.seek(offset)
+            h.fileobj.write(b"N" * (size if resize is insert_bytes else 0))
+            # the original stays untouched until the end
+            self.assertEqual(self.read(self.filename), self.data)
+
+    def test_insert(self):
+        self.data = os.urandom(100000)
+        self.write(self.filename, self.data)
+        self.resize(insert_bytes, 1000, 50000)
+        self.assertEqual(self.read(self.filename),
+                         self.data[:50000] + b"N" * 1000 + self.data[50000:])
+
+    def test_insert_at_end(self):
+        self.data = b"old"
+        self.resize(insert_bytes, 10, 3)
+        self.assertEqual(self.read(self.filename), b"old" + b"N" * 10)
+
+    def test_delete(self):
+        self.data = os.urandom(100000)
+        self.write(self.filename, self.data)
+        self.resize(delete_bytes, 1000, 50000)
+        self.assertEqual(self.read(self.filename),
+                         self.data[:50000] + self.data[51000:])
+
+    def test_unchanged(self):
+        with _openfile(None, self.filename, None, None, True, False,
+                       atomic=True) as h:
+            self.assertEqual(h.fileobj.read(), b"old")
+        self.assertEqual(self.read(self.filename), b"old")
+        self.assertEqual(os.listdir(self.dir), ["file"])
+
+    def test_error(self):
+        try:
+            with _openfile(None, self.filename, None, None, True, False,
+                           atomic=True) as h:
+                insert_bytes(h.fileobj, 10, 0)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.read(self.filename), b"old")
+        self.assertEqual(os.listdir(self.dir), ["file"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import copy
+import unittest
+
+from mutagen._compat import text_type
+from mutagen._vorbis import VCommentDict, _RawValue
+from mutagen.flac import Picture
+
+
+def _picture_value():
+    picture = Picture()
+    picture.mime = u"image/png"
+    picture.data = b"\x89PNG" + b"\x00" * 1000
+    return base64.b64encode(picture.write()).decode("ascii")
+
+
+class TVCommentPictures(unittest.TestCase):
+
+    def setUp(self):
+        tags = VCommentDict()
+        tags["title"] = u"title"
+        tags["metadata_block_picture"] = _picture_value()
+        self.data = tags.write()
+
+    def test_mapping_returns_text(self):
+        tags = VCommentDict(self.data)
+        value = tags["METADATA_BLOCK_PICTURE"][0]
+        self.assertTrue(isinstance(value, text_type))
+        self.assertEqual(value, _picture_value())
+
+    def test_list_returns_text(self):
+        for tags in [VCommentDict(self.data), VCommentDict(self.data)[:],
+                     copy.copy(VCommentDict(self.data))]:
+            for key, value in tags:
+                self.assertTrue(isinstance(value, text_type))
+        tags = VCommentDict(self.data)
+        self.assertEqual(
+            tags.count((u"metadata_block_picture", _picture_value())), 1)
+        self.assertEqual(tags.as_dict()["metadata_block_picture"],
+                         [_picture_value()])
+
+    def test_pictures(self):
+        tags = VCommentDict(self.data)
+        pictures = tags.pictures()
+        self.assertEqual(len(pictures), 1)
+        self.assertEqual(pictures[0].data, b"\x89PNG" + b"\x00" * 1000)
+
+    def test_decoded_on_access(self):
+        tags = VCommentDict(self.data)
+        self.assertEqual(tags["title"], [u"title"])
+        self.assertTrue("metadata_block_picture" in tags)
+        tags.pictures()
+        self.assertTrue(isinstance(list.__getitem__(tags, 1)[1], _RawValue))
+        tags["metadata_block_picture"]
+        self.assertFalse(isinstance(list.__getitem__(tags, 1)[1], _RawValue))
+
+    def test_write_unchanged(self):
+        tags = VCommentDict(self.data)
+        self.assertEqual(tags["title"], [u"title"])
+        self.assertEqual(tags.write(), self.data)
+
+    def test_clear(self):
+        tags = VCommentDict(self.data)
+        tags.clear()
+        self.assertEqual(tags.keys(), [])
+        self.assertEqual(len(tags), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
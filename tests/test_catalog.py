@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog  # noqa: E402
+
+
+class TCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.connection = catalog.open_catalog(
+            os.path.join(self.dir, "catalog.sqlite"))
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.dir)
+
+    def get_files(self, album_dir=None):
+        query = "SELECT * FROM files"
+        parameters = ()
+        if album_dir is not None:
+            query += " WHERE album_dir = ?"
+            parameters = (album_dir,)
+        return self.connection.execute(
+            query + " ORDER BY path", parameters).fetchall()
+
+    def make_file(self, path, data=b"data"):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as h:
+            h.write(data)
+        return path
+
+    def add_album(self, album_dir, result=catalog.ALBUM_RESULT_SUCCESS,
+                  artist=u"artist", album=u"album", files=()):
+        catalog.update_album(self.connection, album_dir, artist, album,
+                             result, list(files))
+
+    def test_reopen(self):
+        self.add_album("/a")
+        self.connection.close()
+        self.connection = catalog.open_catalog(
+            os.path.join(self.dir, "catalog.sqlite"))
+        self.assertEqual([a["album_dir"] for a in
+                          catalog.get_albums(self.connection)], ["/a"])
+
+    def test_get_file_stat_values(self):
+        path = self.make_file(os.path.join(self.dir, "a", "1.mp3"))
+        values = catalog.get_file_stat_values(path)
+        self.assertEqual(values["size"], 4)
+        self.assertEqual(values["inode"], os.stat(path).st_ino)
+        self.assertEqual(catalog.get_file_stat_values(
+            os.path.join(self.dir, "missing")), {})
+
+    def test_update_album(self):
+        self.add_album("/a", artist=u"ärtist", files=[
+            {"path": "/a/1.mp3", "title": u"one", "track_number": 1,
+             "result": catalog.FILE_RESULT_TAGGED},
+            {"path": "/a/cover.jpg", "result": catalog.FILE_RESULT_NOT_MP3},
+        ])
+        album, = catalog.get_albums(self.connection)
+        self.assertEqual(album["artist"], u"ärtist")
+        self.assertEqual(album["result"], catalog.ALBUM_RESULT_SUCCESS)
+        first, cover = self.get_files()
+        self.assertEqual(first["album_dir"], "/a")
+        self.assertEqual((first["title"], first["track_number"]),
+                         (u"one", 1))
+        # missing values are NULL
+        self.assertEqual(cover["title"], None)
+        self.assertEqual(cover["result"], catalog.FILE_RESULT_NOT_MP3)
+
+    def test_update_album_replaces_rows(self):
+        self.add_album("/a", files=[{"path": "/a/1.mp3"},
+                                    {"path": "/a/2.mp3"}])
+        self.add_album("/b", files=[{"path": "/b/1.mp3"}])
+        self.add_album("/a", result=catalog.ALBUM_RESULT_NOT_SUCCESS,
+                       files=[{"path": "/a/2.mp3", "title": u"two"}])
+        self.assertEqual([f["path"] for f in self.get_files()],
+                         ["/a/2.mp3", "/b/1.mp3"])
+        self.assertEqual(self.get_files("/a")[0]["title"], u"two")
+        self.assertEqual(
+            sorted((a["album_dir"], a["result"])
+                   for a in catalog.get_albums(self.connection)),
+            [("/a", catalog.ALBUM_RESULT_NOT_SUCCESS),
+             ("/b", catalog.ALBUM_RESULT_SUCCESS)])
+
+    def test_update_album_fingerprints(self):
+        self.add_album("/a", files=[
+            {"path": "/a/1.mp3", "fingerprint": (100, "AQAA1")},
+            {"path": "/a/2.mp3", "fingerprint": (200, "AQAA2")},
+        ])
+        self.add_album("/b", files=[
+            {"path": "/b/1.mp3", "fingerprint": (100, "AQAA1")},
+        ])
+        a1, a2, b1 = self.get_files()
+        self.assertEqual(a1["fingerprint_id"], b1["fingerprint_id"])
+        self.assertNotEqual(a1["fingerprint_id"], a2["fingerprint_id"])
+        count, = self.connection.execute(
+            "SELECT COUNT(*) FROM fingerprints").fetchone()
+        self.assertEqual(count, 2)
+
+    def test_get_albums(self):
+        self.add_album("/c", artist=u"b", album=u"x")
+        self.add_album("/b", artist=u"a", album=u"y",
+                       result=catalog.ALBUM_RESULT_NOT_SUCCESS)
+        self.add_album("/a", artist=u"b", album=u"w",
+                       result=catalog.ALBUM_RESULT_NOT_SUCCESS)
+
+        def dirs(**kwargs):
+            return [a["album_dir"]
+                    for a in catalog.get_albums(self.connection, **kwargs)]
+
+        self.assertEqual(dirs(), ["/b", "/a", "/c"])
+        self.assertEqual(dirs(artist=u"b"), ["/a", "/c"])
+        self.assertEqual(dirs(result=catalog.ALBUM_RESULT_NOT_SUCCESS),
+                         ["/b", "/a"])
+        self.assertEqual(dirs(result=catalog.ALBUM_RESULT_NOT_SUCCESS,
+                              artist=u"b"), ["/a"])
+
+    def test_move_album(self):
+        album_dir = os.path.join(self.dir, "in", "album")
+        new_album_dir = os.path.join(self.dir, "out", "album")
+        self.add_album(album_dir, files=[
+            {"path": os.path.join(album_dir, "1.mp3"), "title": u"one",
+             "size": 1, "inode": 1},
+            {"path": os.path.join(album_dir, "cd1", "2.mp3"),
+             "title": u"two"},
+        ])
+        self.make_file(os.path.join(new_album_dir, "1.mp3"), b"moved")
+        catalog.move_album(self.connection, album_dir, new_album_dir)
+
+        album, = catalog.get_albums(self.connection)
+        self.assertEqual(album["album_dir"], new_album_dir)
+        first, second = self.get_files()
+        self.assertEqual(first["path"], os.path.join(new_album_dir, "1.mp3"))
+        self.assertEqual(second["path"],
+                         os.path.join(new_album_dir, "cd1", "2.mp3"))
+        self.assertEqual(first["album_dir"], new_album_dir)
+        self.assertEqual(first["title"], u"one")
+        # the stat values are refreshed, NULL for files that are missing
+        self.assertEqual(first["size"], 5)
+        self.assertEqual(first["inode"],
+                         os.stat(first["path"]).st_ino)
+        self.assertEqual(second["size"], None)
+        self.assertEqual(self.get_files(album_dir), [])
+
+    def test_move_album_replaces_previous(self):
+        self.add_album("/in/a", album=u"new", files=[
+            {"path": "/in/a/1.mp3"}])
+        self.add_album("/out/a", album=u"old", files=[
+            {"path": "/out/a/1.mp3", "title": u"old"},
+            {"path": "/out/a/2.mp3"}])
+        catalog.move_album(self.connection, "/in/a", "/out/a")
+        album, = catalog.get_albums(self.connection)
+        self.assertEqual((album["album_dir"], album["album"]),
+                         ("/out/a", u"new"))
+        moved, = self.get_files()
+        self.assertEqual((moved["path"], moved["title"]),
+                         ("/out/a/1.mp3", None))
+
+    def test_move_album_prefix(self):
+        # "/a" must not match the files of "/ab"
+        self.add_album("/a", files=[{"path": "/a/1.mp3"}])
+        self.add_album("/ab", files=[{"path": "/ab/1.mp3"}])
+        catalog.move_album(self.connection, "/a", "/c")
+        self.assertEqual([f["path"] for f in self.get_files()],
+                         ["/ab/1.mp3", "/c/1.mp3"])
+        self.assertEqual(sorted(a["album_dir"] for a in
+                                catalog.get_albums(self.connection)),
+                         ["/ab", "/c"])
+
+    def test_move_album_in_place(self):
+        album_dir = os.path.join(self.dir, "album")
+        path = self.make_file(os.path.join(album_dir, "1.mp3"))
+        self.add_album(album_dir, result=catalog.ALBUM_RESULT_QUEUED, files=[
+            dict(catalog.get_file_stat_values(path), path=path,
+                 title=u"one")])
+        self.make_file(path, b"written")
+        catalog.move_album(self.connection, album_dir, album_dir)
+        album, = catalog.get_albums(self.connection)
+        self.assertEqual(album["result"], catalog.ALBUM_RESULT_QUEUED)
+        written, = self.get_files()
+        self.assertEqual((written["path"], written["title"]), (path, u"one"))
+        self.assertEqual(written["size"], 7)
+
+    def test_get_remaining_work(self):
+        self.add_album("/a", files=[
+            {"path": "/a/1.mp3", "result": catalog.FILE_RESULT_TAGGED}])
+        self.add_album("/b", result=catalog.ALBUM_RESULT_NOT_SUCCESS, files=[
+            {"path": "/b/2.mp3", "result": catalog.FILE_RESULT_UNRESOLVED},
+            {"path": "/b/1.mp3", "result": catalog.FILE_RESULT_TAG_FAILED},
+            {"path": "/b/x.jpg", "result": catalog.FILE_RESULT_NOT_MP3}])
+        self.add_album("/c", result=catalog.ALBUM_RESULT_QUEUED, files=[
+            {"path": "/c/1.mp3", "result": catalog.FILE_RESULT_QUEUED}])
+        albums, files = catalog.get_remaining_work(self.connection)
+        self.assertEqual([a["album_dir"] for a in albums], ["/b", "/c"])
+        self.assertEqual([f["path"] for f in files],
+                         ["/b/1.mp3", "/b/2.mp3", "/c/1.mp3"])
+
+    def test_get_remaining_work_empty(self):
+        self.assertEqual(catalog.get_remaining_work(self.connection),
+                         ([], []))
+
+    def test_get_queued_albums(self):
+        self.add_album("/a", artist=u"z", result=catalog.ALBUM_RESULT_QUEUED)
+        self.add_album("/b", result=catalog.ALBUM_RESULT_NOT_SUCCESS)
+        self.add_album("/c", artist=u"y", result=catalog.ALBUM_RESULT_QUEUED)
+        self.assertEqual([a["album_dir"] for a in
+                          catalog.get_queued_albums(self.connection)],
+                         ["/c", "/a"])
+        # leaves the queue when recorded with another result
+        self.add_album("/a", result=catalog.ALBUM_RESULT_SUCCESS)
+        self.assertEqual([a["album_dir"] for a in
+                          catalog.get_queued_albums(self.connection)],
+                         ["/c"])
+
+    def test_get_queued_files(self):
+        self.add_album("/a", result=catalog.ALBUM_RESULT_QUEUED, files=[
+            {"path": "/a/2.mp3", "result": catalog.FILE_RESULT_QUEUED,
+             "fingerprint": (120, "AQAA2")},
+            {"path": "/a/1.mp3", "result": catalog.FILE_RESULT_QUEUED},
+            {"path": "/a/3.mp3", "result": catalog.FILE_RESULT_TAGGED,
+             "fingerprint": (100, "AQAA3")}])
+        self.add_album("/b", result=catalog.ALBUM_RESULT_QUEUED, files=[
+            {"path": "/b/1.mp3", "result": catalog.FILE_RESULT_QUEUED}])
+        first, second = catalog.get_queued_files(self.connection, "/a")
+        self.assertEqual(first["path"], "/a/1.mp3")
+        self.assertEqual((first["duration"], first["fingerprint"]),
+                         (None, None))
+        self.assertEqual(second["path"], "/a/2.mp3")
+        self.assertEqual((second["duration"], second["fingerprint"]),
+                         (120, "AQAA2"))
+        self.assertEqual(catalog.get_queued_files(self.connection, "/c"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+else:
+    import fingerprint_index
+
+
+def _pack_ints(ints, width):
+    bits = []
+    for value in ints:
+        bits.extend((value >> i) & 1 for i in range(width))
+    bits.extend([0] * (-len(bits) % 8))
+    return bytearray(
+        sum(bit << i for i, bit in enumerate(bits[start:start + 8]))
+        for start in range(0, len(bits), 8))
+
+
+def encode_fingerprint(values):
+    """Compresses sub-fingerprints like Chromaprint does"""
+
+    normal, exceptional = [], []
+    previous = 0
+    for value in values:
+        diff = int(value) ^ previous
+        previous = int(value)
+        last_position = 0
+        for position in range(1, 33):
+            if diff & (1 << (position - 1)):
+                distance = position - last_position
+                last_position = position
+                if distance >= 7:
+                    normal.append(7)
+                    exceptional.append(distance - 7)
+                else:
+                    normal.append(distance)
+        normal.append(0)
+    data = bytearray([1, len(values) >> 16 & 0xff, len(values) >> 8 & 0xff,
+                      len(values) & 0xff])
+    data += _pack_ints(normal, 3) + _pack_ints(exceptional, 5)
+    return base64.urlsafe_b64encode(bytes(data)).decode("ascii").rstrip("=")
+
+
+@unittest.skipIf(numpy is None, "NumPy is missing")
+class TFingerprintIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index = fingerprint_index.FingerprintIndex(
+            os.path.join(self.dir, "index.sqlite"))
+        self.random = numpy.random.RandomState(42)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def random_values(self, count=1000):
+        return self.random.randint(
+            0, 2 ** 32, count, dtype=numpy.int64).astype(numpy.uint32)
+
+    def with_bit_errors(self, values, rate, shift=0):
+        flips = self.random.random_sample((len(values), 32)) < rate
+        masks = flips.astype(numpy.uint64).dot(
+            numpy.uint64(1) << numpy.arange(32, dtype=numpy.uint64))
+        noisy = values ^ masks.astype(numpy.uint32)
+        if shift > 0:
+            noisy = numpy.concatenate((self.random_values(shift), noisy))
+        elif shift < 0:
+            noisy = noisy[-shift:]
+        return noisy
+
+    def test_encode_decode(self):
+        values = self.random_values(50)
+        values[3] = 0
+        values[4] = 0xffffffff
+        decoded = fingerprint_index.decode_fingerprint(
+            encode_fingerprint(values))
+        self.assertTrue(numpy.array_equal(decoded, values))
+
+    def test_recall(self):
+        originals = [self.random_values() for i in range(40)]
+        for i, values in enumerate(originals):
+            self.index.add("%d.mp3" % i, 200, encode_fingerprint(values),
+                           (u"title", u"track%d" % i, u"artist", u"artist"))
+        for rate in (0.01, 0.05, 0.1, 0.15):
+            found = 0
+            for i, values in enumerate(originals):
+                shift = i % (2 * fingerprint_index.MAX_ALIGNMENT_OFFSET + 1) \
+                    - fingerprint_index.MAX_ALIGNMENT_OFFSET
+                query = encode_fingerprint(
+                    self.with_bit_errors(values, rate, shift))
+                paths = self.index.find_duplicates("query.mp3", query, 0.2)
+                found += paths == ["%d.mp3" % i]
+            self.assertTrue(found >= 38, (rate, found))
+
+    def test_unrelated(self):
+        for i in range(40):
+            self.index.add("%d.mp3" % i, 200,
+                           encode_fingerprint(self.random_values()))
+        for i in range(10):
+            query = encode_fingerprint(self.random_values())
+            self.assertEqual(
+                self.index.find_duplicates("query.mp3", query, 0.2), [])
+
+    def test_hot_bucket(self):
+        silence = numpy.zeros(1000, dtype=numpy.uint32)
+        for i in range(20):
+            self.index.add("%d.mp3" % i, 200, encode_fingerprint(silence))
+        values = self.random_values()
+        self.index.add("song.mp3", 200, encode_fingerprint(values))
+        old_limit = fingerprint_index._BUCKET_SCAN_LIMIT
+        fingerprint_index._BUCKET_SCAN_LIMIT = 5
+        try:
+            self.assertEqual(len(self.index.find_duplicates(
+                "query.mp3", encode_fingerprint(silence), 0.0)), 5)
+            self.assertEqual(self.index.find_duplicates(
+                "query.mp3", encode_fingerprint(values), 0.0), ["song.mp3"])
+        finally:
+            fingerprint_index._BUCKET_SCAN_LIMIT = old_limit
+
+    def test_rebuild_buckets(self):
+        values = self.random_values()
+        self.index.add("song.mp3", 200, encode_fingerprint(values))
+        with self.index.connection:
+            self.index.connection.execute(
+                "UPDATE fingerprint_buckets SET bucket = bucket + 1")
+            self.index.connection.execute("PRAGMA user_version = 1")
+        self.index.close()
+        self.index = fingerprint_index.FingerprintIndex(
+            os.path.join(self.dir, "index.sqlite"))
+        self.assertEqual(self.index.find_duplicates(
+            "query.mp3", encode_fingerprint(values), 0.0), ["song.mp3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from mutagen.flac import FLAC, Picture, Padding, error
+
+
+# A STREAMINFO block, taken from mutagen's own tests
+STREAMINFO = (b'\x12\x00\x12\x00\x00\x00\x0e\x005\xea\n\xc4H\xf0\x00\xca0'
+              b'\x14(\x90\xf9\xe1)2\x13\x01\xd4\xa7\xa9\x11!8\xab\x91')
+AUDIO = b"\xff\xf8" + b"audio" * 1000
+
+
+def _block(code, data, last=False):
+    return struct.pack(">I", len(data))[1:].join(
+        [struct.pack("B", code | (128 if last else 0)), data])
+
+
+def _picture(data, desc):
+    picture = Picture()
+    picture.mime = u"image/png"
+    picture.desc = desc
+    picture.data = data
+    return picture
+
+
+def write_flac(filename, pictures, padding=1024):
+    with open(filename, "wb") as fileobj:
+        fileobj.write(b"fLaC" + _block(0, STREAMINFO))
+        for picture in pictures:
+            fileobj.write(_block(Picture.code, picture.write()))
+        fileobj.write(_block(Padding.code, b"\x00" * padding, last=True))
+        fileobj.write(AUDIO)
+
+
+def read_audio(filename):
+    with open(filename, "rb") as fileobj:
+        return fileobj.read()[-len(AUDIO):]
+
+
+class TFLACLazyPictures(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, "test.flac")
+        self.front = os.urandom(3000)
+        self.back = os.urandom(5000)
+        write_flac(self.filename, [_picture(self.front, u"front"),
+                                   _picture(self.back, u"back")])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def assertPictures(self, expected):
+        pictures = FLAC(self.filename).pictures
+        self.assertEqual([(p.desc, p.data) for p in pictures], expected)
+        self.assertEqual(read_audio(self.filename), AUDIO)
+
+    def test_save_unchanged(self):
+        FLAC(self.filename).save()
+        self.assertPictures([(u"front", self.front), (u"back", self.back)])
+
+    def test_save_reordered(self):
+        audio = FLAC(self.filename)
+        pictures = audio.pictures
+        audio.clear_pictures()
+        for picture in reversed(pictures):
+            audio.add_picture(picture)
+        audio.save()
+        self.assertPictures([(u"back", self.back), (u"front", self.front)])
+
+    def test_save_reordered_growing(self):
+        audio = FLAC(self.filename)
+        pictures = audio.pictures
+        audio.clear_pictures()
+        for picture in reversed(pictures):
+            audio.add_picture(picture)
+        audio["title"] = u"x" * 5000
+        audio.save()
+        self.assertPictures([(u"back", self.back), (u"front", self.front)])
+
+    def test_save_picture_twice(self):
+        audio = FLAC(self.filename)
+        audio.add_picture(audio.pictures[0])
+        audio.save()
+        self.assertPictures([(u"front", self.front), (u"back", self.back),
+                             (u"front", self.front)])
+
+    def test_save_twice_after_reorder(self):
+        audio = FLAC(self.filename)
+        pictures = audio.pictures
+        audio.clear_pictures()
+        for picture in reversed(pictures):
+            audio.add_picture(picture)
+        audio.save()
+        audio["title"] = u"title"
+        audio.save()
+        self.assertPictures([(u"back", self.back), (u"front", self.front)])
+
+    def test_save_after_other_instance(self):
+        first = FLAC(self.filename)
+        second = FLAC(self.filename)
+        first["title"] = u"x" * 100
+        first.save()
+        # the pictures of the second one aren't where they were anymore
+        self.assertRaises(error, second.save)
+        self.assertPictures([(u"front", self.front), (u"back", self.back)])
+        self.assertEqual(FLAC(self.filename)["title"], [u"x" * 100])
+
+    def test_save_after_other_instance_reordered(self):
+        first = FLAC(self.filename)
+        second = FLAC(self.filename)
+        pictures = first.pictures
+        first.clear_pictures()
+        for picture in reversed(pictures):
+            first.add_picture(picture)
+        first.save()
+        self.assertRaises(error, second.save)
+        self.assertPictures([(u"back", self.back), (u"front", self.front)])
+
+    def test_save_after_other_instance_read(self):
+        first = FLAC(self.filename)
+        second = FLAC(self.filename)
+        for picture in second.pictures:
+            picture.data
+        first["title"] = u"x" * 100
+        first.save()
+        second["title"] = u"second"
+        second.save()
+        self.assertPictures([(u"front", self.front), (u"back", self.back)])
+        self.assertEqual(FLAC(self.filename)["title"], [u"second"])
+        # the layout of the file is known again after saving
+        second.clear_pictures()
+        second.save()
+        self.assertPictures([])
+
+    def test_data_after_other_instance(self):
+        first = FLAC(self.filename)
+        second = FLAC(self.filename)
+        pictures = first.pictures
+        first.clear_pictures()
+        for picture in reversed(pictures):
+            first.add_picture(picture)
+        first.save()
+        # the picture data isn't where it was anymore
+        self.assertRaises(error, lambda: second.pictures[0].data)
+        self.assertEqual([p.data for p in first.pictures],
+                         [self.back, self.front])
+
+    def test_data_after_closing_fileobj(self):
+        with open(self.filename, "rb") as fileobj:
+            audio = FLAC(fileobj)
+        self.assertEqual([p.data for p in audio.pictures],
+                         [self.front, self.back])
+
+    def test_save_fileobj(self):
+        with open(self.filename, "rb+") as fileobj:
+            audio = FLAC(fileobj)
+            audio["title"] = u"x" * 5000
+            audio.save(fileobj)
+        self.assertPictures([(u"front", self.front), (u"back", self.back)])
+
+    def test_save_to(self):
+        with open(self.filename, "rb") as h:
+            data = h.read()
+        dest = os.path.join(self.temp_dir, "copy.flac")
+        audio = FLAC(self.filename)
+        audio["title"] = u"x" * 5000
+        audio.save_to(dest)
+        copy = FLAC(dest)
+        self.assertEqual(copy["title"], [u"x" * 5000])
+        self.assertEqual([p.data for p in copy.pictures],
+                         [self.front, self.back])
+        self.assertEqual(read_audio(dest), AUDIO)
+        with open(self.filename, "rb") as h:
+            self.assertEqual(h.read(), data)
+        # the loaded file is still the one getting saved
+        audio.save()
+        self.assertEqual(FLAC(self.filename)["title"], [u"x" * 5000])
+
+    def test_save_to_unchanged(self):
+        dest = os.path.join(self.temp_dir, "copy.flac")
+        with open(dest, "wb") as h:
+            h.write(b"x" * 100000)
+        FLAC(self.filename).save_to(dest)
+        with open(self.filename, "rb") as a:
+            with open(dest, "rb") as b:
+                self.assertEqual(a.read(), b.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
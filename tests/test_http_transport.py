@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_transport  # noqa: E402
+from http_transport import HTTPTransport, httplib  # noqa: E402
+
+
+def gzip_data(data):
+    compressed = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed, mode="wb") as gzip_file:
+        gzip_file.write(data)
+    return compressed.getvalue()
+
+
+class FakeResponse(object):
+
+    def __init__(self, body, headers=None, status=200, will_close=False):
+        self.status = status
+        self.reason = "OK"
+        self.body = body
+        self.headers = headers or []
+        self.will_close = will_close
+
+    def read(self):
+        return self.body
+
+    def getheaders(self):
+        return self.headers
+
+
+class FakeConnection(object):
+    """Stands in for an httplib connection. Each request gets the next of
+    `responses`, exceptions in there get raised instead.
+    """
+
+    def __init__(self, server, key):
+        self.server = server
+        self.key = key
+        self.sock = None
+        self.timeout = None
+        self.closed = False
+        self.requests = []
+
+    def request(self, method, path, body, headers):
+        self.closed = False
+        self.requests.append((method, path, body, headers))
+
+    def getresponse(self):
+        return self.server.respond(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServer(object):
+    """The `connection_factory` of the transport, records all connections"""
+
+    def __init__(self):
+        self.connections = []
+        self.responses = []
+        self.lock = threading.Lock()
+
+    def __call__(self, scheme, host, port, timeout):
+        with self.lock:
+            connection = FakeConnection(self, (scheme, host, port))
+            self.connections.append(connection)
+            return connection
+
+    def respond(self, connection):
+        with self.lock:
+            response = self.responses.pop(0) if self.responses else None
+        if response is None:
+            return FakeResponse(b"body")
+        if callable(response):
+            return response(connection)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class THTTPTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeServer()
+        self.calls = []
+        self.transport = HTTPTransport(
+            max_connections=2, max_connections_per_host=1,
+            connection_factory=self.server, hooks=[self.hook])
+
+    def tearDown(self):
+        self.transport.close()
+
+    def hook(self, method, url, status, elapsed, reused):
+        self.calls.append((method, url, status, reused))
+
+    def test_request(self):
+        response = self.transport.request(
+            "POST", "https://example.org:8443/path?q=1", b"data",
+            {"X": "y"})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, b"body")
+        connection, = self.server.connections
+        self.assertEqual(connection.key, ("https", "example.org", 8443))
+        method, path, body, headers = connection.requests[0]
+        self.assertEqual((method, path, body), ("POST", "/path?q=1", b"data"))
+        self.assertEqual(headers, {"X": "y", "Accept-Encoding": "gzip"})
+
+    def test_reuse(self):
+        for i in range(3):
+            self.transport.request("GET", "http://example.org/")
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual([c[3] for c in self.calls], [False, True, True])
+
+    def test_no_reuse_if_closing(self):
+        self.server.responses = [FakeResponse(b"", will_close=True)]
+        self.transport.request("GET", "http://example.org/")
+        self.transport.request("GET", "http://example.org/")
+        self.assertEqual(len(self.server.connections), 2)
+        self.assertTrue(self.server.connections[0].closed)
+
+    def test_stale_connection_retried(self):
+        self.transport.request("GET", "http://example.org/")
+        self.server.responses = [httplib.BadStatusLine("''")]
+        response = self.transport.request("GET", "http://example.org/")
+        self.assertEqual(response.body, b"body")
+        connection, = self.server.connections
+        self.assertEqual(len(connection.requests), 3)
+        self.assertEqual(self.calls[-1], ("GET", "http://example.org/", 200,
+                                          False))
+
+    def test_new_connection_not_retried(self):
+        self.server.responses = [httplib.BadStatusLine("''")]
+        self.assertRaises(httplib.BadStatusLine, self.transport.request,
+                          "GET", "http://example.org/")
+        self.assertEqual(self.calls, [("GET", "http://example.org/", None,
+                                       False)])
+        # the failed connection isn't kept
+        self.transport.request("GET", "http://example.org/")
+        self.assertEqual(len(self.server.connections), 2)
+        self.assertTrue(self.server.connections[0].closed)
+
+    def test_per_host_limit(self):
+        started = threading.Event()
+        done = threading.Event()
+
+        def slow(connection):
+            started.set()
+            done.wait(10)
+            return FakeResponse(b"slow")
+
+        self.server.responses = [slow]
+        thread = threading.Thread(
+            target=self.transport.request, args=("GET", "http://a/"))
+        thread.start()
+        started.wait(10)
+        results = []
+        waiting = threading.Thread(target=lambda: results.append(
+            self.transport.request("GET", "http://a/")))
+        waiting.start()
+        # a request to another host doesn't have to wait
+        self.transport.request("GET", "http://b/")
+        time.sleep(0.1)
+        self.assertEqual(results, [])
+        self.assertEqual(len(self.server.connections), 2)
+        done.set()
+        thread.join(10)
+        waiting.join(10)
+        self.assertEqual(results[0].body, b"body")
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_total_limit_closes_least_recently_used(self):
+        self.transport.request("GET", "http://a/")
+        time.sleep(0.01)
+        self.transport.request("GET", "http://b/")
+        time.sleep(0.01)
+        self.transport.request("GET", "http://a/")
+        a, b = self.server.connections
+        self.transport.request("GET", "http://c/")
+        self.assertEqual(len(self.server.connections), 3)
+        self.assertTrue(b.closed)
+        self.assertFalse(a.closed)
+        # a is still idle and gets reused
+        self.transport.request("GET", "http://a/")
+        self.assertEqual(len(self.server.connections), 3)
+
+    def test_total_limit_waits(self):
+        started = threading.Event()
+        done = threading.Event()
+
+        def slow(connection):
+            started.set()
+            done.wait(10)
+            return FakeResponse(b"slow")
+
+        threads = []
+        for host in ["a", "b"]:
+            self.server.responses = [slow]
+            started.clear()
+            thread = threading.Thread(
+                target=self.transport.request,
+                args=("GET", "http://%s/" % host))
+            thread.start()
+            started.wait(10)
+            threads.append(thread)
+        results = []
+        waiting = threading.Thread(target=lambda: results.append(
+            self.transport.request("GET", "http://c/")))
+        waiting.start()
+        time.sleep(0.1)
+        self.assertEqual(results, [])
+        done.set()
+        for thread in threads + [waiting]:
+            thread.join(10)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(self.server.connections), 3)
+
+    def test_gzip(self):
+        self.server.responses = [FakeResponse(
+            gzip_data(b"x" * 1000), [("Content-Encoding", "gzip")])]
+        response = self.transport.request("GET", "http://example.org/")
+        self.assertEqual(response.body, b"x" * 1000)
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+
+    def test_gzip_corrupt(self):
+        self.server.responses = [FakeResponse(
+            b"not gzip", [("Content-Encoding", "gzip")])]
+        self.assertRaises(httplib.HTTPException, self.transport.request,
+                          "GET", "http://example.org/")
+        # the connection itself is fine
+        self.transport.request("GET", "http://example.org/")
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_http_error(self):
+        self.server.responses = [FakeResponse(b"", status=503)]
+        response = self.transport.request("GET", "http://example.org/")
+        self.assertEqual(response.status, 503)
+        error = http_transport.HTTPError(response)
+        self.assertTrue("503" in str(error))
+
+    def test_close(self):
+        self.transport.request("GET", "http://example.org/")
+        self.transport.close()
+        self.assertTrue(self.server.connections[0].closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
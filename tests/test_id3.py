@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from mutagen import _util, MutagenError
+from mutagen._compat import cBytesIO
+from mutagen.id3 import ID3, TIT2, BitPaddedInt
+from mutagen.mp3 import MP3
+
+
+class TID3Padding(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.mp3")
+        with open(self.filename, "wb") as h:
+            h.write(b"\xff\xfb" + b"\x00" * 10000)
+        tag = ID3()
+        tag.add(TIT2(encoding=3, text=[u"title"]))
+        tag.save(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_custom_padding_not_aligned(self):
+        tag = ID3(self.filename)
+        tag.save(padding=lambda info: 42)
+        self.assertEqual(ID3(self.filename)._padding, 42)
+
+    def test_no_alignment_without_file_name(self):
+        with open(self.filename, "rb+") as h:
+            self.assertEqual(_util.resize_alignment(cBytesIO()), None)
+            alignment = _util.resize_alignment(h)
+        if alignment is not None:
+            self.assertTrue(_util._extents_supported[
+                os.stat(self.filename).st_dev])
+
+
+class TID3SaveTo(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.mp3")
+        with open(self.filename, "wb") as h:
+            # 128 kbit/s, 44.1 kHz frames
+            h.write((b"\xff\xfb\x90\x64" + b"\x00" * 413) * 30)
+        tag = ID3()
+        tag.add(TIT2(encoding=3, text=[u"title"]))
+        tag.save(self.filename)
+        with open(self.filename, "rb") as h:
+            self.data = h.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertUnchanged(self):
+        with open(self.filename, "rb") as h:
+            self.assertEqual(h.read(), self.data)
+
+    def test_copy(self):
+        dest = os.path.join(self.dir, "copy.mp3")
+        ID3(self.filename).save_to(dest)
+        self.assertEqual(ID3(dest)["TIT2"].text, [u"title"])
+        self.assertUnchanged()
+
+    def test_same_file(self):
+        tag = ID3(self.filename)
+        self.assertRaises(MutagenError, tag.save_to, self.filename)
+        self.assertUnchanged()
+
+    @unittest.skipUnless(hasattr(os, "link"), "no hard links")
+    def test_hard_link(self):
+        link = os.path.join(self.dir, "link.mp3")
+        os.link(self.filename, link)
+        self.assertRaises(MutagenError, ID3(self.filename).save_to, link)
+        self.assertRaises(MutagenError, MP3(self.filename).save_to, link)
+        self.assertUnchanged()
+
+    def test_file_type_same_file(self):
+        audio = MP3(self.filename)
+        self.assertRaises(MutagenError, audio.save_to, self.filename)
+        audio.tags = None
+        self.assertRaises(MutagenError, audio.save_to, self.filename)
+        self.assertUnchanged()
+
+
+def _v24_frame(frame_id, data):
+    return frame_id + struct.pack(">I", len(data)) + b"\x00\x00" + data
+
+
+class TID3EncodedFrames(unittest.TestCase):
+
+    # big endian UTF-16, mutagen itself writes little endian
+    TIT2 = _v24_frame(
+        b"TIT2", b"\x01" + u"\ufefftitle\x00".encode("utf-16-be"))
+    TPE1 = _v24_frame(b"TPE1", b"\x03artist")
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.mp3")
+        frames = self.TIT2 + self.TPE1
+        with open(self.filename, "wb") as h:
+            h.write(b"ID3\x04\x00\x00" + BitPaddedInt.to_str(len(frames)))
+            h.write(frames)
+            h.write((b"\xff\xfb\x90\x64" + b"\x00" * 413) * 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def save(self, tag, **kwargs):
+        tag.save(padding=lambda info: 0, **kwargs)
+        with open(self.filename, "rb") as h:
+            return h.read(ID3(self.filename).size)[10:]
+
+    def test_unchanged_written_as_loaded(self):
+        self.assertEqual(self.save(ID3(self.filename)),
+                         self.TIT2 + self.TPE1)
+
+    def test_changed_in_place(self):
+        tag = ID3(self.filename)
+        tag["TIT2"].text.append(u"more")
+        data = self.save(tag)
+        self.assertTrue(data.endswith(self.TPE1))
+        self.assertEqual(ID3(self.filename)["TIT2"].text, [u"title", u"more"])
+
+    def test_changed_in_place_twice(self):
+        tag = ID3(self.filename)
+        tag["TIT2"].text.append(u"more")
+        self.save(tag)
+        tag["TIT2"].text[0] = u"changed"
+        self.save(tag)
+        self.assertEqual(ID3(self.filename)["TIT2"].text,
+                         [u"changed", u"more"])
+
+    def test_changed_attribute(self):
+        tag = ID3(self.filename)
+        tag["TIT2"].encoding = 3
+        data = self.save(tag)
+        self.assertEqual(data,
+                         _v24_frame(b"TIT2", b"\x03title\x00") + self.TPE1)
+
+    def test_replaced(self):
+        tag = ID3(self.filename)
+        tag.add(TIT2(encoding=1, text=[u"title"]))
+        data = self.save(tag)
+        self.assertFalse(self.TIT2 in data)
+        self.assertTrue(data.endswith(self.TPE1))
+        self.assertEqual(ID3(self.filename)["TIT2"].text, [u"title"])
+
+    def test_v23_not_reused(self):
+        tag = ID3(self.filename)
+        data = self.save(tag, v2_version=3)
+        self.assertFalse(self.TIT2 in data)
+        tag = ID3(self.filename)
+        self.assertEqual(tag.version, (2, 3, 0))
+        self.assertEqual(tag["TIT2"].text, [u"title"])
+        self.assertEqual(tag["TPE1"].text, [u"artist"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog  # noqa: E402
+from mutagen.id3 import ID3, TIT2, TRCK  # noqa: E402
+
+if sys.version_info[0] == 2:
+    try:
+        import mp3_tag_fixer
+    except ImportError:
+        # acoustid or musicbrainzngs is missing
+        mp3_tag_fixer = None
+    else:
+        import online_resources
+else:
+    # mp3_tag_fixer.py is written for Python 2
+    mp3_tag_fixer = None
+
+
+MP3_FRAMES = (b"\xff\xfb\x90\x64" + b"\x00" * 413) * 30
+
+
+def match_response(title):
+    return {"status": "ok", "results": [{
+        "score": 0.9,
+        "recordings": [{"title": title, "id": "recording-" + title,
+                        "artists": [{"name": u"Artist", "id": "artist"}]}],
+    }]}
+
+
+@unittest.skipIf(mp3_tag_fixer is None, "web service modules missing")
+class TOfflineQueue(unittest.TestCase):
+    """Albums queued by an offline run and resolved by `resolve_queue()`"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.artist_dir = os.path.join(self.dir, "in", "Artist")
+        self.album_dir = os.path.join(self.artist_dir, "Album")
+        os.makedirs(self.album_dir)
+        self.tagged = self.make_mp3("01 - Song.mp3", u"Song", u"1")
+        self.found = self.make_mp3("02.mp3")
+        self.missed = self.make_mp3("03.mp3")
+
+        self.saved = dict(
+            (name, getattr(mp3_tag_fixer, name)) for name in
+            ["log", "CONFIG_DATA", "CATALOG", "OFFLINE_FIRST", "DEVNULL"])
+        self.saved_run_fpcalc = online_resources._run_fpcalc
+        self.saved_lookup_batch = online_resources._acoustid_lookup_batch
+        mp3_tag_fixer.log = logging.getLogger("test")
+        mp3_tag_fixer.CONFIG_DATA = {
+            "acoustid_web_service": {"api_key": "key",
+                                     "result_threshold": 0.5},
+            "musicbrainz_web_service": {},
+            "output_directory_success": os.path.join(self.dir, "success"),
+            "output_directory_not_success": os.path.join(
+                self.dir, "not_success"),
+            "non_mp3_file_directory": os.path.join(self.dir, "non_mp3"),
+        }
+        mp3_tag_fixer.CATALOG = catalog.open_catalog(
+            os.path.join(self.dir, "catalog.sqlite"))
+        mp3_tag_fixer.OFFLINE_FIRST = True
+
+        self.fingerprinted = []
+        self.lookups = []
+        self.responses = {}
+        online_resources._run_fpcalc = self.run_fpcalc
+        online_resources._acoustid_lookup_batch = self.lookup_batch
+
+    def tearDown(self):
+        mp3_tag_fixer.CATALOG.close()
+        for name, value in self.saved.items():
+            setattr(mp3_tag_fixer, name, value)
+        online_resources._run_fpcalc = self.saved_run_fpcalc
+        online_resources._acoustid_lookup_batch = self.saved_lookup_batch
+        online_resources.FINGERPRINTS.clear()
+        online_resources.RESOLVED_MATCHES.clear()
+        shutil.rmtree(self.dir)
+
+    def make_mp3(self, name, title=None, track_number=None):
+        path = os.path.join(self.album_dir, name)
+        with open(path, "wb") as h:
+            h.write(MP3_FRAMES)
+        if title is not None:
+            tag = ID3()
+            tag.add(TIT2(encoding=3, text=title))
+            tag.add(TRCK(encoding=3, text=track_number))
+            tag.save(path)
+        return path
+
+    def run_fpcalc(self, paths):
+        self.fingerprinted.extend(paths)
+        return [(120, "fp " + os.path.basename(path)) for path in paths], \
+            0, False
+
+    def lookup_batch(self, api_key, items):
+        self.lookups.append(items)
+        if self.responses is None:
+            raise online_resources.WebServiceError("failed")
+        return [self.responses.get(fingerprint) for duration, fingerprint
+                in items]
+
+    def get_files(self):
+        return dict((row["path"], row) for row in
+                    mp3_tag_fixer.CATALOG.execute("SELECT * FROM files"))
+
+    def queue(self):
+        self.assertEqual(mp3_tag_fixer.process_and_move_album(
+            self.album_dir, self.artist_dir), catalog.ALBUM_RESULT_QUEUED)
+
+    def resolve(self):
+        mp3_tag_fixer.OFFLINE_FIRST = False
+        mp3_tag_fixer.resolve_queue()
+
+    def test_queued(self):
+        self.assertEqual(
+            mp3_tag_fixer.process_album_directory(self.album_dir), None)
+        album, = catalog.get_queued_albums(mp3_tag_fixer.CATALOG)
+        self.assertEqual(album["album_dir"], self.album_dir)
+        queued = catalog.get_queued_files(mp3_tag_fixer.CATALOG,
+                                          self.album_dir)
+        self.assertEqual([(f["path"], f["duration"], f["fingerprint"])
+                          for f in queued],
+                         [(self.found, 120, "fp 02.mp3"),
+                          (self.missed, 120, "fp 03.mp3")])
+        # the tags of the files resolved locally are pending, but already
+        # recorded in the catalog
+        self.assertEqual(self.get_files()[self.tagged]["title"], u"Song")
+        self.assertEqual(self.lookups, [])
+
+    def test_queued_album_written_in_place(self):
+        self.queue()
+        self.assertTrue(os.path.isdir(self.album_dir))
+        self.assertEqual(ID3(self.tagged)["TPE1"].text, [u"Artist"])
+        # the catalog has the stat values after writing the tags
+        files = self.get_files()
+        for path in [self.tagged, self.found, self.missed]:
+            self.assertEqual(files[path]["size"], os.path.getsize(path))
+            self.assertEqual(files[path]["mtime"], os.path.getmtime(path))
+        self.assertEqual(catalog.get_queued_albums(mp3_tag_fixer.CATALOG)[0]
+                         ["album_dir"], self.album_dir)
+
+    def test_resolved(self):
+        self.queue()
+        self.responses = {"fp 02.mp3": match_response(u"Found")}
+        del self.fingerprinted[:]
+        self.resolve()
+
+        # the queued fingerprints were reused, all in a single request
+        self.assertEqual(self.fingerprinted, [])
+        self.assertEqual(self.lookups, [[(120, "fp 02.mp3"),
+                                         (120, "fp 03.mp3")]])
+        self.assertEqual(catalog.get_queued_albums(mp3_tag_fixer.CATALOG),
+                         [])
+        # a miss is final, the album isn't queued again
+        new_album_dir = os.path.join(self.dir, "not_success", "Artist",
+                                     "Album")
+        album, = catalog.get_albums(mp3_tag_fixer.CATALOG)
+        self.assertEqual((album["album_dir"], album["result"]),
+                         (new_album_dir, catalog.ALBUM_RESULT_NOT_SUCCESS))
+        self.assertFalse(os.path.exists(self.artist_dir))
+        files = self.get_files()
+        found = os.path.join(new_album_dir, "02 - Found.mp3")
+        self.assertEqual(ID3(found)["TIT2"].text, [u"Found"])
+        self.assertEqual(files[found]["result"], catalog.FILE_RESULT_TAGGED)
+        self.assertEqual(files[found]["recording_mbid"], "recording-Found")
+        missed = os.path.join(new_album_dir, "03.mp3")
+        self.assertEqual(files[missed]["result"],
+                         catalog.FILE_RESULT_UNRESOLVED)
+        self.assertEqual(online_resources.RESOLVED_MATCHES, {})
+
+    def test_resolved_all(self):
+        self.queue()
+        self.responses = {"fp 02.mp3": match_response(u"Found"),
+                          "fp 03.mp3": match_response(u"Other")}
+        self.resolve()
+        album, = catalog.get_albums(mp3_tag_fixer.CATALOG)
+        self.assertEqual(album["result"], catalog.ALBUM_RESULT_SUCCESS)
+        self.assertEqual(album["album_dir"], os.path.join(
+            self.dir, "success", "Artist", "Album"))
+
+    def test_modified_file_fingerprinted_again(self):
+        self.queue()
+        with open(self.found, "ab") as h:
+            h.write(MP3_FRAMES)
+        del self.fingerprinted[:]
+        self.resolve()
+        self.assertEqual(self.fingerprinted, [self.found])
+
+    def test_lookup_failed(self):
+        self.queue()
+        files = self.get_files()
+        self.responses = None
+        self.resolve()
+        # nothing changed, the album stays queued for the next run
+        self.assertEqual(len(self.lookups), 1)
+        self.assertTrue(os.path.isdir(self.album_dir))
+        album, = catalog.get_queued_albums(mp3_tag_fixer.CATALOG)
+        self.assertEqual(album["album_dir"], self.album_dir)
+        self.assertEqual(
+            [f["path"] for f in catalog.get_queued_files(
+                mp3_tag_fixer.CATALOG, self.album_dir)],
+            [self.found, self.missed])
+        self.assertEqual(sorted(self.get_files()), sorted(files))
+        self.assertEqual(online_resources.FINGERPRINTS, {})
+        self.assertEqual(online_resources.RESOLVED_MATCHES, {})
+
+        # and gets resolved by it
+        self.responses = {}
+        self.resolve()
+        self.assertEqual(catalog.get_queued_albums(mp3_tag_fixer.CATALOG),
+                         [])
+
+    def test_missing_album_dir_skipped(self):
+        self.queue()
+        shutil.rmtree(self.album_dir)
+        self.resolve()
+        self.assertEqual(self.lookups, [])
+        self.assertEqual(len(catalog.get_queued_albums(
+            mp3_tag_fixer.CATALOG)), 1)
+
+    def test_queued_album_skipped_offline(self):
+        self.queue()
+        mp3_tag_fixer.CONFIG_DATA["root_directories"] = [
+            os.path.join(self.dir, "in")]
+        mp3_tag_fixer.CONFIG_DATA["scheduler"] = {"network_workers": 1}
+        del self.fingerprinted[:]
+        mp3_tag_fixer.process_root_directories()
+        self.assertEqual(self.fingerprinted, [])
+        self.assertTrue(os.path.isdir(self.album_dir))
+        self.assertEqual(len(catalog.get_queued_albums(
+            mp3_tag_fixer.CATALOG)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from mutagen.mp4 import MP4, MP4SaveStrategy, Atoms
+from mutagen.mp4 import _util
+
+
+CHUNK = 1000
+
+
+def atom(name, data=b""):
+    return struct.pack(">I4s", len(data) + 8, name) + data
+
+
+def full_atom(name, data, version=0, flags=0):
+    return atom(name, struct.pack(">I", (version << 24) | flags) + data)
+
+
+def offset_table(name, offsets):
+    fmt = ">I" if name == b"stco" else ">Q"
+    return full_atom(name, struct.pack(">I", len(offsets)) +
+                     b"".join(struct.pack(fmt, o) for o in offsets))
+
+
+def make_moov(table, offsets, title):
+    mdhd = full_atom(b"mdhd", struct.pack(">IIII", 0, 0, 44100, 0) + b"\0" * 4)
+    hdlr = full_atom(b"hdlr", b"\0" * 4 + b"soun" + b"\0" * 13)
+    stbl = atom(b"stbl", offset_table(table, offsets))
+    trak = atom(b"trak", atom(b"mdia", mdhd + hdlr + atom(
+        b"minf", stbl)))
+    item = atom(b"\xa9nam", atom(
+        b"data", struct.pack(">II", 1, 0) + title.encode("utf-8")))
+    meta = full_atom(b"meta", full_atom(
+        b"hdlr", b"\0" * 4 + b"mdirappl" + b"\0" * 9) + atom(b"ilst", item))
+    return atom(b"moov", trak + atom(b"udta", meta))
+
+
+def make_fragments(start, count):
+    """moof/mdat pairs starting at `start`, the tfhd base offsets pointing
+    to the chunk in the mdat following them"""
+
+    data = b""
+    for i in range(count):
+        offset = start + len(data)
+        moof_size = 8 + 16 + 8 + 24 + 16
+        tfhd = full_atom(
+            b"tfhd", struct.pack(">IQ", 1, offset + moof_size + 8), flags=1)
+        moof = atom(b"moof", full_atom(b"mfhd", struct.pack(">I", i)) +
+                    atom(b"traf", tfhd + full_atom(b"trun", b"\0" * 4)))
+        assert len(moof) == moof_size
+        data += moof + atom(b"mdat", chunk_data(100 + i))
+    return data
+
+
+def chunk_data(index):
+    return (b"chunk%04d" % index).ljust(CHUNK, b".")
+
+
+def make_file(filename, table=b"stco", chunks=4, free=0, moov_first=True,
+              fragments=0, mfra=False, base=0, title=u"t"):
+    """Writes an MP4 file with `chunks` chunks in one mdat atom, and the
+    offsets of the chunks in the `table` ('stco' or 'co64') atom.
+
+    `base` gets added to the file offsets in the table, for testing large
+    values. The chunk data doesn't exist then.
+    """
+
+    ftyp = atom(b"ftyp", b"M4A \0\0\0\0")
+    mdat = atom(b"mdat", b"".join(chunk_data(i) for i in range(chunks)))
+    moov = make_moov(table, [0] * chunks, title)
+    top_free = atom(b"free", b"\0" * (free - 8)) if free else b""
+    if moov_first:
+        mdat_offset = len(ftyp + moov + top_free)
+    else:
+        mdat_offset = len(ftyp)
+    offsets = [base + mdat_offset + 8 + i * CHUNK for i in range(chunks)]
+    moov = make_moov(table, offsets, title)
+    if moov_first:
+        data = ftyp + moov + top_free + mdat
+    else:
+        data = ftyp + mdat + moov + top_free
+    data += make_fragments(len(data), fragments)
+    if mfra:
+        data += atom(b"mfra", full_atom(b"mfro", struct.pack(">I", 16)))
+    with open(filename, "wb") as h:
+        h.write(data)
+
+
+def read_offsets(filename):
+    """Returns the values of all stco/co64 tables and tfhd base offsets"""
+
+    with open(filename, "rb") as h:
+        atoms = Atoms(h)
+        offsets = []
+        tables = [(b"stco", ">I", 4), (b"co64", ">Q", 8)]
+        for name, fmt, size in tables:
+            for table in atoms[b"moov"].findall(name, True):
+                h.seek(table.offset + 12)
+                count, = struct.unpack(">I", h.read(4))
+                offsets.extend(struct.unpack(
+                    ">%d%s" % (count, fmt[1]), h.read(count * size)))
+        for moof in atoms.findall(b"moof"):
+            for tfhd in moof.findall(b"tfhd", True):
+                h.seek(tfhd.offset + 16)
+                offsets.extend(struct.unpack(">Q", h.read(8)))
+        return offsets
+
+
+def read_chunks(filename):
+    with open(filename, "rb") as h:
+        data = h.read()
+    return [data[o:o + 9] for o in read_offsets(filename)]
+
+
+class TMP4Save(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.m4a")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def save_title(self, title, **kwargs):
+        audio = MP4(self.filename)
+        audio["\xa9nam"] = [title]
+        info = audio.save(padding=lambda info: 0, **kwargs)
+        self.assertEqual(MP4(self.filename)["\xa9nam"], [title])
+        return info
+
+    def assertChunks(self, chunks, fragments=0):
+        self.assertEqual(
+            read_chunks(self.filename),
+            [b"chunk%04d" % i for i in range(chunks)] +
+            [b"chunk%04d" % (100 + i) for i in range(fragments)])
+
+    def test_replace_grow(self):
+        make_file(self.filename)
+        before = read_offsets(self.filename)
+        info = self.save_title(u"x" * 500)
+        self.assertEqual(info.strategy, MP4SaveStrategy.IN_PLACE)
+        self.assertEqual(info.offset_tables, 1)
+        self.assertEqual(info.offset_entries, 4)
+        after = read_offsets(self.filename)
+        self.assertEqual(len(set(a - b for a, b in zip(after, before))), 1)
+        self.assertTrue(after[0] > before[0])
+        self.assertChunks(4)
+
+    def test_replace_shrink(self):
+        make_file(self.filename, title=u"x" * 500)
+        info = self.save_title(u"y")
+        self.assertEqual(info.offset_entries, 4)
+        self.assertChunks(4)
+
+    def test_replace_co64(self):
+        make_file(self.filename, table=b"co64")
+        info = self.save_title(u"x" * 500)
+        self.assertEqual(info.offset_entries, 4)
+        self.assertChunks(4)
+
+    def test_replace_moov_last(self):
+        make_file(self.filename, moov_first=False)
+        before = read_offsets(self.filename)
+        info = self.save_title(u"x" * 500)
+        self.assertEqual(info.offset_entries, 0)
+        self.assertEqual(read_offsets(self.filename), before)
+        self.assertChunks(4)
+
+    def test_resize_free(self):
+        make_file(self.filename, free=1000)
+        before = read_offsets(self.filename)
+        size = os.path.getsize(self.filename)
+        info = self.save_title(u"x" * 500)
+        self.assertEqual(info.strategy, MP4SaveStrategy.IN_PLACE)
+        self.assertEqual(info.offset_tables, 0)
+        self.assertEqual(read_offsets(self.filename), before)
+        self.assertEqual(os.path.getsize(self.filename), size)
+        self.assertChunks(4)
+
+    def test_resize_free_too_small(self):
+        make_file(self.filename, free=100)
+        info = self.save_title(u"x" * 500)
+        self.assertEqual(info.offset_entries, 4)
+        self.assertChunks(4)
+
+    def test_move_moov(self):
+        make_file(self.filename)
+        before = read_offsets(self.filename)
+        info = self.save_title(
+            u"x" * 500, strategy=MP4SaveStrategy.MOVE_MOOV)
+        self.assertEqual(info.strategy, MP4SaveStrategy.MOVE_MOOV)
+        self.assertEqual(read_offsets(self.filename), before)
+        with open(self.filename, "rb") as h:
+            names = [a.name for a in Atoms(h).atoms]
+        self.assertEqual(names, [b"ftyp", b"free", b"mdat", b"moov"])
+        self.assertChunks(4)
+        # the moved moov atom is the last one now, so saving again in place
+        # doesn't need to move anything
+        info = self.save_title(u"y" * 1000)
+        self.assertEqual(info.offset_entries, 0)
+        self.assertChunks(4)
+
+    def test_move_moov_shrink(self):
+        make_file(self.filename, title=u"x" * 500)
+        info = self.save_title(u"y", strategy=MP4SaveStrategy.MOVE_MOOV)
+        self.assertEqual(info.strategy, MP4SaveStrategy.IN_PLACE)
+        self.assertChunks(4)
+
+    def test_auto_moves_fewer_bytes(self):
+        make_file(self.filename, chunks=100)
+        info = self.save_title(u"x" * 500, strategy=MP4SaveStrategy.AUTO)
+        self.assertEqual(info.strategy, MP4SaveStrategy.MOVE_MOOV)
+        self.assertChunks(100)
+
+        # moving the empty mdat atom is cheaper than the rest of moov
+        make_file(self.filename, chunks=0)
+        info = self.save_title(u"x" * 500, strategy=MP4SaveStrategy.AUTO)
+        self.assertEqual(info.strategy, MP4SaveStrategy.IN_PLACE)
+
+    def test_auto_uses_free(self):
+        make_file(self.filename, chunks=100, free=1000)
+        info = self.save_title(u"x" * 500, strategy=MP4SaveStrategy.AUTO)
+        self.assertEqual(info.strategy, MP4SaveStrategy.IN_PLACE)
+        self.assertEqual(info.offset_tables, 0)
+        self.assertChunks(100)
+
+    def test_fragmented_no_move_moov(self):
+        for name, kwargs in [("moof", {}), ("mfra", {"mfra": True})]:
+            make_file(self.filename, fragments=3, **kwargs)
+            for strategy in [MP4SaveStrategy.MOVE_MOOV, MP4SaveStrategy.AUTO]:
+                info = self.save_title(u"x" * 500, strategy=strategy)
+                self.assertEqual(info.strategy, MP4SaveStrategy.IN_PLACE)
+                self.assertChunks(4, fragments=3)
+            with open(self.filename, "rb") as h:
+                self.assertEqual(Atoms(h).atoms[1].name, b"moov")
+
+    def test_mfra_only_no_move_moov(self):
+        make_file(self.filename, mfra=True)
+        info = self.save_title(
+            u"x" * 500, strategy=MP4SaveStrategy.MOVE_MOOV)
+        self.assertEqual(info.strategy, MP4SaveStrategy.IN_PLACE)
+        with open(self.filename, "rb") as h:
+            self.assertEqual(Atoms(h).last().name, b"mfra")
+        self.assertChunks(4)
+
+    def test_tfhd(self):
+        make_file(self.filename, fragments=3)
+        before = read_offsets(self.filename)
+        info = self.save_title(u"x" * 500)
+        self.assertEqual(info.offset_tables, 4)
+        self.assertEqual(info.offset_entries, 7)
+        after = read_offsets(self.filename)
+        self.assertEqual(len(set(a - b for a, b in zip(after, before))), 1)
+        self.assertChunks(4, fragments=3)
+
+    def test_co64_large_offsets(self):
+        # offsets beyond 4GB, which only fit into co64
+        make_file(self.filename, table=b"co64", base=2 ** 33)
+        before = read_offsets(self.filename)
+        self.save_title(u"x" * 500)
+        after = read_offsets(self.filename)
+        self.assertTrue(all(a > b for a, b in zip(after, before)))
+        self.assertTrue(all(a > 2 ** 33 for a in after))
+
+
+class TShiftOffsets(unittest.TestCase):
+
+    def shift(self, values, size, delta, offset):
+        fmt = ">%d%s" % (len(values), "IQ"[size // 8])
+        data = struct.pack(fmt, *values)
+        results = []
+        numpy = _util.numpy
+        try:
+            for module in set([None, numpy]):
+                _util.numpy = module
+                new_data, changed = _util.shift_offsets(
+                    data, size, delta, offset)
+                results.append(
+                    (list(struct.unpack(fmt, new_data)), changed))
+        finally:
+            _util.numpy = numpy
+        # the same with and without numpy
+        self.assertEqual(len(set(repr(r) for r in results)), 1)
+        return results[0]
+
+    def test_shift(self):
+        for size in [4, 8]:
+            self.assertEqual(self.shift([10, 20, 30], size, 5, 15),
+                             ([10, 25, 35], 2))
+            self.assertEqual(self.shift([10, 20, 30], size, -5, 15),
+                             ([10, 15, 25], 2))
+            self.assertEqual(self.shift([30, 10, 20], size, 5, 15),
+                             ([35, 10, 25], 2))
+            self.assertEqual(self.shift([10, 20], size, 5, 100),
+                             ([10, 20], 0))
+            self.assertEqual(self.shift([], size, 5, 0), ([], 0))
+
+    def test_stco_overflow(self):
+        self.assertEqual(self.shift([2 ** 32 - 6], 4, 5, 0),
+                         ([2 ** 32 - 1], 1))
+        self.assertRaises(struct.error, self.shift, [2 ** 32 - 5], 4, 5, 0)
+        self.assertRaises(struct.error, self.shift, [10, 20], 4, -15, 5)
+        # values which don't get shifted can't overflow
+        self.assertEqual(self.shift([2 ** 32 - 1, 20], 4, 5, 2 ** 32 - 1),
+                         ([2 ** 32 - 1, 20], 0))
+
+    def test_co64_overflow(self):
+        self.assertEqual(self.shift([2 ** 32 - 1], 8, 5, 0),
+                         ([2 ** 32 + 4], 1))
+        self.assertEqual(self.shift([2 ** 64 - 6], 8, 5, 0),
+                         ([2 ** 64 - 1], 1))
+        self.assertRaises(struct.error, self.shift, [2 ** 64 - 5], 8, 5, 0)
+        self.assertRaises(struct.error, self.shift, [10, 20], 8, -15, 5)
+
+    def test_trailing_bytes(self):
+        data, changed = _util.shift_offsets(
+            struct.pack(">II", 10, 20) + b"\x00", 4, 1, 0)
+        self.assertEqual(data, struct.pack(">II", 11, 21))
+        self.assertEqual(changed, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
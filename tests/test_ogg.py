@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from mutagen.ogg import OggPage, OggPaddingInfo
+
+
+def _info(old_pages, comment_size):
+    packets = OggPage.to_packets(old_pages)
+    padding_left = len(packets[0]) - comment_size
+    return OggPaddingInfo(padding_left, 100000, comment_size, packets,
+                          old_pages)
+
+
+class TOggPageLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.setup = b"s" * 3000
+        self.old_pages = OggPage.from_packets([b"c" * 500, self.setup])
+
+    def new_pages(self, info):
+        packet = b"c" * info.packet_size
+        padding = info.get_page_aligned_padding()
+        packets = [packet + b"\x00" * padding, self.setup]
+        new_pages = OggPage._from_packets_keep_pages(packets, self.old_pages)
+        self.assertEqual(OggPage.to_packets(new_pages), packets)
+        return new_pages
+
+    def test_same_size(self):
+        info = _info(self.old_pages, 500)
+        self.assertEqual(info.get_page_aligned_padding(), 0)
+        new_pages = self.new_pages(info)
+        self.assertEqual(new_pages,
+                         OggPage._from_packets_try_preserve(
+                             OggPage.to_packets(self.old_pages),
+                             self.old_pages))
+
+    def test_grow_fits(self):
+        # still fits into the old pages, so no extra padding is needed
+        info = _info(self.old_pages, 2000)
+        self.assertEqual(info.get_page_aligned_padding(),
+                         info.get_default_padding())
+        self.assertEqual(len(self.new_pages(info)), len(self.old_pages))
+
+    def test_grow_too_large(self):
+        # needs new pages, the comment packet fills all of its pages
+        info = _info(self.old_pages, 100000)
+        padding = info.get_page_aligned_padding()
+        self.assertTrue(padding >= info.get_default_padding())
+        self.assertEqual((info.packet_size + padding) %
+                         OggPage._PAGE_DATA_SIZE, 0)
+        new_pages = self.new_pages(info)
+        comment_pages = (info.packet_size + padding) // \
+            OggPage._PAGE_DATA_SIZE
+        for page in new_pages[:comment_pages]:
+            self.assertEqual([len(p) for p in page.packets],
+                             [OggPage._PAGE_DATA_SIZE])
+        self.assertFalse(new_pages[comment_pages].continued)
+        self.assertEqual(new_pages[comment_pages].packets[0], self.setup)
+
+    def test_try_preserve_falls_back(self):
+        packets = [b"c" * 2000, self.setup]
+        self.assertEqual(
+            OggPage._from_packets_try_preserve(packets, self.old_pages),
+            OggPage.from_packets(packets, self.old_pages[0].sequence))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_transport import HTTPTransport, httplib  # noqa: E402
+from test_http_transport import FakeServer, FakeResponse  # noqa: E402
+
+try:
+    import online_resources
+except ImportError:
+    # acoustid or musicbrainzngs is missing
+    online_resources = None
+else:
+    import musicbrainzngs
+
+try:
+    from urllib2 import Request
+except ImportError:
+    from urllib.request import Request
+
+
+log = logging.getLogger("test")
+
+
+@unittest.skipIf(online_resources is None, "web service modules missing")
+class TMusicbrainzSafeRead(unittest.TestCase):
+
+    def setUp(self):
+        self.module = musicbrainzngs.musicbrainz
+        self.original = self.module._safe_read
+        self.server = FakeServer()
+
+    def tearDown(self):
+        online_resources.close_http_transport()
+        self.module._safe_read = self.original
+
+    def set_up(self):
+        online_resources.set_up_http_transport(
+            {}, log, HTTPTransport(connection_factory=self.server))
+
+    def test_patched_and_restored(self):
+        self.set_up()
+        self.assertTrue(
+            self.module._safe_read is online_resources._musicbrainz_safe_read)
+        online_resources.close_http_transport()
+        self.assertTrue(self.module._safe_read is self.original)
+
+    def test_request(self):
+        self.set_up()
+        request = Request("https://musicbrainz.org/ws/2/artist/x",
+                          headers={"User-Agent": "test"})
+        self.assertEqual(self.module._safe_read(None, request), b"body")
+        connection, = self.server.connections
+        method, path, body, headers = connection.requests[0]
+        self.assertEqual((method, path), ("GET", "/ws/2/artist/x"))
+        self.assertEqual(headers["User-agent"], "test")
+
+    def test_retried(self):
+        self.set_up()
+        self.server.responses = [
+            httplib.HTTPException("failed"),
+            FakeResponse(b"gzip?", [("Content-Encoding", "gzip")]),
+            FakeResponse(b"", status=503),
+        ]
+        request = Request("https://musicbrainz.org/ws/2/artist/x")
+        self.assertEqual(
+            self.module._safe_read(None, request, retry_delay_delta=0),
+            b"body")
+        self.assertEqual(len(self.server.responses), 0)
+
+    def test_not_found(self):
+        self.set_up()
+        self.server.responses = [FakeResponse(b"", status=404)]
+        request = Request("https://musicbrainz.org/ws/2/artist/x")
+        self.assertRaises(musicbrainzngs.ResponseError,
+                          self.module._safe_read, None, request)
+
+    def test_unknown_version(self):
+        del self.module._safe_read
+        try:
+            self.set_up()
+            self.assertFalse(hasattr(self.module, "_safe_read"))
+            online_resources.close_http_transport()
+            self.assertFalse(hasattr(self.module, "_safe_read"))
+        finally:
+            self.module._safe_read = self.original
+
+    def test_fallback_without_transport(self):
+        calls = []
+        online_resources._original_musicbrainz_safe_read, original = \
+            lambda *args: calls.append(args) or b"original", \
+            online_resources._original_musicbrainz_safe_read
+        try:
+            self.assertEqual(online_resources._musicbrainz_safe_read(
+                "opener", "request"), b"original")
+        finally:
+            online_resources._original_musicbrainz_safe_read = original
+        self.assertEqual(calls, [("opener", "request", None, 8, 2.0)])
+
+
+@unittest.skipIf(online_resources is None or online_resources.fcntl is None,
+                 "web service modules or fcntl missing")
+class TRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.dir, "test.ratelimit")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def limiter(self, requests_per_second=20.0, burst=1):
+        return online_resources.RateLimiter(
+            self.state_path, requests_per_second, burst)
+
+    def read_state(self):
+        with open(self.state_path, "rb") as h:
+            return [float(v) for v in h.read().split()]
+
+    def timed_waits(self, limiters, count):
+        """Calls `wait()` `count` times per limiter, each limiter in its own
+        thread, returns the sorted times at which the waits returned.
+        """
+        times = []
+
+        def run(limiter):
+            for i in range(count):
+                limiter.wait()
+                times.append(time.time())
+
+        threads = [threading.Thread(target=run, args=(limiter,))
+                   for limiter in limiters]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        return sorted(times)
+
+    def test_single(self):
+        start = time.time()
+        times = self.timed_waits([self.limiter()], 5)
+        self.assertTrue(times[-1] - start >= 4 * 0.05 - 0.01)
+        tat, written_at = self.read_state()
+        self.assertTrue(tat > written_at)
+
+    def test_shared_state_file(self):
+        # the limiters only share the state file, like separate processes
+        limiters = [self.limiter(), self.limiter()]
+        start = time.time()
+        times = self.timed_waits(limiters, 5)
+        self.assertEqual(len(times), 10)
+        # the combined rate is still 20 per second
+        self.assertTrue(times[-1] - start >= 9 * 0.05 - 0.01)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        self.assertTrue(min(gaps) > 0.05 / 2, gaps)
+
+    def test_shared_burst(self):
+        limiters = [self.limiter(burst=3), self.limiter(burst=3)]
+        start = time.time()
+        times = self.timed_waits(limiters, 2)
+        # three requests right away, one more after an interval
+        self.assertTrue(times[2] - start < 0.05 / 2)
+        self.assertTrue(times[3] - start >= 0.05 - 0.01)
+
+    def test_separate_state_files(self):
+        other = online_resources.RateLimiter(
+            os.path.join(self.dir, "other.ratelimit"), 20.0, 1)
+        start = time.time()
+        times = self.timed_waits([self.limiter(), other], 5)
+        self.assertTrue(times[-1] - start < 9 * 0.05 - 0.01)
+
+    def test_corrupt_state_file(self):
+        for data in [b"", b"garbage", b"1 2 3", b"nan nan", b"inf 0",
+                     b"0 inf", b"\xff\x00"]:
+            with open(self.state_path, "wb") as h:
+                h.write(data)
+            start = time.time()
+            self.limiter().wait()
+            self.assertTrue(time.time() - start < 0.05 / 2, data)
+            tat, written_at = self.read_state()
+            self.assertTrue(start <= written_at <= tat <= start + 1.0, data)
+
+    def test_state_written_in_the_future(self):
+        with open(self.state_path, "wb") as h:
+            h.write(("%r %r" % (time.time() + 3600,
+                                time.time() + 3600)).encode("ascii"))
+        start = time.time()
+        self.limiter().wait()
+        self.assertTrue(time.time() - start < 0.05 / 2)
+
+    def test_unwritable_state_file(self):
+        self.state_path = os.path.join(self.dir, "missing", "test.ratelimit")
+        start = time.time()
+        times = self.timed_waits([self.limiter()], 5)
+        # falls back to limiting per process
+        self.assertTrue(times[-1] - start >= 4 * 0.05 - 0.01)
+        self.assertFalse(os.path.exists(self.state_path))
+
+
+if __name__ == "__main__":
+    unittest.main()